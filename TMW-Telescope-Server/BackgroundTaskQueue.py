@@ -1,55 +1,259 @@
-from queue import Queue
-
-import cherrypy
-
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import itertools
+import queue
 import threading
+import time
+import uuid
 
 from cherrypy.process.plugins import SimplePlugin
 
+from Metrics import task_run, task_wait
+
+# Prioritäten: kleinere Zahl wird zuerst ausgeführt
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
 
 class BackgroundTaskQueue(SimplePlugin):
-    thread = None
+    """
+    Die Klasse BackgroundTaskQueue ermöglicht die Funktionalität von Rückantworten nach Abschluss einer Aktion.
+    http://tools.cherrypy.org/wiki/BackgroundTaskQueue
+
+    Mehrere Worker-Threads arbeiten die Aufgaben nach Priorität ab. Aufgaben
+    derselben Spur (lane, z.B. 'mount', 'camera', 'guider') laufen nacheinander
+    in Einreihungsreihenfolge, Aufgaben verschiedener Spuren parallel.
 
-    def __init__(self, bus, qsize=100, qwait=2, safe_stop=True):
+    Jede Aufgabe erhält eine ID. Zustand, Zeiten, Ergebnis und Fehler bleiben
+    nach dem Ende noch 'result_ttl' Sekunden abrufbar (höchstens 'max_results' Aufgaben).
+    """
+
+    def __init__(self, bus, qsize=100, qwait=2, safe_stop=True, workers=4, max_results=1000, result_ttl=3600):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param qsize: Maximale Anzahl wartender Aufgaben.
+        :param qwait: Wartezeit der Worker in Sekunden, bevor der Zustand erneut geprüft wird.
+        :param safe_stop: Beim Beenden noch wartende Aufgaben abarbeiten.
+        :param workers: Anzahl der Worker-Threads.
+        :param max_results: Maximale Anzahl gespeicherter Aufgaben.
+        :param result_ttl: Aufbewahrungszeit beendeter Aufgaben in Sekunden.
+        """
         SimplePlugin.__init__(self, bus)
-        self.q = Queue.Queue(qsize)
+        self.qsize = qsize
         self.qwait = qwait
         self.safe_stop = safe_stop
+        self.workers = workers
+        self.max_results = max_results
+        self.result_ttl = result_ttl
+        self.threads = []
+        self.running = False
+        self.jobs = []
+        self.results = OrderedDict()
+        self.busy_lanes = set()
+        self.active = 0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0,
+                      'wait_total': 0.0, 'wait_max': 0.0, 'run_total': 0.0, 'run_max': 0.0}
 
     def start(self):
         self.running = True
-        if not self.thread:
-            self.thread = threading.Thread(target=self.run)
-            self.thread.start()
+        with self.cond:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.run)
+                thread.start()
+                self.threads.append(thread)
 
     def stop(self):
-        if self.safe_stop:
-            self.running = "draining"
-        else:
-            self.running = False
-
-        if self.thread:
-            self.thread.join()
-            self.thread = None
+        with self.cond:
+            if self.safe_stop:
+                self.running = "draining"
+            else:
+                self.running = False
+            self.cond.notify_all()
+
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
         self.running = False
 
+    def _next_job(self):
+        """
+        Sucht die Aufgabe mit der höchsten Priorität, deren Spur gerade frei ist.
+        Muss mit gehaltenem self.cond aufgerufen werden.
+        :return: Aufgabe oder None
+        """
+        best = None
+        for job in self.jobs:
+            if job['lane'] is not None and job['lane'] in self.busy_lanes:
+                continue
+            if best is None or (job['priority'], job['seq']) < (best['priority'], best['seq']):
+                best = job
+        if best is not None:
+            self.jobs.remove(best)
+        return best
+
     def run(self):
-        while self.running:
-            try:
-                try:
-                    func, args, kwargs = self.q.get(block=True, timeout=self.qwait)
-                except Queue.Empty:
-                    if self.running == "draining":
+        while True:
+            with self.cond:
+                job = self._next_job()
+                while job is None:
+                    if not self.running or (self.running == "draining" and not self.jobs):
                         return
-                    continue
-                else:
-                    func(*args, **kwargs)
-                    if hasattr(self.q, 'task_done'):
-                        self.q.task_done()
-            except:
+                    self.cond.wait(self.qwait)
+                    job = self._next_job()
+                if job['lane'] is not None:
+                    self.busy_lanes.add(job['lane'])
+                self.active += 1
+                job['state'] = 'running'
+                job['started'] = time.time()
+
+            started = job['started']
+            failed = False
+            try:
+                job['result'] = job['func'](*job['args'], **job['kwargs'])
+            except Exception as e:
+                failed = True
+                job['error'] = str(e)
                 self.bus.log("Error in BackgroundTaskQueue %r." % self,
                              level=40, traceback=True)
+            finished = time.time()
+
+            with self.cond:
+                job['state'] = 'failed' if failed else 'done'
+                job['finished'] = finished
+                if job['lane'] is not None:
+                    self.busy_lanes.discard(job['lane'])
+                self.active -= 1
+                wait = started - job['queued']
+                run = finished - started
+                self.stats['failed' if failed else 'completed'] += 1
+                self.stats['wait_total'] += wait
+                self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+                self.stats['run_total'] += run
+                self.stats['run_max'] = max(self.stats['run_max'], run)
+                task_wait.observe(wait, job['lane'] or '')
+                task_run.observe(run, job['lane'] or '')
+                # Die Spur ist wieder frei, wartende Worker wecken
+                self.cond.notify_all()
+
+    def submit(self, func, args=(), kwargs=None, lane=None, priority=PRIORITY_NORMAL):
+        """
+        Reiht eine Aufgabe ein, ohne zu blockieren.
+        :param func: Auszuführende Funktion
+        :param args: Positionsargumente für func
+        :param kwargs: Schlüsselwortargumente für func
+        :param lane: Spur, in der die Aufgabe nacheinander mit anderen ausgeführt wird (None = keine).
+        :param priority: Priorität, z.B. PRIORITY_HIGH für Parken/Abbrechen.
+        :return: ID der Aufgabe
+        :raises queue.Full: wenn die Warteschlange voll ist.
+        """
+        with self.cond:
+            if len(self.jobs) >= self.qsize:
+                self.stats['rejected'] += 1
+                raise queue.Full("Warteschlange voll (%d Aufgaben)" % len(self.jobs))
+            job = {'id': uuid.uuid4().hex, 'name': getattr(func, '__name__', str(func)),
+                   'func': func, 'args': args, 'kwargs': kwargs or {}, 'lane': lane,
+                   'priority': priority, 'seq': next(self.seq), 'state': 'queued',
+                   'queued': time.time(), 'started': None, 'finished': None,
+                   'result': None, 'error': None}
+            self.jobs.append(job)
+            self._evict()
+            self.results[job['id']] = job
+            self.stats['submitted'] += 1
+            self.cond.notify()
+            return job['id']
+
+    def wait(self, job_id, abort=None):
+        """
+        Wartet auf das Ende einer Aufgabe, z.B. wenn ein Sequenz-Schritt dieselbe
+        Spur wie die Routen nutzt und daher nicht direkt ausgeführt werden darf.
+        :param job_id: ID der Aufgabe
+        :param abort: Optional threading.Event; ist es gesetzt, solange die Aufgabe noch
+                      wartet, wird sie verworfen. Eine laufende Aufgabe muss es selbst prüfen.
+        :return: Zustand der Aufgabe wie job(), None wenn unbekannt.
+        """
+        with self.cond:
+            job = self.results.get(job_id)
+            while job is not None and job['finished'] is None:
+                if abort is not None and abort.is_set() and job['state'] == 'queued':
+                    self.jobs.remove(job)
+                    job['state'] = 'cancelled'
+                    job['finished'] = time.time()
+                    break
+                self.cond.wait(self.qwait)
+            return self._job_info(job) if job is not None else None
 
     def put(self, func, *args, **kwargs):
-        """Schedule the given func to be run."""
-        self.q.put((func, args, kwargs))
\ No newline at end of file
+        """Schedule the given func to be run. Returns the job id."""
+        return self.submit(func, args, kwargs)
+
+    def _evict(self):
+        """
+        Entfernt abgelaufene Aufgaben und bei Überschreitung von max_results die ältesten
+        beendeten. Muss mit gehaltenem self.cond aufgerufen werden.
+        :return:
+        """
+        now = time.time()
+        for job_id in list(self.results):
+            job = self.results[job_id]
+            if job['finished'] is not None and now - job['finished'] > self.result_ttl:
+                del self.results[job_id]
+        if len(self.results) >= self.max_results:
+            for job_id in list(self.results):
+                if len(self.results) < self.max_results:
+                    break
+                if self.results[job_id]['finished'] is not None:
+                    del self.results[job_id]
+
+    @staticmethod
+    def _job_info(job):
+        """
+        :param job: Interne Aufgabe
+        :return: JSON-fähige Beschreibung der Aufgabe.
+        """
+        info = dict((k, job[k]) for k in ('id', 'name', 'lane', 'priority', 'state', 'queued',
+                                          'started', 'finished', 'result', 'error'))
+        info['wait'] = (job['started'] or job['finished'] or time.time()) - job['queued']
+        # Verworfene Aufgaben ('cancelled') sind nie gelaufen
+        info['duration'] = job['finished'] - job['started'] if job['started'] and job['finished'] else None
+        return info
+
+    def job(self, job_id):
+        """
+        Zustand einer Aufgabe.
+        :param job_id: ID der Aufgabe
+        :return: Dict mit Zustand, Zeiten, Ergebnis und Fehler, None wenn unbekannt oder abgelaufen.
+        """
+        with self.cond:
+            self._evict()
+            job = self.results.get(job_id)
+            return self._job_info(job) if job is not None else None
+
+    def metrics(self):
+        """
+        Kennzahlen der Warteschlange.
+        :return: Dict mit Tiefe je Spur, laufenden Aufgaben, Zählern und Warte-/Laufzeiten.
+        """
+        with self.cond:
+            lanes = {}
+            for job in self.jobs:
+                lane = job['lane'] or ''
+                lanes[lane] = lanes.get(lane, 0) + 1
+            done = self.stats['completed'] + self.stats['failed']
+            oldest = min([job['queued'] for job in self.jobs] or [time.time()])
+            return {'depth': len(self.jobs),
+                    'depth_by_lane': lanes,
+                    'active': self.active,
+                    'busy_lanes': sorted(self.busy_lanes),
+                    'workers': len(self.threads),
+                    'submitted': self.stats['submitted'],
+                    'rejected': self.stats['rejected'],
+                    'completed': self.stats['completed'],
+                    'failed': self.stats['failed'],
+                    'wait_avg': self.stats['wait_total'] / done if done else 0.0,
+                    'wait_max': self.stats['wait_max'],
+                    'wait_oldest': time.time() - oldest,
+                    'run_avg': self.stats['run_total'] / done if done else 0.0,
+                    'run_max': self.stats['run_max']}
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+import http.client
+import json
+import sqlite3
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+
+
+def callback_port(port):
+    """
+    Prüft den Port einer Rückantwort, bevor sie angenommen wird.
+    :param port: Port als Zahl oder String
+    :return: Port als int
+    :raises ValueError: wenn port keine Portnummer ist.
+    """
+    try:
+        port = int(port)
+    except (TypeError, ValueError):
+        port = 0
+    if not 0 < port < 65536:
+        raise ValueError("Ungültiger Port für die Rückantwort")
+    return port
+
+
+class CallbackOutbox(object):
+    """
+    Persistenter Ausgang der Rückantworten an den Server in SQLite. Zustände
+    sind 'pending' (noch zuzustellen, ab 'retry_at'), 'done' und 'failed'.
+    """
+
+    columns = ('id', 'host', 'port', 'cmd', 'key', 'status', 'created', 'state', 'attempts', 'retry_at',
+               'delivered', 'error')
+
+    def __init__(self, path):
+        """
+        :param path: Datei der Datenbank, ':memory:' für einen flüchtigen Ausgang.
+        """
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            if path != ':memory:':
+                self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS callbacks (
+                id INTEGER PRIMARY KEY, host TEXT NOT NULL, port INTEGER NOT NULL, cmd TEXT NOT NULL,
+                key TEXT NOT NULL, status INTEGER NOT NULL, created REAL, state TEXT, attempts INTEGER DEFAULT 0,
+                retry_at REAL, delivered REAL, error TEXT)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS callbacks_due ON callbacks (state, host, port, retry_at)")
+
+    def add(self, host, port, cmd, key, status):
+        """
+        :return: ID der neuen Rückantwort
+        """
+        with self.lock, self.db:
+            return self.db.execute("INSERT INTO callbacks (host, port, cmd, key, status, created, state, retry_at) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, 'pending', 0)",
+                                   (host, int(port), cmd, key, int(bool(status)), time.time())).lastrowid
+
+    def update(self, ids, **fields):
+        """
+        Ändert Spalten einer oder mehrerer Rückantworten.
+        :param ids: ID oder Liste von IDs
+        """
+        if isinstance(ids, int):
+            ids = [ids]
+        keys = [k for k in fields if k in self.columns and k != 'id']
+        with self.lock, self.db:
+            self.db.executemany("UPDATE callbacks SET %s WHERE id = ?" % ", ".join(k + " = ?" for k in keys),
+                                [[fields[k] for k in keys] + [i] for i in ids])
+
+    def get(self, callback_id):
+        with self.lock:
+            row = self.db.execute("SELECT * FROM callbacks WHERE id = ?", (callback_id,)).fetchone()
+            return dict(row) if row else None
+
+    def due(self, host, port, now, limit=20):
+        """
+        :return: Fällige Rückantworten an einen Server, älteste zuerst.
+        """
+        with self.lock:
+            return [dict(r) for r in self.db.execute(
+                "SELECT * FROM callbacks WHERE state = 'pending' AND host = ? AND port = ? AND retry_at <= ? "
+                "ORDER BY id LIMIT ?", (host, int(port), now, limit))]
+
+    def next_retry(self, host, port):
+        """
+        :return: Zeitpunkt der nächsten fälligen Rückantwort an einen Server, None wenn keine offen ist.
+        """
+        with self.lock:
+            return self.db.execute("SELECT MIN(retry_at) FROM callbacks WHERE state = 'pending' AND host = ? "
+                                   "AND port = ?", (host, int(port))).fetchone()[0]
+
+    def hosts(self):
+        """
+        :return: Server (host, port) mit offenen Rückantworten
+        """
+        with self.lock:
+            return [tuple(r) for r in
+                    self.db.execute("SELECT DISTINCT host, port FROM callbacks WHERE state = 'pending'")]
+
+    def find(self, state=None, limit=100):
+        """
+        :return: Die letzten Rückantworten, optional nur in einem Zustand.
+        """
+        sql, args = "SELECT * FROM callbacks", []
+        if state:
+            sql += " WHERE state = ?"
+            args.append(state)
+        with self.lock:
+            return [dict(r) for r in self.db.execute(sql + " ORDER BY id DESC LIMIT ?", args + [limit])]
+
+    def ids(self, state):
+        with self.lock:
+            return [r[0] for r in self.db.execute("SELECT id FROM callbacks WHERE state = ?", (state,))]
+
+    def counts(self):
+        """
+        :return: Dict Zustand -> Anzahl
+        """
+        with self.lock:
+            return dict((r[0], r[1]) for r in self.db.execute("SELECT state, COUNT(*) FROM callbacks GROUP BY state"))
+
+    def prune(self, before):
+        """
+        Löscht zugestellte Rückantworten, die vor 'before' zugestellt wurden.
+        :return: Anzahl gelöschter Einträge
+        """
+        with self.lock, self.db:
+            return self.db.execute("DELETE FROM callbacks WHERE state = 'done' AND delivered < ?",
+                                   (before,)).rowcount
+
+
+class CallbackDispatcher(SimplePlugin):
+    """
+    Stellt Rückantworten ('/<cmd>/<key>/<status>') an den Server zu, ohne die
+    Hintergrund-Aufgaben aufzuhalten. Jede Rückantwort landet zuerst im
+    CallbackOutbox und übersteht so Ausfälle und Neustarts. Je Server läuft ein
+    eigener Thread mit einer Keep-Alive-Verbindung, damit ein langsamer oder nicht
+    erreichbarer Server die anderen nicht blockiert. Fehlschläge werden mit
+    wachsendem Abstand wiederholt. Mit 'batch_path' gehen mehrere fällige
+    Rückantworten an denselben Server als ein POST (JSON-Liste); kennt der Server
+    diese Route nicht, wird auf einzelne Anfragen zurückgefallen.
+    """
+
+    def __init__(self, bus, outbox, timeout=10, retries=10, max_delay=300, batch_path=None, batch_size=20,
+                 keep_days=7):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param outbox: CallbackOutbox
+        :param timeout: Socket-Timeout je Anfrage in Sekunden.
+        :param retries: Anzahl der Versuche je Rückantwort.
+        :param max_delay: Größter Abstand zwischen zwei Versuchen in Sekunden.
+        :param batch_path: Route des Servers für gesammelte Rückantworten, z.B. '/return_batch'.
+        :param batch_size: Höchstzahl an Rückantworten je Sammel-Anfrage.
+        :param keep_days: Zugestellte Rückantworten so viele Tage aufbewahren.
+        """
+        SimplePlugin.__init__(self, bus)
+        self.outbox = outbox
+        self.timeout = timeout
+        self.retries = retries
+        self.max_delay = max_delay
+        self.batch_path = batch_path
+        self.batch_size = batch_size
+        self.keep_days = keep_days
+        self.workers = {}
+        self.no_batch = set()
+        self.sent = 0
+        self.requests = 0
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        with self.cond:
+            self.running = True
+        self.outbox.prune(time.time() - self.keep_days * 86400)
+        # Was beim letzten Lauf nicht zugestellt wurde, sofort erneut versuchen
+        self.outbox.update(self.outbox.ids('pending'), retry_at=0)
+        for host, port in self.outbox.hosts():
+            self._worker(host, port)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+            workers = list(self.workers.values())
+        for thread in workers:
+            thread.join()
+        self.workers = {}
+
+    def send(self, host, port, cmd, key, status=True):
+        """
+        Legt eine Rückantwort in den Ausgang und kehrt sofort zurück.
+        :param host: Hostname des Servers
+        :param port: Port des Servers
+        :param cmd: Return-Befehl, üblicherweise 'return'
+        :param key: Einmalig erstellter Schlüssel für diese eine Abfrage.
+        :param status: Erfolg- oder Misserfolgsmeldung
+        :return: ID der Rückantwort
+        :raises ValueError: bei ungültigem Port.
+        """
+        port = callback_port(port)
+        callback_id = self.outbox.add(host, port, cmd, key, status)
+        self._worker(host, port)
+        with self.cond:
+            self.cond.notify_all()
+        return callback_id
+
+    def retry_failed(self):
+        """
+        Stellt endgültig fehlgeschlagene Rückantworten erneut zu.
+        :return: Anzahl der erneut eingereihten Rückantworten
+        """
+        ids = self.outbox.ids('failed')
+        self.outbox.update(ids, state='pending', attempts=0, retry_at=0, error=None)
+        for host, port in self.outbox.hosts():
+            self._worker(host, port)
+        with self.cond:
+            self.cond.notify_all()
+        return len(ids)
+
+    def metrics(self):
+        """
+        :return: Dict mit Anzahl je Zustand, zugestellten Rückantworten und HTTP-Anfragen.
+        """
+        with self.cond:
+            hosts = ["%s:%d" % h for h, t in self.workers.items() if t.is_alive()]
+        return {'states': self.outbox.counts(), 'sent': self.sent, 'requests': self.requests, 'hosts': hosts}
+
+    def _worker(self, host, port):
+        """
+        Startet bei Bedarf den Thread für einen Server.
+        """
+        with self.cond:
+            if not self.running:
+                return
+            thread = self.workers.get((host, port))
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self.run, args=(host, port))
+                thread.daemon = True
+                self.workers[(host, port)] = thread
+                thread.start()
+
+    def run(self, host, port):
+        """
+        Zustell-Schleife für einen Server, endet, wenn nichts mehr offen ist.
+        """
+        conn = None
+        while True:
+            with self.cond:
+                while self.running:
+                    next_retry = self.outbox.next_retry(host, port)
+                    if next_retry is None:
+                        # Nichts mehr offen: Thread beenden, send() startet bei Bedarf einen neuen
+                        del self.workers[(host, port)]
+                        if conn is not None:
+                            conn.close()
+                        return
+                    if next_retry <= time.time():
+                        break
+                    self.cond.wait(next_retry - time.time())
+                if not self.running:
+                    break
+            callbacks = self.outbox.due(host, port, time.time(), self.batch_size)
+            if conn is None:
+                conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+            try:
+                self.deliver(conn, host, port, callbacks)
+            except (OSError, http.client.HTTPException) as e:
+                # Verbindung verwerfen, beim nächsten Versuch neu aufbauen
+                conn.close()
+                conn = None
+                self.bus.log("Rückantwort an %s:%d: %s" % (host, port, e), level=30)
+        if conn is not None:
+            conn.close()
+
+    def deliver(self, conn, host, port, callbacks):
+        """
+        Stellt fällige Rückantworten über eine bestehende Verbindung zu.
+        :raises OSError: bei Verbindungsfehlern, die aktuelle Rückantwort ist dann zur Wiederholung vorgemerkt.
+        """
+        if self.batch_path and len(callbacks) > 1 and (host, port) not in self.no_batch:
+            body = json.dumps([{'cmd': c['cmd'], 'key': c['key'], 'status': bool(c['status'])} for c in callbacks])
+            status, reason = self._request(conn, "POST", self.batch_path, callbacks, body)
+            if status in (404, 405, 501):
+                # Server kennt keine Sammel-Anfragen
+                self.no_batch.add((host, port))
+            else:
+                self._result(callbacks, status, reason)
+                return
+        for c in callbacks:
+            status, reason = self._request(conn, "GET", "/%s/%s/%s" % (c['cmd'], c['key'], bool(c['status'])), [c])
+            self._result([c], status, reason)
+            if status >= 500 or status in (408, 429):
+                # Server überlastet: die übrigen nicht gleich hinterherschicken
+                return
+
+    def _request(self, conn, method, url, callbacks, body=None):
+        """
+        :return: (HTTP-Status, Grund)
+        """
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            conn.request(method, url, body=body, headers=headers)
+            r = conn.getresponse()
+            r.read()
+            with self.cond:
+                self.requests += 1
+            return r.status, r.reason
+        except (OSError, http.client.HTTPException) as e:
+            self._retry(callbacks, str(e))
+            raise
+
+    def _result(self, callbacks, status, reason):
+        ids = [c['id'] for c in callbacks]
+        if 200 <= status < 300:
+            self.outbox.update(ids, state='done', delivered=time.time(), error=None)
+            with self.cond:
+                self.sent += len(ids)
+        elif status >= 500 or status in (408, 429):
+            self._retry(callbacks, "Server antwortet %d %s" % (status, reason))
+        else:
+            # Der Server lehnt die Rückantwort ab, eine Wiederholung ändert daran nichts
+            self.outbox.update(ids, state='failed', error="Server antwortet %d %s" % (status, reason))
+
+    def _retry(self, callbacks, error):
+        """
+        Merkt Rückantworten zur Wiederholung vor bzw. gibt nach 'retries' Versuchen auf.
+        """
+        for c in callbacks:
+            attempts = c['attempts'] + 1
+            if attempts >= self.retries:
+                self.outbox.update(c['id'], state='failed', attempts=attempts, error=error)
+            else:
+                self.outbox.update(c['id'], attempts=attempts, error=error,
+                                   retry_at=time.time() + min(self.max_delay, 2 ** attempts))
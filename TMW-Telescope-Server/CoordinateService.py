@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from astropy import units as u
+from astropy.coordinates import AltAz, EarthLocation, SkyCoord, TETE
+from astropy.time import Time
+from astropy.utils import iers
+import numpy as np
+
+
+class CoordinateService(object):
+    """
+    Koordinaten-Umrechnung für die Sternwarte. Der Beobachtungsort wird einmalig
+    aus der Konfiguration aufgebaut. Für die Montierung werden scheinbare
+    Koordinaten des Tages (JNow, topozentrisch) berechnet, auf Wunsch für
+    ganze Zielisten in einem vektorisierten Aufruf.
+    """
+
+    def __init__(self, lat, lon, height, iers_auto_download=True, iers_max_age=30):
+        """
+        :param lat: Geographische Breite in Grad
+        :param lon: Geographische Länge in Grad
+        :param height: Höhe in Metern
+        :param iers_auto_download: IERS-Daten bei Bedarf herunterladen.
+        :param iers_max_age: Alter der lokal gespeicherten IERS-Daten in Tagen, ab dem neu geladen wird.
+        """
+        self.location = EarthLocation(lat=lat * u.deg, lon=lon * u.deg, height=height * u.m)
+        # IERS-Daten werden im astropy-Cache gehalten und nur selten erneuert. Ohne Netz
+        # wird mit den vorhandenen Daten weitergerechnet statt abzubrechen.
+        iers.conf.auto_download = iers_auto_download
+        iers.conf.auto_max_age = iers_max_age
+        iers.conf.iers_degraded_accuracy = 'warn'
+
+    def altaz_frame(self, obstime=None):
+        """
+        :param obstime: Zeitpunkt(e) als Time, Standard ist jetzt.
+        :return: AltAz-Frame der Sternwarte
+        """
+        return AltAz(location=self.location, obstime=obstime if obstime is not None else Time.now())
+
+    def to_mount_batch(self, ra, dec, obstime=None):
+        """
+        Rechnet ICRS-Koordinaten (J2000) in scheinbare Koordinaten des Tages um.
+        :param ra: Rektaszension(en) in Grad (Zahl oder Array)
+        :param dec: Deklination(en) in Grad (Zahl oder Array)
+        :param obstime: Zeitpunkt als Time, Standard ist jetzt.
+        :return: (RA in Stunden, Dec in Grad) als NumPy-Arrays
+        """
+        coords = SkyCoord(ra=np.asarray(ra, dtype=float) * u.deg, dec=np.asarray(dec, dtype=float) * u.deg,
+                          frame='icrs')
+        jnow = coords.transform_to(TETE(obstime=obstime if obstime is not None else Time.now(),
+                                        location=self.location))
+        return jnow.ra.hour, jnow.dec.degree
+
+    def to_mount(self, coord, obstime=None):
+        """
+        :param coord: SkyCoord eines Objekts
+        :param obstime: Zeitpunkt als Time, Standard ist jetzt.
+        :return: (RA in Stunden, Dec in Grad) für SlewToCoordinates
+        """
+        icrs = coord.icrs
+        ra, dec = self.to_mount_batch(icrs.ra.degree, icrs.dec.degree, obstime)
+        return float(ra), float(dec)
+
+    def altaz_batch(self, ra, dec, obstime=None):
+        """
+        :param ra: Rektaszension(en) in Grad (Zahl oder Array)
+        :param dec: Deklination(en) in Grad (Zahl oder Array)
+        :param obstime: Zeitpunkt als Time, Standard ist jetzt.
+        :return: (Höhe in Grad, Azimut in Grad) als NumPy-Arrays
+        """
+        coords = SkyCoord(ra=np.asarray(ra, dtype=float) * u.deg, dec=np.asarray(dec, dtype=float) * u.deg,
+                          frame='icrs')
+        altaz = coords.transform_to(self.altaz_frame(obstime))
+        return altaz.alt.degree, altaz.az.degree
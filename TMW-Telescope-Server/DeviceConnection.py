@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import Future
+import queue
+import socket
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+
+
+class BufferedChannel(object):
+    """
+    Gepufferter Protokoll-Leser auf einem verbundenen Socket.
+    Antworten werden in einen dauerhaft angelegten Puffer gelesen und daraus
+    Rahmen für Rahmen entnommen: unvollständige Antworten werden weiter
+    gelesen, zusammengeklebte Antworten bleiben für den nächsten Befehl im
+    Puffer. Jeder Lesevorgang hat eine eigene Frist.
+    """
+
+    def __init__(self, s, timeout=5, bufsize=4096):
+        """
+        :param s: Verbundener Socket
+        :param timeout: Standard-Frist für einen Lesevorgang in Sekunden.
+        :param bufsize: Größe des Empfangspuffers
+        """
+        self.s = s
+        self.timeout = timeout
+        self.recvbuf = bytearray(bufsize)
+        self.recvview = memoryview(self.recvbuf)
+        self.data = bytearray()
+        # Gesendete Bytes, DeviceConnection.transact() setzt den Zähler je Aufruf zurück
+        self.sent = 0
+
+    def sendall(self, data):
+        self.s.settimeout(self.timeout)
+        self.s.sendall(data)
+        # Scheitert sendall, war die Verbindung bereits abgerissen; gezählt wird nur Gesendetes
+        self.sent += len(data)
+
+    def alive(self):
+        """
+        Prüft ohne zu warten, ob die Gegenstelle die Verbindung inzwischen geschlossen hat.
+        :return: False, wenn die Verbindung geschlossen ist.
+        """
+        try:
+            self.s.settimeout(0)
+            return self.s.recv(1, socket.MSG_PEEK) != b""
+        except BlockingIOError:
+            # Keine Daten, Verbindung offen
+            return True
+        except OSError:
+            return False
+
+    def discard(self):
+        """
+        Verwirft gepufferte und bereits eingetroffene, aber nicht gelesene Daten,
+        z.B. eine verspätete Antwort auf einen Befehl, dessen Antwort nicht gelesen wurde.
+        :return: Anzahl der verworfenen Bytes
+        """
+        n = len(self.data)
+        del self.data[:]
+        try:
+            self.s.settimeout(0)
+            while True:
+                chunk = self.s.recv_into(self.recvview)
+                if chunk == 0:
+                    break
+                n += chunk
+        except (BlockingIOError, InterruptedError):
+            pass
+        return n
+
+    def _fill(self, deadline):
+        """
+        Liest verfügbare Daten in den Puffer, höchstens bis zur Frist.
+        :param deadline: Frist als time.monotonic()-Wert
+        :return:
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("Zeitüberschreitung beim Lesen")
+        self.s.settimeout(remaining)
+        n = self.s.recv_into(self.recvview)
+        if n == 0:
+            raise ConnectionError("Gegenstelle hat die Verbindung geschlossen")
+        self.data += self.recvview[:n]
+
+    def read_exact(self, n, timeout=None):
+        """
+        Liest einen Rahmen fester Länge.
+        :param n: Länge in Bytes
+        :param timeout: Frist in Sekunden, Standard ist die Frist des Kanals.
+        :return: Rahmen als bytes
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        while len(self.data) < n:
+            self._fill(deadline)
+        frame = bytes(self.data[:n])
+        del self.data[:n]
+        return frame
+
+    def read_until(self, terminator, timeout=None, idle=None):
+        """
+        Liest einen Rahmen bis zum Endezeichen. Das Endezeichen wird entfernt.
+        :param terminator: Endezeichen als bytes
+        :param timeout: Frist in Sekunden, Standard ist die Frist des Kanals.
+        :param idle: Optional: kommen nach den ersten Bytes so viele Sekunden
+                     keine Daten mehr, gilt der Rahmen auch ohne Endezeichen als vollständig.
+        :return: Rahmen als bytes
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        start = 0
+        while True:
+            i = self.data.find(terminator, start)
+            if i >= 0:
+                frame = bytes(self.data[:i])
+                del self.data[:i + len(terminator)]
+                return frame
+            # Nur neu eingetroffene Daten durchsuchen
+            start = max(0, len(self.data) - len(terminator) + 1)
+            if idle and self.data:
+                try:
+                    self._fill(min(deadline, time.monotonic() + idle))
+                except socket.timeout:
+                    frame = bytes(self.data)
+                    del self.data[:]
+                    return frame
+            else:
+                self._fill(deadline)
+
+
+class DeviceConnection(SimplePlugin):
+    """
+    Dauerhafte TCP-Verbindung zu einer Geräte-Software (z.B. PHD).
+    Alle CherryPy-Threads teilen sich einen Socket, der Zugriff wird über ein
+    Lock serialisiert. Reißt die Verbindung ab, wird mit wachsendem Abstand
+    (Backoff) neu verbunden. Ein Keepalive-Thread hält die Verbindung auch in
+    Ruhephasen offen und stellt sie nach einem Neustart der Software wieder her.
+    """
+    thread = None
+
+    def __init__(self, bus, host, port, timeout=5, keepalive=15, keepalive_func=None,
+                 backoff_min=0.5, backoff_max=10):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param host: Hostname der Geräte-Software
+        :param port: Port der Geräte-Software
+        :param timeout: Socket-Timeout in Sekunden
+        :param keepalive: Ruhezeit in Sekunden, nach der ein Keepalive gesendet wird.
+        :param keepalive_func: Funktion func(channel), die als Keepalive ausgeführt wird.
+        :param backoff_min: Erste Wartezeit nach einem fehlgeschlagenen Verbindungsversuch.
+        :param backoff_max: Maximale Wartezeit zwischen zwei Verbindungsversuchen.
+        """
+        SimplePlugin.__init__(self, bus)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.keepalive_func = keepalive_func
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.lock = threading.RLock()
+        self.s = None
+        self.channel = None
+        self.backoff = 0
+        self.next_attempt = 0
+        self.last_used = 0
+        self.running = False
+        self.wakeup = threading.Event()
+
+    def start(self):
+        self.running = True
+        self.wakeup.clear()
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.close()
+
+    def run(self):
+        """
+        Keepalive-Schleife: sendet nach jeder Ruhephase ein Keepalive bzw.
+        versucht eine abgerissene Verbindung wiederherzustellen.
+        """
+        while self.running:
+            self.wakeup.wait(self.keepalive)
+            if not self.running:
+                return
+            if time.time() - self.last_used < self.keepalive:
+                continue
+            try:
+                if self.keepalive_func:
+                    self.transact(self.keepalive_func)
+                else:
+                    with self.lock:
+                        if self.s is None:
+                            self._connect()
+            except Exception:
+                # Verbindung ist bereits geschlossen, der nächste Versuch folgt nach dem Backoff.
+                pass
+
+    def connected(self):
+        """
+        :return: True, wenn aktuell eine Verbindung besteht.
+        """
+        return self.s is not None
+
+    def reset_backoff(self):
+        """
+        Erlaubt sofort einen neuen Verbindungsversuch, z.B. nachdem die Software gestartet wurde.
+        :return:
+        """
+        with self.lock:
+            self.backoff = 0
+            self.next_attempt = 0
+
+    def close(self):
+        """
+        Schließt die Verbindung. Die nächste Anfrage verbindet neu.
+        :return:
+        """
+        with self.lock:
+            if self.s is not None:
+                try:
+                    self.s.close()
+                except OSError:
+                    pass
+                self.s = None
+                self.channel = None
+
+    def _connect(self):
+        """
+        Baut die Verbindung auf. Nach Fehlversuchen wird bis zum Ablauf des
+        Backoffs sofort abgebrochen, statt die Software mit Versuchen zu fluten.
+        :return:
+        """
+        now = time.time()
+        if now < self.next_attempt:
+            raise ConnectionError("Keine Verbindung zu %s:%s, nächster Versuch in %.1f s"
+                                  % (self.host, self.port, self.next_attempt - now))
+        try:
+            s = socket.create_connection((self.host, self.port), self.timeout)
+        except OSError:
+            self.backoff = min(self.backoff_max, self.backoff * 2) if self.backoff else self.backoff_min
+            self.next_attempt = time.time() + self.backoff
+            raise
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.backoff = 0
+        self.next_attempt = 0
+        self.s = s
+        self.channel = BufferedChannel(s, self.timeout)
+
+    def transact(self, func):
+        """
+        Führt func(channel) exklusiv auf der gemeinsamen Verbindung aus.
+        Hat die Gegenstelle die bestehende Verbindung inzwischen geschlossen
+        (z.B. nach einem Neustart der Software), wird vorher neu verbunden.
+        Reißt sie erst während func ab, wird func nur wiederholt, wenn noch
+        nichts gesendet wurde, sonst könnte ein Befehl doppelt ausgeführt werden.
+        :param func: Funktion, die mit dem BufferedChannel der Verbindung aufgerufen wird.
+        :return: Rückgabewert von func
+        """
+        with self.lock:
+            if self.s is not None and not self.channel.alive():
+                self.close()
+            reused = self.s is not None
+            if not reused:
+                self._connect()
+            channel = self.channel
+            channel.sent = 0
+            try:
+                result = func(channel)
+            except ConnectionError:
+                self.close()
+                if not reused or channel.sent:
+                    raise
+                self._connect()
+                try:
+                    result = func(self.channel)
+                except OSError:
+                    self.close()
+                    raise
+            except OSError:
+                # Timeout o.ä.: Zustand der Verbindung ist unklar, daher neu aufbauen.
+                self.close()
+                raise
+            self.last_used = time.time()
+            return result
+
+
+class QueuedDeviceConnection(DeviceConnection):
+    """
+    Dauerhafte Verbindung wie DeviceConnection, Befehle werden jedoch in eine
+    Warteschlange gestellt und von einem eigenen I/O-Thread der Reihe nach
+    ausgeführt. Aufrufer stellen ihre Befehle sofort ein und warten nur noch
+    auf die eigene Antwort, Verbindungsaufbau und Wiederverbindung erledigt
+    ausschließlich der I/O-Thread.
+    """
+    worker = None
+
+    def __init__(self, bus, host, port, qsize=100, **kwargs):
+        DeviceConnection.__init__(self, bus, host, port, **kwargs)
+        self.q = queue.Queue(qsize)
+
+    def start(self):
+        DeviceConnection.start(self)
+        if not self.worker:
+            self.worker = threading.Thread(target=self.work)
+            self.worker.daemon = True
+            self.worker.start()
+
+    def stop(self):
+        if self.worker:
+            self.q.put(None)
+            self.worker.join()
+            self.worker = None
+        DeviceConnection.stop(self)
+
+    def work(self):
+        """
+        I/O-Schleife: arbeitet die Befehle der Warteschlange ab.
+        """
+        while True:
+            item = self.q.get()
+            if item is None:
+                return
+            func, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.transact(func))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, func):
+        """
+        Stellt func(channel) in die Warteschlange, ohne auf die Ausführung zu warten.
+        :param func: Funktion, die mit dem BufferedChannel der Verbindung aufgerufen wird.
+        :return: Future mit dem Ergebnis von func
+        :raises queue.Full: wenn die Warteschlange voll ist.
+        """
+        future = Future()
+        self.q.put_nowait((func, future))
+        return future
+
+    def request(self, func, timeout=None):
+        """
+        Stellt func(channel) in die Warteschlange und wartet auf das Ergebnis.
+        Läuft die Wartezeit ab, bevor der Befehl an der Reihe war, wird er
+        verworfen und nicht mehr nachträglich an das Gerät gesendet.
+        :param func: Funktion, die mit dem BufferedChannel der Verbindung aufgerufen wird.
+        :param timeout: Maximale Wartezeit, Standard ist das Doppelte des Socket-Timeouts
+                        für diesen und jeden bereits wartenden Befehl.
+        :return: Rückgabewert von func
+        :raises TimeoutError: wenn das Ergebnis nicht innerhalb der Wartezeit vorliegt.
+        """
+        if timeout is None:
+            timeout = 2 * self.timeout * (1 + self.q.qsize())
+        future = self.submit(func)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # Läuft der Befehl bereits, lässt er sich nicht mehr zurückholen
+            future.cancel()
+            raise
@@ -0,0 +1,585 @@
+# -*- coding: utf-8 -*-
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import re
+import socket
+import socketserver
+import sys
+import threading
+import time
+from urllib.parse import unquote
+
+
+def send_fragmented(request, data, fragment=False):
+    """
+    Sendet eine Antwort, auf Wunsch in zufällig großen Stücken mit kleinen
+    Pausen, um Teil-Antworten beim Client zu provozieren.
+    :param request: Socket der Client-Verbindung
+    :param data: Antwort als bytes
+    :param fragment: True für zerstückeltes Senden
+    :return:
+    """
+    if not fragment:
+        request.sendall(data)
+        return
+    pos = 0
+    while pos < len(data):
+        size = random.randint(1, max(1, len(data) - pos))
+        request.sendall(data[pos:pos + size])
+        pos += size
+        time.sleep(random.uniform(0, 0.01))
+
+
+class FakePHDHandler(socketserver.BaseRequestHandler):
+    """
+    Beantwortet Befehle des PHD Socket-Protokolls (ein Byte pro Befehl)
+    wie ein laufendes PHD.
+    """
+
+    def handle(self):
+        while True:
+            try:
+                data = self.request.recv(64)
+            except OSError:
+                return
+            if not data:
+                return
+            for cmd in data:
+                self.request.sendall(bytes([self.server.command(cmd)]))
+
+
+class FakePHDServer(socketserver.ThreadingTCPServer):
+    """
+    Lokaler Ersatz für den PHD Socket-Server (Port 4300), damit die
+    Verbindungsverwaltung auch unter Linux getestet und belastet werden kann.
+    Nach 'calibration' Sekunden Kalibrierung wird geguidet, ein Dither
+    versetzt den Stern, der Abstand klingt danach mit 'settle_time' ab.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # MSG_MOVE1 bis MSG_MOVE5 -> Dither-Weite in Pixeln
+    dithers = {3: 1.0, 4: 2.0, 5: 3.0, 12: 4.0, 13: 5.0}
+
+    def __init__(self, host="localhost", port=4300, calibration=1.0, settle_time=1.0):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FakePHDHandler)
+        self.lock = threading.Lock()
+        self.status = 0
+        self.commands = 0
+        self.calibration = calibration
+        self.settle_time = settle_time
+        self.calibrated = 0
+        self.dither_size = 0.0
+        self.dither_time = 0
+        self.thread = None
+
+    def command(self, cmd):
+        """
+        Simuliert die Zustandsänderungen von PHD.
+        :param cmd: Befehl in Form einer Zahl.
+        :return: Antwort in Form einer Zahl.
+        """
+        with self.lock:
+            self.commands += 1
+            if self.status == 2 and time.time() >= self.calibrated:
+                self.status = 3
+            if cmd == 14:  # MSG_AUTOFINDSTAR
+                if self.status == 101:
+                    self.status = 1
+                return 1
+            elif cmd == 17:  # MSG_GETSTATUS
+                return self.status
+            elif cmd == 18:  # MSG_STOP
+                self.status = 0
+            elif cmd == 19:  # MSG_LOOP
+                self.status = 101
+            elif cmd == 20:  # MSG_STARTGUIDING
+                self.status = 2
+                self.calibrated = time.time() + self.calibration
+            elif cmd == 10:  # MSG_REQDIST, Abstand in 1/100 Pixel
+                elapsed = time.time() - self.dither_time
+                distance = 0.2 + self.dither_size * max(0.0, 1 - elapsed / self.settle_time)
+                return min(255, int(distance * 100))
+            elif cmd in self.dithers:  # MSG_MOVE1 bis MSG_MOVE5
+                self.dither_size = self.dithers[cmd]
+                self.dither_time = time.time()
+            return 0
+
+    def start(self):
+        """
+        Startet den Server in einem Hintergrund-Thread.
+        :return: Tatsächlicher Port (bei Port 0 vom System vergeben).
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakePHD2Handler(socketserver.BaseRequestHandler):
+    """
+    Eine Client-Verbindung zum Event-Server von PHD2.
+    """
+
+    def handle(self):
+        self.request.sendall(self.server.line({'Event': 'Version', 'PHDVersion': '2.6.5', 'MsgVersion': 1}))
+        self.server.add_client(self.request)
+        buffer = b""
+        try:
+            while True:
+                data = self.request.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    if line.strip():
+                        self.server.rpc(self.request, json.loads(line.decode()))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.server.remove_client(self.request)
+
+
+class FakePHD2Server(socketserver.ThreadingTCPServer):
+    """
+    Lokaler Ersatz für den Event-Server von PHD2 (Port 4400). Sendet entweder
+    ein festes Skript aus (Pause, Ereignis)-Paaren oder fortlaufend GuideSteps
+    mit normalverteilter Abweichung ('ra_sigma', 'dec_sigma' in Pixeln) und
+    alle 'star_lost_every' Schritte ein StarLost. JSON-RPC 'dither' wird
+    beantwortet und nach 'settle_duration' Sekunden mit SettleDone quittiert.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=4400, interval=0.1, ra_sigma=0.3, dec_sigma=0.2,
+                 star_lost_every=0, script=None, settle_duration=1.0):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FakePHD2Handler)
+        self.lock = threading.Lock()
+        self.clients = []
+        self.interval = interval
+        self.ra_sigma = ra_sigma
+        self.dec_sigma = dec_sigma
+        self.star_lost_every = star_lost_every
+        self.script = script
+        self.settle_duration = settle_duration
+        self.frame = 0
+        self.sent = 0
+        self.running = False
+        self.thread = None
+        self.emitter = None
+
+    @staticmethod
+    def line(event):
+        event.setdefault('Timestamp', time.time())
+        event.setdefault('Host', 'fake')
+        event.setdefault('Inst', 1)
+        return (json.dumps(event) + "\r\n").encode()
+
+    def add_client(self, request):
+        with self.lock:
+            self.clients.append(request)
+
+    def remove_client(self, request):
+        with self.lock:
+            if request in self.clients:
+                self.clients.remove(request)
+
+    def broadcast(self, event):
+        """
+        Sendet ein Ereignis an alle verbundenen Clients.
+        :param event: Ereignis als Dict
+        """
+        data = self.line(event)
+        with self.lock:
+            for request in list(self.clients):
+                try:
+                    request.sendall(data)
+                except OSError:
+                    self.clients.remove(request)
+            self.sent += 1
+
+    def rpc(self, request, message):
+        """
+        Beantwortet einen JSON-RPC-Befehl eines Clients.
+        :param request: Socket des Clients
+        :param message: Befehl als Dict
+        """
+        response = {'jsonrpc': '2.0', 'id': message.get('id')}
+        method = message.get('method')
+        if method == 'dither':
+            response['result'] = 0
+            settle = message.get('params', {}).get('settle', {})
+            threading.Thread(target=self.settle, args=(settle.get('time', 0),), daemon=True).start()
+        elif method == 'get_app_state':
+            response['result'] = 'Guiding'
+        else:
+            response['error'] = {'code': -32601, 'message': "method not found"}
+        with self.lock:
+            request.sendall((json.dumps(response) + "\r\n").encode())
+
+    def settle(self, settle_time):
+        """
+        Meldet nach einem Dither Settling-Ereignisse und schließlich SettleDone.
+        """
+        started = time.time()
+        duration = max(self.settle_duration, settle_time)
+        while time.time() - started < duration:
+            elapsed = time.time() - started
+            self.broadcast({'Event': 'Settling', 'Distance': round(2.0 * (1 - elapsed / duration), 2),
+                            'Time': elapsed, 'SettleTime': settle_time, 'StarLocked': True})
+            time.sleep(min(0.5, duration))
+        frames = int(duration / self.interval) if self.interval else 0
+        self.broadcast({'Event': 'SettleDone', 'Status': 0, 'TotalFrames': frames, 'DroppedFrames': 0})
+
+    def guide_step(self):
+        self.frame += 1
+        if self.star_lost_every and self.frame % self.star_lost_every == 0:
+            return {'Event': 'StarLost', 'Frame': self.frame, 'Time': self.frame * self.interval,
+                    'StarMass': 0, 'SNR': 0, 'AvgDist': 0, 'ErrorCode': 1, 'Status': "Star lost"}
+        return {'Event': 'GuideStep', 'Frame': self.frame, 'Time': self.frame * self.interval, 'Mount': 'Fake',
+                'RADistanceRaw': random.gauss(0, self.ra_sigma), 'DECDistanceRaw': random.gauss(0, self.dec_sigma),
+                'StarMass': 12000, 'SNR': 40.0, 'HFD': 2.1}
+
+    def emit(self):
+        """
+        Sendet das Skript bzw. fortlaufende Guide-Schritte.
+        """
+        if self.script is not None:
+            for delay, event in self.script:
+                time.sleep(delay)
+                if not self.running:
+                    return
+                self.broadcast(dict(event))
+            return
+        while self.running:
+            self.broadcast(self.guide_step())
+            time.sleep(self.interval)
+
+    def start(self):
+        """
+        Startet Server und Ereignis-Ausgabe in Hintergrund-Threads.
+        :return: Tatsächlicher Port (bei Port 0 vom System vergeben).
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.emitter = threading.Thread(target=self.emit)
+        self.emitter.daemon = True
+        self.emitter.start()
+        return self.server_address[1]
+
+    def stop(self):
+        self.running = False
+        self.shutdown()
+        with self.lock:
+            for request in self.clients:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.server_close()
+
+
+class FakeBYEHandler(socketserver.BaseRequestHandler):
+    """
+    Beantwortet die Text-Befehle von BackyardEOS. Kurz hintereinander
+    gesendete Befehle können in einem Block ankommen und werden anhand
+    der bekannten Befehlsnamen getrennt.
+    """
+    commands = re.compile(r"(?=takepicture|getstatus|getpicturepath|connect)")
+
+    def handle(self):
+        while True:
+            try:
+                data = self.request.recv(1024)
+            except OSError:
+                return
+            if not data:
+                return
+            for cmd in self.commands.split(data.decode()):
+                if not cmd:
+                    continue
+                reply = self.server.command(cmd.strip())
+                if reply is not None:
+                    send_fragmented(self.request, (reply + self.server.terminator).encode(),
+                                    self.server.fragment)
+
+
+class FakeBYEServer(socketserver.ThreadingTCPServer):
+    """
+    Lokaler Ersatz für den BackyardEOS Socket-Server (Port 1499).
+    'takepicture' belichtet simuliert für die angegebene Dauer, nach
+    zusätzlich 'download' Sekunden liefert 'getpicturepath' den Pfad des
+    neuen Bildes. Mit fragment=True werden Antworten zerstückelt gesendet.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=1499, picture_dir=".", terminator="", fragment=False, download=0.0):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FakeBYEHandler)
+        self.lock = threading.Lock()
+        self.terminator = terminator
+        self.fragment = fragment
+        self.picture_dir = picture_dir
+        self.download = download
+        self.picturepath = ""
+        self.pendingpath = ""
+        self.exposure_end = 0
+        self.pictures = 0
+        self.commands = 0
+        self.thread = None
+
+    def command(self, cmd):
+        """
+        Simuliert die Antworten von BYE.
+        :param cmd: Befehl als String
+        :return: Antwort als String, None bei Befehlen ohne Antwort.
+        """
+        with self.lock:
+            self.commands += 1
+            busy = time.time() < self.exposure_end
+            if self.pendingpath and time.time() >= self.exposure_end + self.download:
+                self.picturepath = self.pendingpath
+                self.pendingpath = ""
+            if cmd.startswith("takepicture"):
+                match = re.search(r"duration:([0-9.]+)", cmd)
+                duration = float(match.group(1)) if match else 0
+                self.exposure_end = time.time() + duration
+                self.pictures += 1
+                self.pendingpath = "%s/IMG_%04d.CR2" % (self.picture_dir, self.pictures)
+                return None
+            elif cmd == "getstatus":
+                return "busy" if busy else "idle"
+            elif cmd == "getpicturepath":
+                return self.picturepath or "error"
+            elif cmd == "connect":
+                return "OK"
+            return "error"
+
+    def start(self):
+        """
+        Startet den Server in einem Hintergrund-Thread.
+        :return: Tatsächlicher Port (bei Port 0 vom System vergeben).
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeArchiveHandler(BaseHTTPRequestHandler):
+    """
+    HEAD liefert die Größe des bereits empfangenen Teils, PUT schreibt ab
+    dem Anfang bzw. ab der Position aus 'Content-Range'.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _path(self):
+        return os.path.join(self.server.directory, *[unquote(p) for p in self.path.split("/") if p and p != ".."])
+
+    def do_HEAD(self):
+        path = self._path()
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+        else:
+            self.send_response(200)
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+
+    def do_PUT(self):
+        path = self._path()
+        length = int(self.headers['Content-Length'])
+        match = re.match(r"bytes (\d+)-", self.headers.get('Content-Range', ""))
+        offset = int(match.group(1)) if match else 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.server.lock:
+            self.server.puts += 1
+            drop = self.server.fail_after is not None and path not in self.server.dropped
+            if drop:
+                self.server.dropped.add(path)
+        with open(path, 'r+b' if offset and os.path.exists(path) else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            remaining = length
+            while remaining:
+                data = self.rfile.read(min(65536, remaining, self.server.fail_after or remaining))
+                if not data:
+                    return
+                f.write(data)
+                remaining -= len(data)
+                if drop and length - remaining >= self.server.fail_after:
+                    # Verbindungsabbruch mitten in der Übertragung
+                    self.close_connection = True
+                    return
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeArchiveServer(ThreadingHTTPServer):
+    """
+    Lokale HTTP-Senke als Ersatz für das Archiv, legt Dateien unter 'directory' ab.
+    Mit fail_after bricht die erste Übertragung jeder Datei nach so vielen Bytes ab.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=0, directory=".", fail_after=None):
+        ThreadingHTTPServer.__init__(self, (host, port), FakeArchiveHandler)
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.fail_after = fail_after
+        self.dropped = set()
+        self.puts = 0
+        self.thread = None
+
+    def start(self):
+        """
+        Startet den Server in einem Hintergrund-Thread.
+        :return: Tatsächlicher Port (bei Port 0 vom System vergeben).
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeCallbackHandler(BaseHTTPRequestHandler):
+    """
+    Nimmt Rückantworten als GET '/<cmd>/<key>/<status>' oder gesammelt als
+    POST auf '/batch' (JSON-Liste) an.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _flaky(self):
+        """
+        :return: True, wenn die Anfrage wie bei einem gestörten Server scheitert.
+        """
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            roll = server.random.random()
+        time.sleep(server.delay)
+        if roll < server.drop_rate:
+            self.close_connection = True
+            return True
+        if roll < server.drop_rate + server.error_rate:
+            self._reply(503)
+            return True
+        return False
+
+    def do_GET(self):
+        parts = [unquote(p) for p in self.path.split("/") if p]
+        if self._flaky():
+            return
+        if len(parts) != 3:
+            self._reply(404)
+            return
+        with self.server.lock:
+            self.server.received.append((parts[0], parts[1], parts[2] == "True"))
+        self._reply(200)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.server.batch or self.path != "/batch":
+            self._reply(404)
+            return
+        if self._flaky():
+            return
+        with self.server.lock:
+            self.server.batches += 1
+            self.server.received.extend((c['cmd'], c['key'], c['status']) for c in json.loads(body.decode()))
+        self._reply(200)
+
+
+class FakeCallbackServer(ThreadingHTTPServer):
+    """
+    Lokale, absichtlich unzuverlässige HTTP-Senke als Ersatz für den Server, der
+    Rückantworten empfängt. Ein Anteil 'drop_rate' der Anfragen endet mit einem
+    Verbindungsabbruch ohne Antwort, ein Anteil 'error_rate' mit 503. Zustellungen
+    landen in 'received' (cmd, key, status).
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=0, drop_rate=0.0, error_rate=0.0, delay=0.0, batch=True, seed=None):
+        ThreadingHTTPServer.__init__(self, (host, port), FakeCallbackHandler)
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.drop_rate = drop_rate
+        self.error_rate = error_rate
+        self.delay = delay
+        self.batch = batch
+        self.received = []
+        self.requests = 0
+        self.batches = 0
+        self.connections = set()
+        self.thread = None
+
+    def start(self):
+        """
+        Startet den Server in einem Hintergrund-Thread.
+        :return: Tatsächlicher Port (bei Port 0 vom System vergeben).
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def fake_bdsrun(argv):
+    """
+    Ersatz für BDSRun.exe unter Linux, z.B. mit 'BDSCommand = python3 DeviceSimulators.py bdsrun'.
+    Gibt den Script-Namen aus, wartet FAKE_BDS_DELAY Sekunden (Standard 0.5) und endet
+    mit Exit-Code 0. Scripte, deren Name 'fail' enthält, enden mit Exit-Code 1,
+    solche mit 'hang' laufen bis zum Timeout.
+    :param argv: Argumente wie bei BDSRun.exe, z.B. ['/Script:...\\bye_start.bds', '/S']
+    :return: Exit-Code
+    """
+    script = next((a[len("/Script:"):] for a in argv if a.startswith("/Script:")), "")
+    name = re.split(r"[\\/]", script)[-1]
+    print("BDSRun: " + name)
+    sys.stdout.flush()
+    if "hang" in name:
+        while True:
+            time.sleep(1)
+    time.sleep(float(os.environ.get("FAKE_BDS_DELAY", 0.5)))
+    return 1 if "fail" in name else 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "bdsrun":
+        sys.exit(fake_bdsrun(sys.argv[2:]))
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import sys
+import threading
+
+from cherrypy.process.plugins import SimplePlugin
+
+# Treiber je Geräteart: Name aus der Konfiguration -> 'Modul:Klasse'. Das Modul
+# wird erst beim Erzeugen des Treibers importiert, so lädt ein Server ohne
+# Windows weder pythoncom noch win32com.
+#
+# Kamera (BYE), Guider (PHD) und der Event-Server von PHD2 sind eigene Programme,
+# mit denen der Server über Sockets spricht. Ihre Treiber sind Endpunkte mit
+# Konstruktor (host, port, **Optionen), start() und stop(); für die echten
+# Programme ist das ExternalProgram, das nichts startet. Der Solver
+# (AstroTortilla) wird wie das Starten der Programme über BDS-Scripte bedient,
+# sein Treiber liefert das Kommando dafür.
+DRIVERS = {
+    'mount': {'ascom': 'MountDriver:ASCOMMountDriver',
+              'simulator': 'MountDriver:SimulatedMountDriver'},
+    'screenshot': {'exe': 'ScreenshotService:ExeScreenshotBackend',
+                   'stub': 'ScreenshotService:StubScreenshotBackend'},
+    'camera': {'bye': 'Drivers:ExternalProgram',
+               'simulator': 'DeviceSimulators:FakeBYEServer'},
+    'guider': {'phd': 'Drivers:ExternalProgram',
+               'simulator': 'DeviceSimulators:FakePHDServer'},
+    'guider_events': {'phd': 'Drivers:ExternalProgram',
+                      'simulator': 'DeviceSimulators:FakePHD2Server'},
+    'solver': {'astrotortilla': 'Drivers:BDSScripts',
+               'simulator': 'Drivers:SimulatedBDSScripts'},
+}
+
+
+def load(path):
+    """
+    Importiert eine Klasse erst bei Bedarf.
+    :param path: 'Modul:Klasse'
+    :return: Klasse
+    """
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def driver(kind, name, *args, **kwargs):
+    """
+    Erzeugt den Treiber einer Geräteart.
+    :param kind: Geräteart, z.B. 'mount'
+    :param name: Treiber aus der Konfiguration, z.B. 'ascom' oder 'simulator'
+    :return: Treiber-Objekt
+    :raises ValueError: bei unbekannten Treibern.
+    """
+    try:
+        path = DRIVERS[kind][name]
+    except KeyError:
+        raise ValueError("Unbekannter Treiber '%s' für %s, möglich: %s"
+                         % (name, kind, ", ".join(sorted(DRIVERS.get(kind, {})))))
+    return load(path)(*args, **kwargs)
+
+
+class Lazy(object):
+    """
+    Stellvertreter, der das eigentliche Objekt erst beim ersten Zugriff erzeugt,
+    z.B. für Dienste, die astropy benötigen. warm() erzeugt es vorab, etwa in
+    einer Hintergrund-Aufgabe nach dem Start.
+    """
+
+    def __init__(self, factory):
+        """
+        :param factory: Funktion ohne Argumente, die das Objekt erzeugt.
+        """
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def warm(self):
+        """
+        :return: Das erzeugte Objekt
+        """
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+                target = self._target
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self.warm(), name)
+
+
+def simulator_bdscommand():
+    """
+    :return: BDSCommand für die Konfiguration, das statt BDSRun.exe fake_bdsrun aufruft.
+    """
+    return '"%s" "%s" bdsrun' % (sys.executable, importlib.util.find_spec("DeviceSimulators").origin)
+
+
+class ExternalProgram(object):
+    """
+    Endpunkt eines Programms, das selbst läuft (gestartet über BDS-Scripte) und
+    unter host:port erreichbar ist. start() und stop() tun nichts.
+    """
+
+    def __init__(self, host, port, **options):
+        self.host = host
+        self.port = port
+
+    def start(self):
+        """
+        :return: Port des Programms
+        """
+        return self.port
+
+    def stop(self):
+        pass
+
+
+class BDSScripts(object):
+    """
+    Solver über BDS-Scripte mit BDSRun.exe, z.B. 'at_platesolve'.
+    """
+
+    def __init__(self, command):
+        """
+        :param command: BDSCommand aus der Konfiguration
+        """
+        self.command = command
+
+
+class SimulatedBDSScripts(BDSScripts):
+    """
+    Solver über fake_bdsrun aus den Simulatoren, unabhängig von BDSCommand.
+    """
+
+    def __init__(self, command=None):
+        BDSScripts.__init__(self, simulator_bdscommand())
+
+
+class DeviceEndpoints(SimplePlugin):
+    """
+    Erzeugt und startet die Treiber von Kamera, Guider und PHD2-Event-Server
+    vor den Geräteverbindungen. Für die echten Programme geschieht dabei nichts,
+    die Simulatoren lauschen danach auf den Ports, unter denen der Server BYE,
+    PHD und PHD2 erwartet. Zusammen mit den übrigen Simulator-Treibern läuft
+    der ganze Server so ohne Windows und ohne Geräte ('--simulate').
+    """
+
+    def __init__(self, bus, endpoints):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param endpoints: Dict Geräteart -> (Treiber, host, port, Dict mit Optionen der Simulatoren)
+        """
+        SimplePlugin.__init__(self, bus)
+        self.endpoints = endpoints
+        self.drivers = {}
+
+    def start(self):
+        if self.drivers:
+            return
+        # Nach einem Stopp sind die Simulatoren geschlossen, daher bei jedem Start neu erzeugen
+        for kind, (name, host, port, options) in self.endpoints.items():
+            self.drivers[kind] = driver(kind, name, host, port, **options)
+            self.drivers[kind].start()
+        simulated = ["%s %d" % (kind, port) for kind, (name, host, port, options) in sorted(self.endpoints.items())
+                     if name == 'simulator']
+        if simulated:
+            self.bus.log("Simulatoren gestartet: " + ", ".join(simulated))
+    # Vor den Geräteverbindungen (Priorität 50) starten
+    start.priority = 40
+
+    def stop(self):
+        for endpoint in self.drivers.values():
+            endpoint.stop()
+        self.drivers = {}
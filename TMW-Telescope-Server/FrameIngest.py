@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import http.client
+import os
+import queue
+import re
+import sqlite3
+import tarfile
+import threading
+import time
+from urllib.parse import quote, urlsplit
+
+from cherrypy.process.plugins import SimplePlugin
+
+# Dateiendungen, die als Aufnahme gelten
+RAW_EXTENSIONS = ('.cr2', '.cr3', '.nef', '.arw', '.dng', '.fit', '.fits')
+
+
+def file_sha256(path, blocksize=1024 * 1024):
+    """
+    :param path: Pfad der Datei
+    :param blocksize: Größe der gelesenen Blöcke in Bytes
+    :return: SHA-256 der Datei als Hex-String
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def session_of(timestamp):
+    """
+    Beobachtungsnacht einer Aufnahme: Aufnahmen nach Mitternacht zählen zur Nacht des Vortages.
+    :param timestamp: Aufnahmezeit (Unix-Zeit)
+    :return: Datum der Nacht als 'YYYY-MM-DD' (Ortszeit)
+    """
+    return (datetime.datetime.fromtimestamp(timestamp) - datetime.timedelta(hours=12)).date().isoformat()
+
+
+def parse_frame_name(name):
+    """
+    Liest Belichtungszeit und ISO aus dem Dateinamen, wie BYE ihn vergibt,
+    z.B. 'M31_LIGHT_300s_800iso_+22c_20160812-23h11m04s.CR2'.
+    :param name: Dateiname
+    :return: Dict mit 'exposure' und 'iso', soweit erkennbar.
+    """
+    meta = {}
+    match = re.search(r"(?:^|_)(\d+(?:\.\d+)?)s(?:_|$)", name)
+    if match:
+        meta['exposure'] = float(match.group(1))
+    match = re.search(r"(?:iso(\d+)|(\d+)iso)", name, re.IGNORECASE)
+    if match:
+        meta['iso'] = int(match.group(1) or match.group(2))
+    return meta
+
+
+def tar_stream(frames, blocksize=1024 * 1024):
+    """
+    Erzeugt ein tar-Archiv der Aufnahmen stückweise, ohne es im Speicher
+    aufzubauen. Jede Datei liegt unter '<session>/<name>'. Nicht mehr
+    vorhandene Dateien werden übersprungen. Kommt ein Name in einer Nacht
+    mehrfach vor (z.B. nach einem Neustart der Kamera-Zählung), erhalten die
+    weiteren Dateien die ID der Aufnahme im Namen, z.B. 'IMG_0001_42.CR2'.
+    :param frames: Aufnahmen aus dem Katalog
+    :param blocksize: Größe der gelesenen Blöcke in Bytes
+    :return: Generator der tar-Daten
+    """
+    members = set()
+    for frame in frames:
+        try:
+            f = open(frame['path'], 'rb')
+        except OSError:
+            continue
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            member = "%s/%s" % (frame['session'] or "unknown", frame['name'])
+            root, ext = os.path.splitext(member)
+            while member in members:
+                root = "%s_%s" % (root, frame['id'])
+                member = root + ext
+            members.add(member)
+            info = tarfile.TarInfo(member)
+            info.size = size
+            info.mtime = int(frame['mtime'] or time.time())
+            yield info.tobuf(tarfile.PAX_FORMAT)
+            remaining = size
+            while remaining > 0:
+                block = f.read(min(blocksize, remaining))
+                if not block:
+                    # Datei wurde während des Lesens gekürzt: mit Nullen auffüllen
+                    block = b"\0" * min(blocksize, remaining)
+                remaining -= len(block)
+                yield block
+        if size % tarfile.BLOCKSIZE:
+            yield b"\0" * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+class FrameCatalog(object):
+    """
+    Lokaler Katalog aller Aufnahmen in SQLite mit Prüfsumme, Aufnahmedaten,
+    Beobachtungsnacht ('session') und Archiv-Zustand ('pending', 'uploading',
+    'retry', 'done', 'failed', 'local').
+    """
+
+    columns = ('id', 'path', 'name', 'size', 'mtime', 'sha256', 'exposure', 'iso', 'target', 'sequence',
+               'session', 'captured', 'ingested', 'archive_state', 'attempts', 'retry_at', 'archived', 'error')
+
+    def __init__(self, path):
+        """
+        :param path: Datei der Datenbank, ':memory:' für einen flüchtigen Katalog.
+        """
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            if path != ':memory:':
+                self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS frames (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, name TEXT NOT NULL, size INTEGER,
+                mtime REAL, sha256 TEXT, exposure REAL, iso INTEGER, target TEXT, sequence TEXT,
+                session TEXT, captured REAL, ingested REAL, archive_state TEXT, attempts INTEGER DEFAULT 0,
+                retry_at REAL, archived REAL, error TEXT)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS frames_captured ON frames (captured)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS frames_target ON frames (target, captured)")
+            # Kataloge ohne Spalte 'session' ergänzen
+            if 'session' not in [r[1] for r in self.db.execute("PRAGMA table_info(frames)")]:
+                self.db.execute("ALTER TABLE frames ADD COLUMN session TEXT")
+                for frame_id, captured in self.db.execute("SELECT id, captured FROM frames").fetchall():
+                    self.db.execute("UPDATE frames SET session = ? WHERE id = ?", (session_of(captured), frame_id))
+            self.db.execute("CREATE INDEX IF NOT EXISTS frames_archive ON frames (archive_state)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS frames_session ON frames (session, target, captured)")
+
+    def add(self, frame):
+        """
+        :param frame: Dict mit Spalten der Tabelle (ohne id)
+        :return: ID der neuen Aufnahme, None wenn der Pfad schon bekannt ist.
+        """
+        keys = [k for k in frame if k in self.columns and k != 'id']
+        with self.lock, self.db:
+            cur = self.db.execute("INSERT OR IGNORE INTO frames (%s) VALUES (%s)"
+                                  % (", ".join(keys), ", ".join("?" * len(keys))), [frame[k] for k in keys])
+            return cur.lastrowid if cur.rowcount else None
+
+    def update(self, frame_id, **fields):
+        """
+        Ändert Spalten einer Aufnahme.
+        :param frame_id: ID der Aufnahme
+        :param fields: Spalte -> neuer Wert
+        """
+        keys = [k for k in fields if k in self.columns and k != 'id']
+        if not keys:
+            return
+        with self.lock, self.db:
+            self.db.execute("UPDATE frames SET %s WHERE id = ?" % ", ".join(k + " = ?" for k in keys),
+                            [fields[k] for k in keys] + [frame_id])
+
+    def update_path(self, path, **fields):
+        """
+        Ändert Spalten einer Aufnahme anhand ihres Pfades.
+        :return: True, wenn die Aufnahme bekannt ist.
+        """
+        frame = self.find(path)
+        if frame is None:
+            return False
+        self.update(frame['id'], **fields)
+        return True
+
+    def get(self, frame_id):
+        """
+        :param frame_id: ID der Aufnahme
+        :return: Aufnahme als Dict, None wenn unbekannt.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT * FROM frames WHERE id = ?", (frame_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def find(self, path):
+        """
+        :param path: Pfad der Datei
+        :return: Aufnahme als Dict, None wenn unbekannt.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT * FROM frames WHERE path = ?", (path,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def paths(self):
+        """
+        :return: Menge aller bekannten Pfade
+        """
+        with self.lock:
+            return set(r[0] for r in self.db.execute("SELECT path FROM frames"))
+
+    def ids(self, states, before=None):
+        """
+        :param states: Archiv-Zustände
+        :param before: Optional nur Aufnahmen mit retry_at vor diesem Zeitpunkt
+        :return: IDs der Aufnahmen in diesen Zuständen, älteste zuerst.
+        """
+        sql = "SELECT id FROM frames WHERE archive_state IN (%s)" % ", ".join("?" * len(states))
+        args = list(states)
+        if before is not None:
+            sql += " AND retry_at <= ?"
+            args.append(before)
+        with self.lock:
+            return [r[0] for r in self.db.execute(sql + " ORDER BY id", args)]
+
+    def query(self, session=None, target=None, since=None, until=None, state=None, ids=None, after=0, limit=100):
+        """
+        Durchsucht den Katalog. Die Seiten werden über die ID fortgesetzt ('after'),
+        damit neu hinzukommende Aufnahmen die Seiten nicht verschieben.
+        :param session: Beobachtungsnacht 'YYYY-MM-DD'
+        :param target: Ziel
+        :param since: Aufnahmezeit ab (Unix-Zeit)
+        :param until: Aufnahmezeit bis (Unix-Zeit)
+        :param state: Archiv-Zustand
+        :param ids: Liste von IDs
+        :param after: Nur Aufnahmen mit größerer ID
+        :param limit: Maximale Anzahl, None für alle
+        :return: Liste der Aufnahmen als Dict, nach ID sortiert.
+        """
+        where = ["id > ?"]
+        args = [after]
+        for column, op, value in (('session', '=', session), ('target', '=', target), ('captured', '>=', since),
+                                  ('captured', '<=', until), ('archive_state', '=', state)):
+            if value is not None:
+                where.append("%s %s ?" % (column, op))
+                args.append(value)
+        if ids is not None:
+            where.append("id IN (%s)" % ", ".join("?" * len(ids)))
+            args.extend(ids)
+        sql = "SELECT * FROM frames WHERE " + " AND ".join(where) + " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self.lock:
+            return [dict(r) for r in self.db.execute(sql, args)]
+
+    def sessions(self):
+        """
+        :return: Liste der Beobachtungsnächte mit Anzahl der Aufnahmen und Zielen, neueste zuerst.
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT session, COUNT(*), GROUP_CONCAT(DISTINCT target) FROM frames "
+                                   "GROUP BY session ORDER BY session DESC").fetchall()
+        return [{'session': r[0], 'frames': r[1], 'targets': r[2].split(",") if r[2] else []} for r in rows]
+
+    def counts(self):
+        """
+        :return: Dict Archiv-Zustand -> Anzahl der Aufnahmen
+        """
+        with self.lock:
+            return dict((r[0], r[1]) for r in
+                        self.db.execute("SELECT archive_state, COUNT(*) FROM frames GROUP BY archive_state"))
+
+
+class FrameIngest(SimplePlugin):
+    """
+    Überwacht das Ausgabeverzeichnis von BYE. Neue Aufnahmen werden erfasst,
+    sobald Größe und Änderungszeit zwischen zwei Durchläufen gleich bleiben,
+    mit Prüfsumme im FrameCatalog abgelegt und von 'workers' Threads per HTTP PUT
+    an das Archiv übertragen. Abgebrochene Übertragungen werden per HEAD und
+    Content-Range fortgesetzt, Fehlschläge mit wachsendem Abstand wiederholt.
+    Nach einem Neustart werden offene Übertragungen wieder aufgenommen.
+    Jede neue Aufnahme wird auf dem Bus als 'frame_added' (ID) veröffentlicht.
+    """
+    thread = None
+
+    def __init__(self, bus, catalog, directory, interval=2.0, archive_url=None, workers=2, retries=5,
+                 timeout=60, extensions=RAW_EXTENSIONS):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param catalog: FrameCatalog
+        :param directory: Ausgabeverzeichnis von BYE (inklusive Unterverzeichnissen)
+        :param interval: Abstand der Verzeichnis-Durchläufe in Sekunden.
+        :param archive_url: Basis-URL des Archivs, ohne Angabe werden Aufnahmen nur katalogisiert.
+        :param workers: Anzahl gleichzeitiger Übertragungen.
+        :param retries: Anzahl der Versuche je Aufnahme.
+        :param timeout: Socket-Timeout der Übertragung in Sekunden.
+        :param extensions: Dateiendungen der Aufnahmen
+        """
+        SimplePlugin.__init__(self, bus)
+        self.catalog = catalog
+        self.directory = directory
+        self.interval = interval
+        self.archive_url = archive_url.rstrip("/") if archive_url else None
+        self.workers = workers
+        self.retries = retries
+        self.timeout = timeout
+        self.extensions = extensions
+        self.q = queue.Queue()
+        self.uploaders = []
+        self.hints = {}
+        self.pending = {}
+        self.indexed = set()
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        self.running = True
+        self.indexed = self.catalog.paths()
+        if self.archive_url:
+            # Fortsetzen, was beim letzten Lauf nicht fertig wurde
+            for frame_id in self.catalog.ids(('pending', 'uploading')):
+                self.q.put(frame_id)
+            for i in range(self.workers - len(self.uploaders)):
+                thread = threading.Thread(target=self.upload_worker)
+                thread.daemon = True
+                thread.start()
+                self.uploaders.append(thread)
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.uploaders:
+            self.q.put(None)
+        for thread in self.uploaders:
+            thread.join()
+        self.uploaders = []
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Überwachungs-Schleife.
+        """
+        while self.running:
+            started = time.time()
+            try:
+                self.scan()
+                if self.archive_url:
+                    for frame_id in self.catalog.ids(('retry',), before=time.time()):
+                        self.catalog.update(frame_id, archive_state='pending')
+                        self.q.put(frame_id)
+            except Exception as e:
+                self.bus.log("Ingest: %s" % e, level=30)
+            with self.cond:
+                if self.running:
+                    self.cond.wait(max(0, self.interval - (time.time() - started)))
+
+    def scan(self):
+        """
+        Ein Durchlauf durch das Verzeichnis.
+        :return: IDs der neu erfassten Aufnahmen
+        """
+        added = []
+        seen = {}
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.lower().endswith(self.extensions):
+                    continue
+                path = os.path.normcase(os.path.abspath(os.path.join(root, name)))
+                if path in self.indexed:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen[path] = (st.st_size, st.st_mtime)
+                # Erst erfassen, wenn BYE die Datei nicht mehr schreibt
+                if self.pending.get(path) == seen[path] and st.st_size > 0:
+                    frame_id = self.ingest(path, st)
+                    if frame_id is not None:
+                        added.append(frame_id)
+                    del seen[path]
+        self.pending = seen
+        return added
+
+    def ingest(self, path, st):
+        """
+        Erfasst eine Aufnahme im Katalog und reiht sie zur Übertragung ein.
+        :param path: Normalisierter Pfad der Datei
+        :param st: os.stat der Datei
+        :return: ID der Aufnahme
+        """
+        name = os.path.basename(path)
+        frame = {'path': path, 'name': name, 'size': st.st_size, 'mtime': st.st_mtime,
+                 'sha256': file_sha256(path), 'session': session_of(st.st_mtime), 'captured': st.st_mtime,
+                 'ingested': time.time(),
+                 'archive_state': 'pending' if self.archive_url else 'local'}
+        frame.update(parse_frame_name(name))
+        with self.cond:
+            frame.update(self.hints.pop(path, {}))
+            frame_id = self.catalog.add(frame)
+            self.indexed.add(path)
+        if frame_id is not None:
+            if self.archive_url:
+                self.q.put(frame_id)
+            # z.B. für das Vorberechnen der Vorschau
+            self.bus.publish('frame_added', frame_id)
+        return frame_id
+
+    def annotate(self, path, **meta):
+        """
+        Ergänzt Aufnahmedaten, die nicht im Dateinamen stehen (z.B. Ziel und
+        Sequenz aus dem Sequencer). Ist die Datei noch nicht erfasst, werden
+        die Angaben bei der Erfassung übernommen.
+        :param path: Pfad der Datei, wie BYE ihn meldet.
+        :param meta: z.B. exposure, iso, target, sequence
+        """
+        path = os.path.normcase(os.path.abspath(path))
+        with self.cond:
+            if path not in self.indexed:
+                self.hints[path] = meta
+                return
+        self.catalog.update_path(path, **meta)
+
+    def upload_worker(self):
+        """
+        Übertragungs-Thread.
+        """
+        while True:
+            frame_id = self.q.get()
+            if frame_id is None:
+                return
+            try:
+                self.upload(frame_id)
+            except Exception as e:
+                # z.B. Datenbank gesperrt: der Thread läuft weiter, die Aufnahme kommt später erneut an die Reihe
+                self.bus.log("Archiv: Aufnahme %s: %s" % (frame_id, e), level=30)
+                try:
+                    self.catalog.update(frame_id, archive_state='retry', retry_at=time.time() + 60)
+                except Exception:
+                    pass
+
+    def upload(self, frame_id):
+        """
+        Überträgt eine Aufnahme und hält das Ergebnis im Katalog fest.
+        :param frame_id: ID der Aufnahme
+        """
+        frame = self.catalog.get(frame_id)
+        if frame is None or frame['archive_state'] not in ('pending', 'uploading'):
+            return
+        self.catalog.update(frame_id, archive_state='uploading')
+        try:
+            self.push(frame)
+            self.catalog.update(frame_id, archive_state='done', archived=time.time(), error=None)
+        except Exception as e:
+            attempts = frame['attempts'] + 1
+            if attempts >= self.retries:
+                self.catalog.update(frame_id, archive_state='failed', attempts=attempts, error=str(e))
+            else:
+                self.catalog.update(frame_id, archive_state='retry', attempts=attempts, error=str(e),
+                                    retry_at=time.time() + min(300, 2 ** attempts))
+
+    def _connection(self):
+        parts = urlsplit(self.archive_url)
+        cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        return cls(parts.netloc, timeout=self.timeout), parts.path
+
+    def push(self, frame):
+        """
+        Überträgt eine Aufnahme an '<archive_url>/<sha256>/<name>'. Liegt dort
+        bereits ein Teil, wird ab dessen Ende fortgesetzt.
+        :param frame: Aufnahme aus dem Katalog
+        :raises IOError: wenn das Archiv die Aufnahme nicht annimmt.
+        """
+        conn, base = self._connection()
+        url = base + "/" + frame['sha256'] + "/" + quote(frame['name'])
+        try:
+            conn.request("HEAD", url)
+            r = conn.getresponse()
+            r.read()
+            offset = 0
+            if r.status == 200:
+                offset = int(r.getheader('Content-Length', 0))
+                if offset == frame['size']:
+                    return
+                if offset > frame['size']:
+                    offset = 0
+            headers = {'Content-Length': str(frame['size'] - offset), 'X-Checksum-SHA256': frame['sha256'],
+                       'Content-Type': 'application/octet-stream'}
+            if offset:
+                headers['Content-Range'] = "bytes %d-%d/%d" % (offset, frame['size'] - 1, frame['size'])
+            with open(frame['path'], 'rb') as f:
+                f.seek(offset)
+                conn.request("PUT", url, body=f, headers=headers)
+                r = conn.getresponse()
+                r.read()
+            if r.status not in (200, 201, 204):
+                raise IOError("Archiv antwortet %d %s" % (r.status, r.reason))
+        finally:
+            conn.close()
+
+    def retry_failed(self):
+        """
+        Setzt endgültig fehlgeschlagene Übertragungen zurück.
+        :return: Anzahl der erneut eingereihten Aufnahmen
+        """
+        ids = self.catalog.ids(('failed',))
+        for frame_id in ids:
+            self.catalog.update(frame_id, archive_state='pending', attempts=0, error=None)
+            self.q.put(frame_id)
+        return len(ids)
+
+    def metrics(self):
+        """
+        :return: Dict mit Anzahl der Aufnahmen je Archiv-Zustand, Warteschlange und noch nicht stabilen Dateien.
+        """
+        return {'states': self.catalog.counts(), 'queued': self.q.qsize(), 'settling': len(self.pending),
+                'archive': self.archive_url}
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+import functools
+import threading
+import time
+
+import cherrypy
+
+# Grenzen der Histogramme in Sekunden
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                          for n, v in zip(names, values)) + "}"
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded(object):
+    """
+    Basis für Counter und Histogram: jeder Thread zählt in seinem eigenen Dict
+    (ohne Lock), erst beim Abfragen werden die Teile zusammengezählt. Teile
+    beendeter Threads werden dabei in 'retired' übernommen.
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.shards = []
+        self.retired = {}
+        self.lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _merge(self, target, key, value):
+        raise NotImplementedError
+
+    def collect(self):
+        """
+        :return: Dict Label-Werte -> zusammengezählter Wert
+        """
+        with self.lock:
+            result = {}
+            alive = []
+            for key, value in self.retired.items():
+                self._merge(result, key, value)
+            for thread, shard in self.shards:
+                # Während des Kopierens kann der Thread weiterzählen
+                items = list(shard.items())
+                for key, value in items:
+                    self._merge(result, key, value)
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    for key, value in items:
+                        self._merge(self.retired, key, value)
+            self.shards = alive
+            return result
+
+
+class Counter(_Sharded):
+    """
+    Monoton steigender Zähler, optional mit Labels.
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        """
+        :param amount: Zuwachs
+        :param labels: Werte der Labels in der Reihenfolge von 'labels'
+        """
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, target, key, value):
+        target[key] = target.get(key, 0) + value
+
+    def render(self):
+        return ["%s%s %s" % (self.name, _labels(self.labels, key), _number(value))
+                for key, value in sorted(self.collect().items())]
+
+
+class Histogram(_Sharded):
+    """
+    Histogramm mit festen Grenzen. Je Label-Kombination werden die Anzahl je
+    Bereich, Summe und Anzahl gezählt.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        _Sharded.__init__(self, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        """
+        :param value: Messwert, z.B. Dauer in Sekunden
+        :param labels: Werte der Labels in der Reihenfolge von 'labels'
+        """
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # Bereiche, danach +Inf, Summe
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, *labels):
+        """
+        Misst die Dauer eines with-Blocks.
+        """
+        return _Timer(self, labels)
+
+    def _merge(self, target, key, value):
+        counts = target.get(key)
+        if counts is None:
+            target[key] = list(value)
+        else:
+            for i, v in enumerate(value):
+                counts[i] += v
+
+    def render(self):
+        lines = []
+        for key, counts in sorted(self.collect().items()):
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                lines.append("%s_bucket%s %d" % (self.name, _labels(self.labels + ('le',), key + (_number(bound),)),
+                                                 total))
+            lines.append("%s_sum%s %s" % (self.name, _labels(self.labels, key), _number(counts[-1])))
+            lines.append("%s_count%s %d" % (self.name, _labels(self.labels, key), total))
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Gauge(object):
+    """
+    Momentanwert, der erst beim Abfragen ermittelt wird, z.B. die Tiefe einer Warteschlange.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, func, labels=()):
+        """
+        :param func: Funktion ohne Argumente; liefert eine Zahl oder bei Labels ein Dict Label-Werte -> Zahl.
+        """
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labels = tuple(labels)
+
+    def render(self):
+        values = self.func()
+        if not self.labels:
+            values = {(): values}
+        return ["%s%s %s" % (self.name, _labels(self.labels, key if isinstance(key, tuple) else (key,)),
+                             _number(value))
+                for key, value in sorted(values.items())]
+
+
+class Registry(object):
+    """
+    Sammlung aller Kennzahlen, Ausgabe im Textformat von Prometheus.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics = [m for m in self.metrics if m.name != metric.name] + [metric]
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, func, labels=()):
+        return self.register(Gauge(name, help, func, labels))
+
+    def render(self):
+        """
+        :return: Alle Kennzahlen als Text (Prometheus Exposition Format 0.0.4)
+        """
+        lines = []
+        for metric in list(self.metrics):
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Eine fehlerhafte Kennzahl soll die übrigen nicht verhindern
+                lines.append("# %s: %s" % (metric.name, e))
+        return "\n".join(lines) + "\n"
+
+
+# Gemeinsame Kennzahlen des Servers
+registry = Registry()
+http_requests = registry.histogram("tmw_http_request_seconds", "Bearbeitungszeit der Routen", ('route', 'code'))
+http_bytes = registry.counter("tmw_http_response_bytes_total", "Ausgelieferte Bytes je Route", ('route',))
+device_seconds = registry.histogram("tmw_device_seconds", "Dauer der Befehle an Geräte und Programme",
+                                    ('device', 'call'))
+device_errors = registry.counter("tmw_device_errors_total", "Fehlgeschlagene Befehle an Geräte", ('device', 'call'))
+task_wait = registry.histogram("tmw_task_wait_seconds", "Wartezeit der Hintergrund-Aufgaben in der Warteschlange",
+                               ('lane',), WAIT_BUCKETS)
+task_run = registry.histogram("tmw_task_run_seconds", "Laufzeit der Hintergrund-Aufgaben", ('lane',), WAIT_BUCKETS)
+
+
+def timed(device, call=None):
+    """
+    Decorator: misst die Dauer jedes Aufrufs in 'tmw_device_seconds' und zählt Fehler.
+    :param device: Gerät bzw. Programm, z.B. 'phd'
+    :param call: Name des Befehls oder Funktion, die ihn aus den Argumenten bildet;
+                 ohne Angabe der Funktionsname.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            name = call(*args, **kwargs) if callable(call) else call or func.__name__
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                device_errors.inc(1, device, name)
+                raise
+            finally:
+                device_seconds.observe(time.perf_counter() - started, device, name)
+        return wrapper
+    return decorator
+
+
+class MetricsTool(cherrypy.Tool):
+    """
+    CherryPy-Tool: misst Bearbeitungszeit und ausgelieferte Bytes jeder Anfrage
+    je Route ('tools.metrics.on'). Gestreamte Antworten werden beim Senden
+    gezählt, die Zeit endet erst mit dem letzten Byte.
+    """
+
+    def __init__(self):
+        cherrypy.Tool.__init__(self, 'on_start_resource', self._start, priority=10)
+
+    def _setup(self):
+        cherrypy.Tool._setup(self)
+        request = cherrypy.serving.request
+        request.hooks.attach('before_finalize', self._stream, priority=90)
+        request.hooks.attach('on_end_request', self._end, priority=90)
+
+    @staticmethod
+    def _start():
+        request = cherrypy.serving.request
+        request.metrics_started = time.perf_counter()
+        # Später ersetzen Tools wie json_out den Handler, daher jetzt merken
+        handler = getattr(request.handler, 'callable', None)
+        request.metrics_route = getattr(handler, '__name__', 'other')
+
+    @staticmethod
+    def _stream():
+        response = cherrypy.serving.response
+        if response.stream:
+            route = cherrypy.serving.request.metrics_route
+            body = response.body
+
+            def counting():
+                sent = 0
+                try:
+                    for chunk in body:
+                        sent += len(chunk)
+                        yield chunk
+                finally:
+                    http_bytes.inc(sent, route)
+            response.body = counting()
+
+    @staticmethod
+    def _end():
+        request = cherrypy.serving.request
+        started = getattr(request, 'metrics_started', None)
+        if started is None:
+            return
+        response = cherrypy.serving.response
+        route = request.metrics_route
+        http_requests.observe(time.perf_counter() - started, route, str(response.status)[:3])
+        if not response.stream and isinstance(response.body, list):
+            http_bytes.inc(sum(len(chunk) for chunk in response.body), route)
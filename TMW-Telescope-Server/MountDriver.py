@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import Future
+import itertools
+import math
+import queue
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+
+from Metrics import timed
+
+
+class MountDriver(object):
+    """
+    Schnittstelle der Montierungs-Treiber. Alle Methoden werden ausschließlich
+    aus dem Thread des MountService aufgerufen.
+    """
+
+    def connect(self):
+        """
+        Verbindet den Treiber mit der Montierung.
+        :return:
+        """
+        raise NotImplementedError
+
+    def disconnect(self):
+        """
+        Gibt die Verbindung frei, der nächste Befehl verbindet über connect() neu.
+        :return:
+        """
+        raise NotImplementedError
+
+    def connection_lost(self, error):
+        """
+        :param error: Exception eines Befehls
+        :return: True, wenn die Verbindung danach unbrauchbar ist und neu aufgebaut werden muss.
+        """
+        return False
+
+    def start(self):
+        """
+        Meldet einen Client an und stellt die Verbindung zum Teleskop her.
+        :return: True, wenn das Teleskop schwenken kann.
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Meldet alle Clients ab, EQMOD beendet sich.
+        :return:
+        """
+        raise NotImplementedError
+
+    def park(self):
+        raise NotImplementedError
+
+    def unpark(self):
+        raise NotImplementedError
+
+    def set_park(self):
+        raise NotImplementedError
+
+    def slew_to_coordinates(self, ra, dec):
+        """
+        Startet einen Schwenk, ohne auf dessen Ende zu warten.
+        :param ra: Rektaszension (JNow) in Stunden
+        :param dec: Deklination (JNow) in Grad
+        :return:
+        """
+        raise NotImplementedError
+
+    def abort_slew(self):
+        raise NotImplementedError
+
+    def state(self):
+        """
+        :return: Dict mit ra, dec, alt, az, slewing, atpark und tracking.
+        """
+        raise NotImplementedError
+
+
+class ASCOMMountDriver(MountDriver):
+    """
+    Treiber für EQMOD (bzw. jede ASCOM-Montierung) über COM. Das COM-Objekt wird
+    einmalig im Thread des MountService erzeugt und dort weiterverwendet.
+    """
+
+    def __init__(self, progid="EQMOD.Telescope"):
+        self.progid = progid
+        self.o = None
+        self.com_error = None
+
+    def connect(self):
+        # Erst hier importieren: nur unter Windows vorhanden und nur im Mount-Thread benötigt
+        import pythoncom
+        import pywintypes
+        import win32com.client
+        self.com_error = pywintypes.com_error
+        pythoncom.CoInitialize()
+        self.o = win32com.client.Dispatch(self.progid)
+
+    def disconnect(self):
+        import pythoncom
+        self.o = None
+        pythoncom.CoUninitialize()
+
+    def connection_lost(self, error):
+        # Z.B. EQMOD beendet: das COM-Objekt ist nicht mehr erreichbar
+        return self.com_error is not None and isinstance(error, self.com_error)
+
+    def start(self):
+        self.o.Connected = True
+        self.o.IncClientCount()
+        return bool(self.o.CanSlew)
+
+    def stop(self):
+        self.o.StopClientCount()
+
+    def park(self):
+        self.o.Park()
+
+    def unpark(self):
+        self.o.Unpark()
+
+    def set_park(self):
+        self.o.SetPark()
+
+    def slew_to_coordinates(self, ra, dec):
+        self.o.SlewToCoordinatesAsync(ra, dec)
+
+    def abort_slew(self):
+        self.o.AbortSlew()
+
+    def state(self):
+        o = self.o
+        return {'ra': o.RightAscension, 'dec': o.Declination, 'alt': o.Altitude, 'az': o.Azimuth,
+                'slewing': bool(o.Slewing), 'atpark': bool(o.AtPark), 'tracking': bool(o.Tracking)}
+
+
+class SimulatedMountDriver(MountDriver):
+    """
+    Reine Python-Montierung für Tests und Lasttests unter Linux. Schwenks
+    laufen mit fester Geschwindigkeit und benötigen dadurch realistische Zeit.
+    """
+
+    def __init__(self, lat=53.082806, lon=7.800694, slew_rate=4.0):
+        """
+        :param lat: Geographische Breite in Grad
+        :param lon: Geographische Länge in Grad
+        :param slew_rate: Schwenkgeschwindigkeit in Grad pro Sekunde
+        """
+        self.lat = lat
+        self.lon = lon
+        self.slew_rate = slew_rate
+        self.connected = False
+        self.atpark = True
+        self.park_position = (0.0, 90.0)
+        self.ra, self.dec = self.park_position
+        self.slew = None
+
+    def _lst(self):
+        """
+        :return: Lokale Sternzeit in Stunden (Näherung nach Meeus, genügt für die Simulation).
+        """
+        jd = time.time() / 86400.0 + 2440587.5
+        gmst = 18.697374558 + 24.06570982441908 * (jd - 2451545.0)
+        return (gmst + self.lon / 15.0) % 24
+
+    def _update(self):
+        """
+        Schreibt den Fortschritt eines laufenden Schwenks fort.
+        """
+        if self.slew is None:
+            return
+        start_ra, start_dec, target_ra, target_dec, started, duration = self.slew
+        fraction = min(1.0, (time.time() - started) / duration) if duration > 0 else 1.0
+        dra = ((target_ra - start_ra + 12) % 24) - 12
+        self.ra = (start_ra + dra * fraction) % 24
+        self.dec = start_dec + (target_dec - start_dec) * fraction
+        if fraction >= 1.0:
+            self.slew = None
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def start(self):
+        return self.connected
+
+    def stop(self):
+        pass
+
+    def park(self):
+        self._update()
+        self.slew_to_coordinates(*self.park_position, check_park=False)
+        self.atpark = True
+
+    def unpark(self):
+        self.atpark = False
+
+    def set_park(self):
+        self._update()
+        self.park_position = (self.ra, self.dec)
+
+    def slew_to_coordinates(self, ra, dec, check_park=True):
+        if check_park and self.atpark:
+            raise RuntimeError("Montierung ist geparkt")
+        self._update()
+        dra = abs(((float(ra) - self.ra + 12) % 24) - 12) * 15
+        distance = max(dra, abs(float(dec) - self.dec))
+        self.slew = (self.ra, self.dec, float(ra) % 24, float(dec), time.time(), distance / self.slew_rate)
+
+    def abort_slew(self):
+        self._update()
+        self.slew = None
+
+    def state(self):
+        self._update()
+        ha = math.radians((self._lst() - self.ra) * 15)
+        dec = math.radians(self.dec)
+        lat = math.radians(self.lat)
+        alt = math.asin(math.sin(lat) * math.sin(dec) + math.cos(lat) * math.cos(dec) * math.cos(ha))
+        az = math.atan2(-math.cos(dec) * math.sin(ha),
+                        math.sin(dec) * math.cos(lat) - math.cos(dec) * math.sin(lat) * math.cos(ha))
+        return {'ra': self.ra, 'dec': self.dec, 'alt': math.degrees(alt), 'az': math.degrees(az) % 360,
+                'slewing': self.slew is not None, 'atpark': self.atpark and self.slew is None,
+                'tracking': not self.atpark}
+
+
+class MountService(SimplePlugin):
+    """
+    Eigener Thread, der als einziger den Montierungs-Treiber besitzt. Befehle
+    aus beliebigen CherryPy-Threads werden über eine Warteschlange an ihn
+    übergeben. Damit entsteht nur ein COM-Objekt in einem Apartment, statt
+    eines pro Anfrage und Thread. Nach 'stop' (EQMOD beendet sich) und nach
+    Verbindungsfehlern wird der Treiber freigegeben, der nächste Befehl
+    verbindet neu.
+    Abbruch-Befehle überholen wartende Befehle in der Warteschlange, einen
+    laufenden Befehl (z.B. ein synchrones Park) unterbrechen sie nicht.
+    """
+    thread = None
+    # Befehle, die bis zum Ende der Bewegung dauern können (ASCOM Park() ist synchron)
+    LONG = ('start', 'park', 'unpark', 'slew_to_coordinates')
+    # Befehle, die vor allen wartenden ausgeführt werden
+    URGENT = ('abort_slew',)
+
+    def __init__(self, bus, driver, timeout=30, long_timeout=300):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param driver: MountDriver
+        :param timeout: Maximale Wartezeit auf die Ausführung eines Befehls in Sekunden.
+        :param long_timeout: Maximale Wartezeit für Befehle aus LONG (Parken, Schwenken) in Sekunden.
+        """
+        SimplePlugin.__init__(self, bus)
+        self.driver = driver
+        self.timeout = timeout
+        self.long_timeout = long_timeout
+        self.q = queue.PriorityQueue()
+        self.seq = itertools.count()
+        self.connected = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        if self.thread:
+            self.q.put((1, next(self.seq), None))
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while True:
+            item = self.q.get()[2]
+            if item is None:
+                if self.connected:
+                    self._disconnect()
+                return
+            method, args, future, connect = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            if not connect and not self.connected:
+                future.set_exception(ConnectionError("Montierung nicht verbunden"))
+                continue
+            try:
+                if not self.connected:
+                    self.driver.connect()
+                    self._set_connected(True)
+                result = getattr(self.driver, method)(*args)
+            except Exception as e:
+                if self.connected and self.driver.connection_lost(e):
+                    self._disconnect()
+                future.set_exception(e)
+                continue
+            if method == 'stop':
+                # EQMOD beendet sich nach StopClientCount, das COM-Objekt ist danach ungültig
+                self._disconnect()
+            future.set_result(result)
+
+    def _set_connected(self, connected):
+        with self.cond:
+            self.connected = connected
+            self.cond.notify_all()
+
+    def _disconnect(self):
+        self._set_connected(False)
+        try:
+            self.driver.disconnect()
+        except Exception:
+            pass
+
+    def wait_connected(self, timeout):
+        """
+        Wartet, bis der Treiber verbunden ist, ohne selbst zu verbinden.
+        :param timeout: Maximale Wartezeit in Sekunden.
+        :return: True, wenn der Treiber verbunden ist.
+        """
+        with self.cond:
+            if not self.connected:
+                self.cond.wait(timeout)
+            return self.connected
+
+    def wake(self):
+        """
+        Weckt alle in wait_connected() Wartenden, z.B. beim Beenden.
+        """
+        with self.cond:
+            self.cond.notify_all()
+
+    def submit(self, method, *args, connect=True):
+        """
+        Übergibt einen Befehl an den Mount-Thread, ohne zu warten.
+        :param method: Name der MountDriver-Methode
+        :param args: Argumente
+        :param connect: False: nicht selbst verbinden, ohne Verbindung schlägt der Befehl mit ConnectionError fehl.
+        :return: Future mit dem Ergebnis
+        """
+        future = Future()
+        self.q.put((0 if method in self.URGENT else 1, next(self.seq), (method, args, future, connect)))
+        return future
+
+    @timed('mount', lambda self, method, *args, **kwargs: method)
+    def call(self, method, *args, connect=True, timeout=None):
+        """
+        Führt einen Befehl im Mount-Thread aus und wartet auf das Ergebnis.
+        :param method: Name der MountDriver-Methode, z.B. 'park'
+        :param args: Argumente
+        :param connect: siehe submit()
+        :param timeout: Maximale Wartezeit in Sekunden, None: long_timeout für Befehle aus LONG, sonst timeout.
+        :return: Rückgabewert der Methode
+        """
+        if timeout is None:
+            timeout = self.long_timeout if method in self.LONG else self.timeout
+        future = self.submit(method, *args, connect=connect)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            # Noch nicht begonnene Befehle nicht mehr nachträglich ausführen
+            future.cancel()
+            raise
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+
+from Sequencer import SequenceAborted
+
+
+class TelemetryStopped(SequenceAborted):
+    """
+    Die Telemetrie wurde beendet (Server fährt herunter), während auf einen Schwenk gewartet wurde.
+    """
+    pass
+
+
+class MountTelemetry(SimplePlugin):
+    """
+    Zwischenspeicher für den Zustand der Montierung. Ein Hintergrund-Thread
+    fragt den MountService im eingestellten Takt ab, Anfragen lesen nur den
+    letzten Stand und berühren die Montierung nie selbst. Die letzten Werte
+    bleiben in einem Ringpuffer für Nachführ-Diagramme erhalten.
+    Während eines Schwenks wird im kürzeren Takt 'slew_interval' abgefragt,
+    damit auf das Schwenkende wartende Aufgaben ohne Verzögerung weiterlaufen.
+    Abgefragt wird nur, solange der MountService verbunden ist: eine Abfrage
+    würde sonst selbst verbinden und damit EQMOD starten.
+    """
+    thread = None
+
+    def __init__(self, bus, mount, interval=1.0, history=3600, slew_interval=0.25):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param mount: MountService
+        :param interval: Abfrage-Intervall in Sekunden.
+        :param slew_interval: Abfrage-Intervall während eines Schwenks in Sekunden.
+        :param history: Größe des Ringpuffers (Anzahl Werte).
+        """
+        SimplePlugin.__init__(self, bus)
+        self.mount = mount
+        self.interval = interval
+        self.slew_interval = slew_interval
+        self.slew_pending = 0
+        self.samples = deque(maxlen=history)
+        self.latest = None
+        self.error = None
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        self.running = True
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.mount.wake()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Abfrage-Schleife.
+        """
+        while self.running:
+            if not self.mount.wait_connected(self.interval):
+                with self.cond:
+                    self.error = "Montierung nicht verbunden"
+                continue
+            started = time.time()
+            try:
+                # Zwischen Warten und Ausführung kann 'stop' die Verbindung beendet haben
+                sample = self.mount.call('state', connect=False)
+                # Zeitpunkt der Anfrage, nicht der Antwort: so bildet der Wert sicher
+                # keinen Zustand vor einem früher eingereihten Befehl ab.
+                sample['time'] = started
+                error = None
+            except Exception as e:
+                sample = None
+                error = str(e)
+            with self.cond:
+                if sample is not None:
+                    self.latest = sample
+                    self.samples.append(sample)
+                self.error = error
+                self.cond.notify_all()
+                fast = self.slew_pending or (self.latest is not None and self.latest['slewing'])
+                if self.running:
+                    self.cond.wait(max(0, (self.slew_interval if fast else self.interval) - (time.time() - started)))
+
+    def state(self):
+        """
+        :return: Letzter Zustand der Montierung (Dict) inklusive Alter in Sekunden, None wenn noch keiner vorliegt.
+        """
+        with self.cond:
+            if self.latest is None:
+                return None
+            state = dict(self.latest)
+            state['age'] = time.time() - state['time']
+            return state
+
+    def history(self, count=None, since=None):
+        """
+        :param count: Anzahl der neuesten Werte, Standard alle.
+        :param since: Nur Werte nach diesem Zeitpunkt (Unix-Zeit).
+        :return: Liste der Werte, ältester zuerst.
+        """
+        with self.cond:
+            samples = list(self.samples)
+        if since is not None:
+            samples = [s for s in samples if s['time'] > since]
+        if count is not None:
+            samples = samples[-count:] if count > 0 else []
+        return samples
+
+    def wake(self):
+        """
+        Weckt alle in wait_for_slew() Wartenden, damit sie einen Abbruch bemerken.
+        """
+        with self.cond:
+            self.cond.notify_all()
+
+    def wait_for_slew(self, issued, settle=0.0, timeout=300, abort=None):
+        """
+        Wartet, bis ein Schwenk beendet ist, und anschließend die Beruhigungszeit.
+        Alle Wartenden teilen sich die Abfrage-Schleife der Telemetrie.
+        :param issued: Zeitpunkt (Unix-Zeit), nachdem der Schwenk-Befehl ausgeführt wurde.
+        :param settle: Beruhigungszeit nach dem Schwenk in Sekunden.
+        :param timeout: Maximale Wartezeit auf das Schwenkende in Sekunden.
+        :param abort: Optional threading.Event des Sequencers, nach dem Setzen wake() aufrufen.
+        :return: Dict mit slew (Schwenkdauer), settle und total in Sekunden.
+        :raises TimeoutError: wenn der Schwenk nicht rechtzeitig endet.
+        :raises SequenceAborted: wenn 'abort' gesetzt wurde.
+        :raises TelemetryStopped: wenn die Telemetrie beim Warten beendet wird.
+        """
+        deadline = issued + timeout
+        with self.cond:
+            self.slew_pending += 1
+            # Schneller Takt sofort, nicht erst nach dem laufenden Intervall
+            self.cond.notify_all()
+            try:
+                while True:
+                    if abort is not None and abort.is_set():
+                        raise SequenceAborted()
+                    latest = self.latest
+                    # Nur Werte zählen, die nach dem Start des Schwenks abgefragt wurden
+                    if latest is not None and latest['time'] > issued and not latest['slewing']:
+                        slewed = latest['time']
+                        break
+                    if not self.running:
+                        raise TelemetryStopped("Telemetrie beendet, Schwenkende unbekannt")
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError("Schwenk nicht innerhalb von %d s beendet" % timeout)
+                    self.cond.wait(remaining)
+            finally:
+                self.slew_pending -= 1
+
+            settled = slewed + settle
+            while time.time() < settled:
+                if abort is not None and abort.is_set():
+                    raise SequenceAborted()
+                if not self.running:
+                    raise TelemetryStopped("Telemetrie beendet, Beruhigungszeit nicht abgewartet")
+                self.cond.wait(settled - time.time())
+        return {'slew': slewed - issued, 'settle': settle, 'total': time.time() - issued}
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import csv
+import json
+import os
+import re
+import threading
+import time
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+from Metrics import device_seconds
+
+
+def normalize(name):
+    """
+    Vereinheitlicht Objektnamen, damit 'M 31', 'm31' und 'Messier 31' bzw.
+    'NGC 224' und 'NGC0224' denselben Eintrag treffen.
+    :param name: Objektname
+    :return: Normalisierter Name
+    """
+    name = " ".join(name.upper().split())
+    name = re.sub(r"^MESSIER\s*", "M", name)
+    match = re.match(r"^(M|NGC|IC)\s*0*(\d+)\s*([A-Z]?)$", name)
+    if match:
+        return match.group(1) + match.group(2) + match.group(3)
+    return name
+
+
+def parse_angle(value, hours=False):
+    """
+    Liest einen Winkel als Dezimalgrad oder sexagesimal ('00:42:44.3', '+41 16 09').
+    :param value: Winkel als String
+    :param hours: True, wenn sexagesimale Angaben Stunden sind (Rektaszension).
+    :return: Winkel in Grad
+    """
+    value = value.strip()
+    parts = re.split(r"[:\s]+", value)
+    if len(parts) == 1:
+        return float(value)
+    sign = -1 if value.startswith("-") else 1
+    degrees = sum(abs(float(p)) / 60 ** i for i, p in enumerate(parts))
+    return sign * degrees * (15 if hours else 1)
+
+
+class NameResolver(object):
+    """
+    Löst Objektnamen in Koordinaten auf. Zuerst wird der Offline-Katalog
+    befragt, dann der persistente Cache, erst zuletzt Sesame über das Netz.
+    So funktioniert ein GoTo auf bekannte Objekte auch ohne Internetverbindung.
+    """
+
+    def __init__(self, cache_file="name_cache.json", catalog_file=None, ttl=30 * 86400, max_entries=5000):
+        """
+        :param cache_file: JSON-Datei des persistenten Caches.
+        :param catalog_file: Optionaler Offline-Katalog als CSV mit den Spalten Name, RA und Dec,
+                             optional M für die Messier-Nummer (Aufbau wie NGC.csv von OpenNGC).
+                             Mehrere Dateien durch Komma getrennt, z.B. catalog/messier.csv und
+                             eine vollständige NGC.csv.
+        :param ttl: Gültigkeit eines Cache-Eintrags in Sekunden.
+        :param max_entries: Maximale Anzahl Cache-Einträge, danach wird der am längsten
+                            nicht genutzte Eintrag verworfen.
+        """
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.catalog = {}
+        self.cache = OrderedDict()
+        self.stats = {'catalog': 0, 'cache': 0, 'network': 0}
+        for path in (catalog_file or "").split(","):
+            if path.strip() and os.path.exists(path.strip()):
+                self.load_catalog(path.strip())
+        self._load_cache()
+
+    def load_catalog(self, catalog_file):
+        """
+        Lädt den Offline-Katalog. Trennzeichen (';' oder ',') wird automatisch erkannt.
+        :param catalog_file: Pfad der CSV-Datei
+        :return: Anzahl geladener Objekte
+        """
+        with open(catalog_file, newline='', encoding='utf-8') as f:
+            dialect = csv.Sniffer().sniff(f.readline(), ";,")
+            f.seek(0)
+            for row in csv.DictReader(f, dialect=dialect):
+                try:
+                    coords = (parse_angle(row['RA'], hours=True), parse_angle(row['Dec']))
+                except (KeyError, ValueError):
+                    continue
+                self.catalog[normalize(row['Name'])] = coords
+                if row.get('M'):
+                    self.catalog[normalize("M" + row['M'])] = coords
+        return len(self.catalog)
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        # Die Datei ist in LRU-Reihenfolge gespeichert
+        for name, entry in entries.items():
+            self.cache[name] = tuple(entry)
+
+    def _save_cache(self):
+        """
+        Schreibt den Cache atomar, damit ein Absturz keine halbe Datei hinterlässt.
+        Muss mit gehaltenem self.lock aufgerufen werden.
+        """
+        tmp = self.cache_file + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp, self.cache_file)
+
+    def resolve(self, name, network=True):
+        """
+        :param name: Objektname, z.B. 'M31' oder 'NGC 7000'
+        :param network: False: nur Katalog und Cache verwenden, Sesame nicht abfragen.
+        :return: (RA in Grad, Dec in Grad, Quelle 'catalog'/'cache'/'network')
+        :raises KeyError: wenn 'network' False ist und der Name weder im Katalog noch im Cache steht.
+        """
+        key = normalize(name)
+        if key in self.catalog:
+            ra, dec = self.catalog[key]
+            with self.lock:
+                self.stats['catalog'] += 1
+            return ra, dec, 'catalog'
+
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and time.time() - entry[2] < self.ttl:
+                self.cache.move_to_end(key)
+                self.stats['cache'] += 1
+                return entry[0], entry[1], 'cache'
+
+        if not network:
+            if entry is not None:
+                return entry[0], entry[1], 'cache'
+            raise KeyError("%s nicht im Katalog oder Cache" % name)
+        try:
+            with device_seconds.time('sesame', 'resolve'):
+                coord = SkyCoord.from_name(name)
+        except Exception:
+            if entry is not None:
+                # Sesame nicht erreichbar: lieber einen abgelaufenen Eintrag als gar keinen
+                return entry[0], entry[1], 'cache'
+            raise
+
+        with self.lock:
+            self.stats['network'] += 1
+            self.cache[key] = (coord.ra.degree, coord.dec.degree, time.time())
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+            self._save_cache()
+        return coord.ra.degree, coord.dec.degree, 'network'
+
+    def coord(self, name):
+        """
+        :param name: Objektname
+        :return: SkyCoord (ICRS) des Objekts
+        """
+        ra, dec, source = self.resolve(name)
+        return SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame='icrs')
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import json
+import math
+import socket
+import threading
+import time
+
+import numpy as np
+from cherrypy.process.plugins import SimplePlugin
+
+from Metrics import timed
+from Readiness import backoff_delays
+from Sequencer import SequenceAborted
+
+
+class GuideStats(object):
+    """
+    Ringpuffer der letzten 'size' Guide-Schritte (NumPy) mit laufender
+    Statistik: RMS und Spitzenwerte in RA und Dec werden bei jedem Schritt
+    fortgeschrieben statt über den ganzen Puffer neu berechnet.
+    """
+
+    # Spalten des Ringpuffers
+    fields = ('time', 'frame', 'ra', 'dec', 'snr', 'mass')
+
+    def __init__(self, size=1000):
+        """
+        :param size: Anzahl der Guide-Schritte im Fenster
+        """
+        self.size = size
+        self.data = np.zeros((size, len(self.fields)))
+        self.count = 0
+        self.seq = 0
+        self.sums = [0.0, 0.0, 0.0, 0.0]  # Summe ra, ra², dec, dec²
+        # Monotone Warteschlangen (seq, Betrag) für das gleitende Maximum
+        self.peaks = {'ra': deque(), 'dec': deque()}
+
+    def add(self, t, frame, ra, dec, snr=0.0, mass=0.0):
+        """
+        Fügt einen Guide-Schritt hinzu, der älteste fällt bei vollem Puffer heraus.
+        :param ra: Abweichung RA in Pixeln
+        :param dec: Abweichung Dec in Pixeln
+        """
+        pos = self.seq % self.size
+        sums = self.sums
+        if self.count == self.size:
+            old_ra, old_dec = float(self.data[pos, 2]), float(self.data[pos, 3])
+            sums[0] -= old_ra
+            sums[1] -= old_ra * old_ra
+            sums[2] -= old_dec
+            sums[3] -= old_dec * old_dec
+        else:
+            self.count += 1
+        self.data[pos] = (t, frame, ra, dec, snr, mass)
+        sums[0] += ra
+        sums[1] += ra * ra
+        sums[2] += dec
+        sums[3] += dec * dec
+        for name, value in (('ra', abs(ra)), ('dec', abs(dec))):
+            peak = self.peaks[name]
+            while peak and peak[-1][1] <= value:
+                peak.pop()
+            peak.append((self.seq, value))
+            while peak[0][0] <= self.seq - self.size:
+                peak.popleft()
+        self.seq += 1
+        if self.count == self.size and self.seq % (self.size * 10) == 0:
+            # Rundungsfehler der laufenden Summen gelegentlich zurücksetzen
+            window = self.data[:self.count]
+            self.sums = [float(window[:, 2].sum()), float((window[:, 2] ** 2).sum()),
+                         float(window[:, 3].sum()), float((window[:, 3] ** 2).sum())]
+
+    def clear(self):
+        self.count = 0
+        self.sums = [0.0, 0.0, 0.0, 0.0]
+        for peak in self.peaks.values():
+            peak.clear()
+
+    def stats(self):
+        """
+        :return: Dict mit Anzahl, RMS (Standardabweichung) und Spitzenwert je Achse sowie RMS gesamt, in Pixeln.
+        """
+        n = self.count
+        if n == 0:
+            return {'count': 0, 'ra_rms': None, 'dec_rms': None, 'total_rms': None, 'ra_peak': None,
+                    'dec_peak': None}
+        ra_mean, ra2, dec_mean, dec2 = (v / n for v in self.sums)
+        ra_rms = math.sqrt(max(0.0, ra2 - ra_mean ** 2))
+        dec_rms = math.sqrt(max(0.0, dec2 - dec_mean ** 2))
+        return {'count': n, 'ra_rms': round(ra_rms, 3), 'dec_rms': round(dec_rms, 3),
+                'total_rms': round(math.hypot(ra_rms, dec_rms), 3),
+                'ra_peak': round(self.peaks['ra'][0][1], 3), 'dec_peak': round(self.peaks['dec'][0][1], 3)}
+
+    def history(self, count=None):
+        """
+        :param count: Anzahl der neuesten Schritte, Standard alle im Fenster.
+        :return: Liste von Dicts, ältester zuerst.
+        """
+        n = self.count if count is None else max(0, min(count, self.count))
+        rows = [self.data[(self.seq - n + i) % self.size] for i in range(n)]
+        return [dict(zip(self.fields, (float(v) for v in row))) for row in rows]
+
+
+class PHD2Client(SimplePlugin):
+    """
+    Dauerhafte Verbindung zum Event-Server von PHD2 (Port 4400). PHD2 sendet
+    jedes Ereignis als JSON-Zeile, GuideStep-Ereignisse landen in GuideStats,
+    StarLost, Settling, SettleDone und AppState werden mitgezählt bzw. gemerkt.
+    Aufrufer können mit wait_event() auf bestimmte Ereignisse warten. Über
+    dieselbe Verbindung gehen JSON-RPC-Befehle an PHD2 (call(), dither()).
+    """
+    thread = None
+
+    def __init__(self, bus, host, port=4400, size=1000, history=200, timeout=5):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param host: Hostname von PHD2
+        :param port: Port des Event-Servers
+        :param size: Anzahl der Guide-Schritte für die Statistik
+        :param history: Anzahl der gespeicherten sonstigen Ereignisse
+        :param timeout: Verbindungs-Timeout in Sekunden
+        """
+        SimplePlugin.__init__(self, bus)
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.guide = GuideStats(size)
+        self.events = deque(maxlen=history)
+        self.version = 0
+        self.state = None
+        self.star_lost = 0
+        self.last_settle = None
+        self.last_event = None
+        self.connected = False
+        self.s = None
+        self.rpc_id = 0
+        self.responses = {}
+        # IDs der Befehle, auf deren Antwort noch gewartet wird
+        self.waiting = set()
+        self.send_lock = threading.Lock()
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        self.running = True
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        s = self.s
+        if s is not None:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Verbindet sich (mit Backoff) und liest Ereignisse, bis der Server stoppt.
+        """
+        delays = backoff_delays(0.5, 10)
+        while self.running:
+            try:
+                self.s = socket.create_connection((self.host, self.port), self.timeout)
+                self.s.settimeout(None)
+                self.connected = True
+                delays = backoff_delays(0.5, 10)
+                for line in self.s.makefile('rb'):
+                    if not self.running:
+                        break
+                    line = line.strip()
+                    if line:
+                        self.handle(json.loads(line.decode()))
+            except (OSError, ValueError):
+                pass
+            finally:
+                self.connected = False
+                if self.s is not None:
+                    self.s.close()
+                    self.s = None
+            with self.cond:
+                if self.running:
+                    self.cond.wait(next(delays))
+
+    def handle(self, message):
+        """
+        Wertet eine Nachricht von PHD2 aus.
+        :param message: Ereignis als Dict
+        """
+        event = message.get('Event')
+        if event is None:
+            if 'jsonrpc' in message and message.get('id') is not None:
+                with self.cond:
+                    # Verspätete Antworten nach einem Timeout werden verworfen
+                    if message['id'] in self.waiting:
+                        self.responses[message['id']] = message
+                        self.cond.notify_all()
+            return
+        with self.cond:
+            self.last_event = time.time()
+            if event == 'GuideStep':
+                self.guide.add(message.get('Time', self.last_event), message.get('Frame', 0),
+                               message.get('RADistanceRaw', 0.0), message.get('DECDistanceRaw', 0.0),
+                               message.get('SNR', 0.0), message.get('StarMass', 0.0))
+                self.state = 'Guiding'
+            else:
+                if event == 'StarLost':
+                    self.star_lost += 1
+                    self.state = 'LostLock'
+                elif event == 'SettleDone':
+                    self.last_settle = message
+                elif event == 'AppState':
+                    self.state = message.get('State')
+                elif event in ('GuidingStopped', 'LoopingExposuresStopped'):
+                    self.state = 'Stopped'
+                elif event == 'StartGuiding':
+                    self.guide.clear()
+            self.version += 1
+            if event != 'GuideStep':
+                # Guide-Schritte stehen im Ringpuffer und würden die übrigen Ereignisse verdrängen
+                self.events.append((self.version, message))
+            self.cond.notify_all()
+
+    def wake(self):
+        """
+        Weckt alle in wait_event() Wartenden, damit sie einen Abbruch bemerken.
+        """
+        with self.cond:
+            self.cond.notify_all()
+
+    def wait_event(self, names, since, timeout, abort=None):
+        """
+        Wartet auf ein Ereignis mit einem der Namen, das nach Version 'since' kam.
+        :param names: Ereignisnamen, z.B. ('SettleDone',)
+        :param since: Version vor dem auslösenden Befehl (self.version)
+        :param timeout: Maximale Wartezeit in Sekunden.
+        :param abort: Optional threading.Event des Sequencers, nach dem Setzen wake() aufrufen.
+        :return: Ereignis als Dict
+        :raises TimeoutError: wenn kein passendes Ereignis rechtzeitig kommt.
+        :raises SequenceAborted: wenn 'abort' gesetzt wurde.
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                if abort is not None and abort.is_set():
+                    raise SequenceAborted()
+                for version, message in self.events:
+                    if version > since and message.get('Event') in names:
+                        return message
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.running:
+                    raise TimeoutError("Kein Ereignis %s von PHD2 nach %d s" % ("/".join(names), timeout))
+                self.cond.wait(remaining)
+
+    @timed('phd2', lambda self, method, *args, **kwargs: method)
+    def call(self, method, params=None, timeout=None):
+        """
+        Sendet einen JSON-RPC-Befehl an PHD2 und wartet auf die Antwort.
+        :param method: Methode, z.B. 'dither'
+        :param params: Parameter (Dict oder Liste)
+        :param timeout: Maximale Wartezeit in Sekunden, Standard ist der Verbindungs-Timeout.
+        :return: Ergebnis des Befehls
+        :raises ConnectionError: ohne Verbindung zu PHD2
+        :raises RuntimeError: wenn PHD2 einen Fehler meldet.
+        """
+        timeout = timeout or self.timeout
+        s = self.s
+        if s is None or not self.connected:
+            raise ConnectionError("Keine Verbindung zum Event-Server von PHD2")
+        with self.cond:
+            self.rpc_id += 1
+            rpc_id = self.rpc_id
+            self.waiting.add(rpc_id)
+        request = {'method': method, 'id': rpc_id}
+        if params is not None:
+            request['params'] = params
+        try:
+            with self.send_lock:
+                s.sendall((json.dumps(request) + "\r\n").encode())
+            deadline = time.time() + timeout
+            with self.cond:
+                while rpc_id not in self.responses:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self.running:
+                        raise TimeoutError("Keine Antwort von PHD2 auf '%s' nach %d s" % (method, timeout))
+                    self.cond.wait(remaining)
+                response = self.responses.pop(rpc_id)
+        finally:
+            with self.cond:
+                self.waiting.discard(rpc_id)
+                self.responses.pop(rpc_id, None)
+        if 'error' in response:
+            raise RuntimeError("PHD2 %s: %s" % (method, response['error'].get('message', response['error'])))
+        return response.get('result')
+
+    def dither(self, amount, ra_only=False, pixels=1.5, settle_time=10, timeout=60, abort=None):
+        """
+        Dithert über PHD2 und wartet auf das Ereignis SettleDone, statt eine feste Zeit zu schlafen.
+        :param amount: Dither-Weite in Pixeln
+        :param ra_only: Nur in RA dithern
+        :param pixels: Maximale Abweichung in Pixeln, ab der das Guiding als ruhig gilt
+        :param settle_time: Geforderte ruhige Zeit in Sekunden
+        :param timeout: Maximale Settle-Dauer in Sekunden
+        :param abort: Optional threading.Event des Sequencers, siehe wait_event()
+        :return: Dict mit gemessener Settle-Dauer, Anzahl Guide-Bilder und verworfener Bilder.
+        :raises RuntimeError: wenn PHD2 das Settle als fehlgeschlagen meldet.
+        """
+        with self.cond:
+            since = self.version
+        started = time.time()
+        self.call('dither', {'amount': amount, 'raOnly': bool(ra_only),
+                             'settle': {'pixels': pixels, 'time': settle_time, 'timeout': timeout}})
+        # PHD2 meldet selbst nach 'timeout' ein fehlgeschlagenes Settle, etwas Reserve für die Übertragung
+        done = self.wait_event(('SettleDone',), since, timeout + 10, abort)
+        if done.get('Status', 0) != 0:
+            raise RuntimeError("Settle fehlgeschlagen: %s" % done.get('Error', "unbekannter Fehler"))
+        return {'settle': time.time() - started, 'total_frames': done.get('TotalFrames'),
+                'dropped_frames': done.get('DroppedFrames')}
+
+    def stats(self, history=None):
+        """
+        :param history: Optional die letzten N Guide-Schritte mit ausgeben.
+        :return: Dict mit Verbindung, Zustand, Guide-Statistik und Zählern.
+        """
+        with self.cond:
+            result = {'connected': self.connected, 'state': self.state, 'star_lost': self.star_lost,
+                      'last_event': self.last_event, 'last_settle': self.last_settle, 'guide': self.guide.stats()}
+            if history is not None:
+                result['history'] = self.guide.history(history)
+            return result
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import datetime
+import threading
+
+from astropy import units as u
+from astropy.time import Time
+import numpy as np
+
+
+class Planner(object):
+    """
+    Sichtbarkeitsplanung für ganze Ziellisten. Höhen- und Azimutkurven aller
+    Ziele werden in einem vektorisierten Durchlauf über das Raster
+    Ziele x Zeitschritte berechnet, Ergebnisse werden je Nacht gecacht.
+    Objektnamen werden nur aus Katalog und Cache aufgelöst: eine Sesame-Abfrage
+    je unbekanntem Ziel würde eine lange Liste um Minuten verzögern. Unbekannte
+    Namen stehen in 'errors', ein GoTo oder '/test_astropy' legt sie im Cache ab.
+    """
+    # Kleinster Zeitschritt in Minuten
+    MIN_STEP = 1.0
+
+    def __init__(self, coordinates, resolver, cache_size=32, max_steps=2000):
+        """
+        :param coordinates: CoordinateService der Sternwarte
+        :param resolver: NameResolver für Objektnamen
+        :param cache_size: Anzahl gecachter Pläne
+        :param max_steps: Maximale Anzahl Zeitschritte eines Plans
+        """
+        self.coordinates = coordinates
+        self.resolver = resolver
+        self.cache_size = cache_size
+        self.max_steps = max_steps
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def night(now=None):
+        """
+        Standard-Zeitfenster: die aktuelle Nacht von 12 Uhr UTC bis 12 Uhr UTC am Folgetag.
+        :param now: Bezugszeitpunkt (UTC), Standard ist jetzt.
+        :return: (Start, Ende) als datetime
+        """
+        now = now or datetime.datetime.utcnow()
+        start = datetime.datetime.combine((now - datetime.timedelta(hours=12)).date(), datetime.time(12))
+        return start, start + datetime.timedelta(days=1)
+
+    def _resolve(self, target):
+        """
+        :param target: Objektname oder 'RA,Dec' in Grad
+        :return: (RA in Grad, Dec in Grad)
+        """
+        parts = target.split(",")
+        if len(parts) == 2:
+            try:
+                return float(parts[0]), float(parts[1])
+            except ValueError:
+                pass
+        ra, dec, source = self.resolver.resolve(target, network=False)
+        return ra, dec
+
+    def plan(self, targets, start=None, end=None, step=10, horizon=20.0, curves=True):
+        """
+        :param targets: Liste von Objektnamen oder 'RA,Dec'-Angaben in Grad
+        :param start: Beginn als datetime (UTC), Standard ist die aktuelle Nacht.
+        :param end: Ende als datetime (UTC)
+        :param step: Zeitschritt in Minuten
+        :param horizon: Mindesthöhe in Grad
+        :param curves: Höhen-/Azimutkurven mit ausgeben
+        :return: Dict mit Zeitachse und je Ziel Aufgang, Kulmination, Untergang und Zeit über dem Horizont.
+        :raises ValueError: bei einem Zeitschritt unter MIN_STEP oder mehr als max_steps Zeitschritten.
+        """
+        if start is None or end is None:
+            start, end = self.night()
+        if not step >= self.MIN_STEP:
+            raise ValueError("Zeitschritt muss mindestens %g min betragen" % self.MIN_STEP)
+        if (end - start).total_seconds() / (step * 60) >= self.max_steps:
+            raise ValueError("Mehr als %d Zeitschritte, bitte größeren Zeitschritt wählen" % self.max_steps)
+        key = (tuple(targets), start, end, step, horizon, curves)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        result = self._compute(targets, start, end, step, horizon, curves)
+
+        with self.lock:
+            self.cache[key] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    def _compute(self, targets, start, end, step, horizon, curves):
+        steps = max(2, int((end - start).total_seconds() // (step * 60)) + 1)
+        offsets = np.arange(steps) * step * 60.0
+        times = Time(start) + offsets * u.s
+
+        names = []
+        ra = []
+        dec = []
+        errors = {}
+        for target in targets:
+            try:
+                r, d = self._resolve(target)
+            except Exception as e:
+                errors[target] = str(e)
+                continue
+            names.append(target)
+            ra.append(r)
+            dec.append(d)
+
+        entries = []
+        if names:
+            # Scheinbarer Ort einmal zur Fenstermitte, danach reine Trigonometrie über das ganze Raster
+            ra_h, dec_deg = self.coordinates.to_mount_batch(ra, dec, times[steps // 2])
+            lst = times.sidereal_time('apparent', longitude=self.coordinates.location.lon).hour
+            lat = np.radians(self.coordinates.location.lat.degree)
+            ha = np.radians((lst[np.newaxis, :] - ra_h[:, np.newaxis]) * 15.0)
+            d = np.radians(dec_deg)[:, np.newaxis]
+            alt = np.degrees(np.arcsin(np.sin(lat) * np.sin(d) + np.cos(lat) * np.cos(d) * np.cos(ha)))
+            az = np.degrees(np.arctan2(-np.cos(d) * np.sin(ha),
+                                       np.sin(d) * np.cos(lat) - np.cos(d) * np.sin(lat) * np.cos(ha))) % 360
+            # Refraktion nach Bennett (Bogenminuten), nur oberhalb von -1 Grad
+            refraction = np.where(alt > -1, 1.0 / np.tan(np.radians(alt + 7.31 / (alt + 4.4))) / 60.0, 0.0)
+            alt = alt + refraction
+
+            above = alt >= horizon
+            transit = np.argmax(alt, axis=1)
+            # Übergänge über den Horizont, linear zwischen zwei Zeitschritten interpoliert
+            crossing = above[:, 1:] != above[:, :-1]
+            a0 = alt[:, :-1] - horizon
+            a1 = alt[:, 1:] - horizon
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.where(crossing, a0 / (a0 - a1), 0.0)
+            crossing_time = (np.arange(steps - 1)[np.newaxis, :] + fraction) * step * 60.0
+
+            for i, name in enumerate(names):
+                rises = crossing_time[i][crossing[i] & ~above[i, :-1]]
+                sets = crossing_time[i][crossing[i] & above[i, :-1]]
+                entry = {'target': name, 'ra': ra[i], 'dec': dec[i],
+                         'rise': self._iso(start, rises[0]) if len(rises) else None,
+                         'transit': self._iso(start, offsets[transit[i]]),
+                         'set': self._iso(start, sets[0]) if len(sets) else None,
+                         'max_alt': round(float(alt[i, transit[i]]), 2),
+                         'minutes_above': int(above[i].sum()) * step}
+                if curves:
+                    entry['alt'] = np.round(alt[i], 2).tolist()
+                    entry['az'] = np.round(az[i], 2).tolist()
+                entries.append(entry)
+
+        return {'start': start.isoformat(), 'end': end.isoformat(), 'step': step, 'horizon': horizon,
+                'times': [self._iso(start, o) for o in offsets] if curves else None,
+                'targets': entries, 'errors': errors}
+
+    @staticmethod
+    def _iso(start, seconds):
+        return (start + datetime.timedelta(seconds=float(seconds))).isoformat(timespec='seconds')
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from io import BytesIO
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from ScreenshotService import png_gray
+
+try:
+    import rawpy
+except ImportError:
+    # Ohne rawpy wird das in der Raw-Datei eingebettete JPEG verwendet.
+    rawpy = None
+
+try:
+    from PIL import Image
+except ImportError:
+    # Ohne Pillow gibt es Vorschauen nur als PNG und keine eingebetteten JPEGs.
+    Image = None
+
+
+def embedded_jpeg(path):
+    """
+    Sucht das größte eingebettete JPEG einer TIFF-basierten Raw-Datei (CR2, NEF, DNG).
+    :param path: Pfad der Datei
+    :return: JPEG-Daten
+    :raises ValueError: wenn die Datei kein TIFF ist oder kein JPEG enthält.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        if head[:2] == b'II':
+            order = '<'
+        elif head[:2] == b'MM':
+            order = '>'
+        else:
+            raise ValueError("Keine TIFF-basierte Raw-Datei: " + os.path.basename(path))
+        best = None
+        ifd = struct.unpack(order + 'I', head[4:8])[0]
+        visited = set()
+        while ifd and ifd not in visited and len(visited) < 16:
+            visited.add(ifd)
+            f.seek(ifd)
+            count = struct.unpack(order + 'H', f.read(2))[0]
+            tags = {}
+            for i in range(count):
+                tag, kind, n, value = struct.unpack(order + 'HHII', f.read(12))
+                if kind == 3 and n == 1:
+                    # SHORT steht linksbündig im Wertefeld
+                    value = value & 0xffff if order == '<' else value >> 16
+                tags[tag] = value
+            ifd = struct.unpack(order + 'I', f.read(4))[0]
+            # StripOffsets/StripByteCounts bzw. JPEGInterchangeFormat/-Length
+            for start, length in ((0x111, 0x117), (0x201, 0x202)):
+                if start in tags and length in tags and (best is None or tags[length] > best[1]):
+                    best = (tags[start], tags[length])
+        if best is not None:
+            f.seek(best[0])
+            data = f.read(best[1])
+            if data[:2] == b'\xff\xd8':
+                return data
+    raise ValueError("Kein eingebettetes JPEG in " + os.path.basename(path))
+
+
+def load_luminance(path):
+    """
+    Liest eine Aufnahme als Helligkeitsbild.
+    :param path: Pfad der Datei (FITS oder Raw)
+    :return: (2D-Array float32, Pixel des Sensors je Bildpixel)
+    :raises RuntimeError: wenn weder rawpy noch Pillow vorhanden sind.
+    """
+    if path.lower().endswith(('.fit', '.fits')):
+        from astropy.io import fits
+        data = np.asarray(fits.getdata(path), dtype=np.float32)
+        return (data.mean(axis=0) if data.ndim == 3 else data), 1
+    if rawpy is not None:
+        with rawpy.imread(path) as raw:
+            data = raw.raw_image_visible.astype(np.float32) - np.mean(raw.black_level_per_channel)
+        # Bayer-Matrix als Superpixel: je 2x2 Sensorpixel ein Bildpixel
+        return bin_image(data, 2), 2
+    if Image is not None:
+        img = Image.open(BytesIO(embedded_jpeg(path)))
+        return np.asarray(img.convert('L'), dtype=np.float32), 1
+    raise RuntimeError("Für Raw-Vorschauen wird rawpy oder Pillow benötigt")
+
+
+def bin_image(data, factor):
+    """
+    Fasst factor x factor Pixel zu einem zusammen (Mittelwert), Ränder werden abgeschnitten.
+    :param data: 2D-Array
+    :param factor: Binning-Faktor
+    :return: Gebinntes 2D-Array
+    """
+    if factor <= 1:
+        return data
+    h = data.shape[0] // factor * factor
+    w = data.shape[1] // factor * factor
+    return data[:h, :w].reshape(h // factor, factor, w // factor, factor).mean(axis=(1, 3))
+
+
+def stretch(data, background=0.25):
+    """
+    Automatische Streckung wie bei der Screen Transfer Function: Schwarzpunkt
+    knapp unter dem Himmelshintergrund, Mitteltöne so, dass der Hintergrund
+    bei 'background' liegt.
+    :param data: 2D-Array
+    :param background: Zielhelligkeit des Hintergrunds (0..1)
+    :return: 2D-Array uint8
+    """
+    median = float(np.median(data))
+    mad = float(np.median(np.abs(data - median))) * 1.4826
+    shadows = max(float(data.min()), median - 2.8 * mad)
+    highlights = float(np.percentile(data, 99.95))
+    if highlights <= shadows:
+        highlights = shadows + 1
+    x = np.clip((data - shadows) / (highlights - shadows), 0, 1)
+    m = (median - shadows) / (highlights - shadows)
+    # Mitteltonwert, der m auf 'background' abbildet
+    mb = ((background - 1) * m) / ((2 * background - 1) * m - background) if 0 < m < 1 else 0.5
+    y = ((mb - 1) * x) / ((2 * mb - 1) * x - mb)
+    return np.clip(y * 255 + 0.5, 0, 255).astype(np.uint8)
+
+
+def star_stats(data, scale=1, sigma=5.0, radius=6, max_stars=200):
+    """
+    Schnelle Bildstatistik: Anzahl der Sterne und mittlerer Half-Flux-Radius.
+    Sterne sind lokale Maxima über 'sigma' Rauschen mit mindestens zwei hellen
+    Nachbarn (keine Hotpixel), der HFR wird an den hellsten 'max_stars' gemessen.
+    :param data: 2D-Array
+    :param scale: Sensorpixel je Bildpixel, der HFR wird in Sensorpixeln angegeben.
+    :return: Dict mit stars, hfr, background und noise
+    """
+    background = float(np.median(data))
+    noise = float(np.median(np.abs(data - background))) * 1.4826 or 1.0
+    threshold = background + sigma * noise
+    h, w = data.shape
+    padded = np.pad(data, 1, mode='edge')
+    shifted = [padded[1 + dy:h + 1 + dy, 1 + dx:w + 1 + dx]
+               for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx]
+    neighbours = np.max(shifted, axis=0)
+    bright = sum((s > threshold).astype(np.uint8) for s in shifted)
+    peaks = (data > threshold) & (data >= neighbours) & (bright >= 2)
+    ys, xs = np.nonzero(peaks)
+    stars = len(ys)
+    inside = (ys >= radius) & (ys < h - radius) & (xs >= radius) & (xs < w - radius)
+    ys, xs = ys[inside], xs[inside]
+    hfr = None
+    if len(ys):
+        order = np.argsort(data[ys, xs])[::-1][:max_stars]
+        ys, xs = ys[order], xs[order]
+        offsets = np.arange(-radius, radius + 1)
+        dy, dx = np.meshgrid(offsets, offsets, indexing='ij')
+        windows = np.clip(data[ys[:, None, None] + dy, xs[:, None, None] + dx] - background, 0, None)
+        flux = windows.sum(axis=(1, 2))
+        valid = flux > 0
+        windows, flux = windows[valid], flux[valid]
+        if len(flux):
+            cy = (windows * dy).sum(axis=(1, 2)) / flux
+            cx = (windows * dx).sum(axis=(1, 2)) / flux
+            dist = np.sqrt((dy - cy[:, None, None]) ** 2 + (dx - cx[:, None, None]) ** 2)
+            hfr = round(float(np.median((windows * dist).sum(axis=(1, 2)) / flux)) * scale, 2)
+    return {'stars': int(stars), 'hfr': hfr, 'background': round(background, 2), 'noise': round(noise, 2)}
+
+
+class PreviewCache(object):
+    """
+    Größenbegrenzter Zwischenspeicher auf der Platte. Beim Überschreiten von
+    'max_bytes' werden die am längsten nicht genutzten Dateien gelöscht.
+    """
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024):
+        """
+        :param directory: Verzeichnis des Caches
+        :param max_bytes: Maximale Gesamtgröße in Bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        files = [e for e in os.scandir(directory) if e.is_file() and not e.name.endswith(".tmp")]
+        files.sort(key=lambda e: e.stat().st_mtime)
+        self.entries = OrderedDict((e.name, e.stat().st_size) for e in files)
+        self.total = sum(self.entries.values())
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key):
+        """
+        :param key: Dateiname des Eintrags
+        :return: Daten, None wenn nicht vorhanden.
+        """
+        path = os.path.join(self.directory, key)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Zeitpunkt der Nutzung, damit die Reihenfolge einen Neustart übersteht
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self.total -= self.entries.pop(key, 0)
+            return None
+        return data
+
+    def put(self, key, data):
+        """
+        Legt einen Eintrag ab und verdrängt bei Bedarf die ältesten.
+        :param key: Dateiname des Eintrags
+        :param data: Daten
+        """
+        path = os.path.join(self.directory, key)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old, size = self.entries.popitem(last=False)
+                self.total -= size
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
+
+    def metrics(self):
+        """
+        :return: Dict mit Anzahl der Einträge und Größe in Bytes
+        """
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total, 'max_bytes': self.max_bytes}
+
+
+class PreviewService(object):
+    """
+    Vorschaubilder und Schnellstatistik für Aufnahmen aus dem FrameCatalog.
+    Eine Aufnahme wird je Anfrage höchstens einmal dekodiert, Vorschau und
+    Statistik landen im PreviewCache unter der Prüfsumme der Datei.
+    """
+
+    def __init__(self, catalog, cache, size=1024, quality=80):
+        """
+        :param catalog: FrameCatalog
+        :param cache: PreviewCache
+        :param size: Standard-Kantenlänge der Vorschau in Pixeln
+        :param quality: JPEG-Qualität
+        """
+        self.catalog = catalog
+        self.cache = cache
+        self.size = size
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def _size(self, size):
+        """
+        Rundet die gewünschte Kantenlänge auf eine Zweierpotenz ab 64 auf, höchstens
+        auf die Standard-Kantenlänge. So entstehen je Aufnahme nur wenige Varianten im Cache.
+        :param size: Kantenlänge in Pixeln, ohne Angabe die Standard-Kantenlänge
+        :return: Kantenlänge in Pixeln
+        :raises ValueError: wenn size keine ganze Zahl ist.
+        """
+        if size is None or size == "":
+            return self.size
+        try:
+            size = int(size)
+        except ValueError:
+            raise ValueError("Ungültige Größe: %s" % size)
+        allowed = 64
+        while allowed < size:
+            allowed *= 2
+        return min(allowed, self.size)
+
+    def _frame(self, frame_id):
+        frame = self.catalog.get(frame_id)
+        if frame is None:
+            raise ValueError("Unbekannte Aufnahme")
+        return frame
+
+    def variant(self, frame_id, size=None, fmt="jpeg"):
+        """
+        :param frame_id: ID der Aufnahme
+        :param size: Maximale Kantenlänge in Pixeln, siehe _size()
+        :param fmt: 'jpeg' oder 'png' (ohne Pillow immer 'png')
+        :return: (Cache-Schlüssel, Content-Type, ETag), ohne das Bild zu berechnen.
+        """
+        frame = self._frame(frame_id)
+        size = self._size(size)
+        fmt = "png" if fmt == "png" or Image is None else "jpeg"
+        key = "%s_%d.%s" % (frame['sha256'], size, "jpg" if fmt == "jpeg" else "png")
+        return key, 'image/' + fmt, '"%s-%d-%s"' % (frame['sha256'], size, fmt)
+
+    def preview(self, frame_id, size=None, fmt="jpeg"):
+        """
+        :param frame_id: ID der Aufnahme
+        :param size: Maximale Kantenlänge in Pixeln
+        :param fmt: 'jpeg' oder 'png'
+        :return: (Daten, Content-Type, ETag)
+        """
+        key, content_type, etag = self.variant(frame_id, size, fmt)
+        data = self.cache.get(key)
+        if data is None:
+            self._render(self._frame(frame_id), self._size(size), content_type[6:])
+            data = self.cache.get(key)
+        return data, content_type, etag
+
+    def stats(self, frame_id):
+        """
+        :param frame_id: ID der Aufnahme
+        :return: Dict mit stars, hfr, background und noise
+        """
+        frame = self._frame(frame_id)
+        data = self.cache.get(frame['sha256'] + "_stats.json")
+        if data is None:
+            self._render(frame)
+            data = self.cache.get(frame['sha256'] + "_stats.json")
+        return json.loads(data.decode())
+
+    def generate(self, frame_id):
+        """
+        Erzeugt Standard-Vorschau und Statistik im Voraus, z.B. direkt nach der Erfassung.
+        :param frame_id: ID der Aufnahme
+        :return: Statistik der Aufnahme
+        """
+        self.preview(frame_id)
+        return self.stats(frame_id)
+
+    def _render(self, frame, size=None, fmt=None):
+        """
+        Dekodiert eine Aufnahme einmal und legt fehlende Statistik und die gewünschte Vorschau ab.
+        """
+        with self.lock:
+            lock = self.locks.setdefault(frame['sha256'], threading.Lock())
+        with lock:
+            stats_key = frame['sha256'] + "_stats.json"
+            preview_key = None
+            if size is not None:
+                preview_key = "%s_%d.%s" % (frame['sha256'], size, "jpg" if fmt == "jpeg" else "png")
+            need_stats = stats_key not in self.cache
+            need_preview = preview_key is not None and preview_key not in self.cache
+            if need_stats or need_preview:
+                data, scale = load_luminance(frame['path'])
+                if need_stats:
+                    # Statistik auf höchstens 2048 Pixel Kantenlänge, genügt für HFR und Sternzahl
+                    factor = max(1, -(-max(data.shape) // 2048))
+                    stats = star_stats(bin_image(data, factor), scale * factor)
+                    self.cache.put(stats_key, json.dumps(stats).encode())
+                if need_preview:
+                    self.cache.put(preview_key, self._encode(data, size, fmt))
+        with self.lock:
+            self.locks.pop(frame['sha256'], None)
+
+    def _encode(self, data, size, fmt):
+        image = stretch(bin_image(data, max(1, -(-max(data.shape) // size))))
+        if fmt == "jpeg":
+            out = BytesIO()
+            Image.fromarray(image).save(out, 'JPEG', quality=self.quality)
+            return out.getvalue()
+        return png_gray(image.shape[1], image.shape[0], image.tobytes())
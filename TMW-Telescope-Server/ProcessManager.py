@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import subprocess
+import threading
+import time
+import uuid
+
+
+class ProcessManager(object):
+    """
+    Startet externe Programme (BDS-Scripte, Screenshot.exe) kontrolliert:
+    höchstens 'max_concurrent' gleichzeitig, Programme mit derselben Ressource
+    (z.B. 'desktop' für Scripte, die dieselbe Oberfläche bedienen) nacheinander.
+    Laufzeit, Exit-Code und Ausgabe werden festgehalten, hängende Prozesse
+    nach Ablauf des Timeouts beendet.
+    """
+
+    def __init__(self, max_concurrent=4, history=200, output_limit=8192):
+        """
+        :param max_concurrent: Maximale Anzahl gleichzeitig laufender Prozesse.
+        :param history: Anzahl gespeicherter Prozess-Einträge je Name.
+        :param output_limit: Anzahl der gespeicherten letzten Zeichen der Ausgabe.
+        """
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.history = history
+        self.output_limit = output_limit
+        self.lock = threading.Lock()
+        self.resource_locks = {}
+        self.records = OrderedDict()
+
+    def _resource_lock(self, resource):
+        with self.lock:
+            if resource not in self.resource_locks:
+                self.resource_locks[resource] = threading.Lock()
+            return self.resource_locks[resource]
+
+    def run(self, args, name=None, resource=None, timeout=300, wait=True):
+        """
+        Führt ein Programm aus.
+        :param args: Programm und Argumente als Liste
+        :param name: Anzeigename, Standard ist das Programm.
+        :param resource: Optionale Ressource, die exklusiv belegt wird.
+        :param timeout: Maximale Laufzeit in Sekunden, danach wird der Prozess beendet.
+        :param wait: True wartet auf das Ende, False kehrt sofort zurück.
+        :return: Eintrag des Prozesses (Dict), bei wait=True mit Exit-Code und Ausgabe.
+        """
+        record = {'id': uuid.uuid4().hex, 'name': name or args[0], 'args': list(args), 'resource': resource,
+                  'state': 'waiting', 'pid': None, 'queued': time.time(), 'started': None, 'finished': None,
+                  'returncode': None, 'output': "", 'error': None}
+        with self.lock:
+            self.records[record['id']] = record
+            # Begrenzung je Name, damit häufige Aufrufe (Screenshot) die BDS-Scripte nicht verdrängen
+            same = [k for k, r in self.records.items() if r['name'] == record['name']]
+            for k in same[:max(0, len(same) - self.history)]:
+                del self.records[k]
+        if wait:
+            self._execute(record, timeout)
+        else:
+            thread = threading.Thread(target=self._execute, args=(record, timeout))
+            thread.daemon = True
+            thread.start()
+        return record
+
+    def _execute(self, record, timeout):
+        resource_lock = self._resource_lock(record['resource']) if record['resource'] else None
+        if resource_lock:
+            resource_lock.acquire()
+        try:
+            with self.slots:
+                record['state'] = 'running'
+                record['started'] = time.time()
+                try:
+                    proc = subprocess.Popen(record['args'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                except OSError as e:
+                    record['state'] = 'failed'
+                    record['error'] = str(e)
+                    return
+                record['pid'] = proc.pid
+                try:
+                    output, _ = proc.communicate(timeout=timeout)
+                    record['state'] = 'done' if proc.returncode == 0 else 'failed'
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    output, _ = proc.communicate()
+                    record['state'] = 'killed'
+                    record['error'] = "Timeout nach %d s" % timeout
+                record['returncode'] = proc.returncode
+                record['output'] = (output or b"")[-self.output_limit:].decode(errors='replace')
+        finally:
+            record['finished'] = time.time()
+            if resource_lock:
+                resource_lock.release()
+
+    def processes(self, state=None):
+        """
+        :param state: Optional nur Einträge in diesem Zustand ('waiting', 'running', 'done', 'failed', 'killed').
+        :return: Liste der Einträge ohne Ausgabe, neuester zuletzt.
+        """
+        with self.lock:
+            records = list(self.records.values())
+        return [dict((k, v) for k, v in r.items() if k != 'output')
+                for r in records if state is None or r['state'] == state]
+
+    def process(self, process_id):
+        """
+        :param process_id: ID des Eintrags
+        :return: Eintrag inklusive Ausgabe, None wenn unbekannt.
+        """
+        with self.lock:
+            record = self.records.get(process_id)
+            return dict(record) if record is not None else None
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import subprocess
+import time
+
+
+def backoff_delays(initial=0.25, maximum=5.0, factor=2.0):
+    """
+    Erzeugt exponentiell wachsende Wartezeiten bis zum Maximum.
+    :param initial: Erste Wartezeit in Sekunden
+    :param maximum: Größte Wartezeit in Sekunden
+    :param factor: Wachstumsfaktor
+    :return: Generator der Wartezeiten
+    """
+    delay = initial
+    while True:
+        yield delay
+        delay = min(maximum, delay * factor)
+
+
+def wait_until(check, timeout, initial=0.25, maximum=5.0):
+    """
+    Ruft check() mit exponentiellem Backoff auf, bis es True liefert oder die Frist abläuft.
+    Ausnahmen in check() zählen als "noch nicht bereit".
+    :param check: Funktion ohne Parameter
+    :param timeout: Frist in Sekunden
+    :param initial: Erste Wartezeit in Sekunden
+    :param maximum: Größte Wartezeit in Sekunden
+    :return: Benötigte Zeit in Sekunden
+    :raises TimeoutError: wenn check() bis zur Frist nicht True liefert.
+    """
+    started = time.time()
+    deadline = started + timeout
+    last_error = None
+    for delay in backoff_delays(initial, maximum):
+        try:
+            if check():
+                return time.time() - started
+        except Exception as e:
+            last_error = e
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutError("Nicht bereit nach %d s%s" % (timeout, ": %s" % last_error if last_error else ""))
+        time.sleep(min(delay, remaining))
+
+
+def port_open(host, port, timeout=1.0):
+    """
+    :param host: Hostname
+    :param port: Port
+    :param timeout: Verbindungs-Timeout in Sekunden
+    :return: True, wenn eine TCP-Verbindung möglich ist.
+    """
+    try:
+        s = socket.create_connection((host, port), timeout)
+    except OSError:
+        return False
+    s.close()
+    return True
+
+
+def process_running(image):
+    """
+    :param image: Name der ausführbaren Datei, z.B. 'AstroTortilla.exe'
+    :return: True, wenn ein Prozess dieses Namens läuft.
+    """
+    if os.name == 'nt':
+        output = subprocess.run(["tasklist", "/FI", "IMAGENAME eq %s" % image, "/NH"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        return image.lower().encode() in output.lower()
+    return subprocess.run(["pgrep", "-f", image], stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL).returncode == 0
+
+
+def wait_for_port(host, port, timeout=120, initial=0.25, maximum=5.0):
+    """
+    Wartet, bis eine Software ihren Port geöffnet hat.
+    :return: Benötigte Zeit in Sekunden
+    """
+    return wait_until(lambda: port_open(host, port), timeout, initial, maximum)
+
+
+def wait_for_process(image, timeout=120, initial=0.25, maximum=5.0):
+    """
+    Wartet, bis ein Prozess gestartet ist.
+    :return: Benötigte Zeit in Sekunden
+    """
+    return wait_until(lambda: process_running(image), timeout, initial, maximum)
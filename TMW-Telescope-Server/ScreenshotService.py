@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import hashlib
+from io import BytesIO
+import struct
+import subprocess
+import threading
+import time
+import zlib
+
+from cherrypy.process.plugins import SimplePlugin
+
+from Metrics import device_seconds
+
+try:
+    from PIL import Image
+except ImportError:
+    # Ohne Pillow gibt es keine verkleinerten bzw. JPEG-Varianten, nur das Original-PNG.
+    Image = None
+
+
+def png_gray(width, height, pixels, level=6):
+    """
+    Kodiert ein 8-Bit-Graustufenbild als PNG, ohne Pillow.
+    :param width: Breite in Pixeln
+    :param height: Höhe in Pixeln
+    :param pixels: Pixel zeilenweise, ein Byte je Pixel
+    :param level: zlib-Kompressionsstufe
+    :return: PNG-Daten
+    """
+    raw = b"".join(b'\x00' + pixels[y * width:(y + 1) * width] for y in range(height))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, level))
+            + chunk(b'IEND', b''))
+
+
+class ExeScreenshotBackend(object):
+    """
+    Nimmt Bildschirmfotos über die mitgelieferte Screenshot.exe auf.
+    """
+
+    def __init__(self, exe, output="screenshot.png", processes=None, timeout=30):
+        """
+        :param exe: Pfad zur Screenshot.exe
+        :param output: Datei, in die Screenshot.exe das Bild schreibt.
+        :param processes: Optionaler ProcessManager, der den Aufruf begrenzt und protokolliert.
+        :param timeout: Maximale Laufzeit der Screenshot.exe in Sekunden.
+        """
+        self.exe = exe
+        self.output = output
+        self.processes = processes
+        self.timeout = timeout
+
+    def capture(self):
+        """
+        :return: PNG-Daten des Bildschirmfotos.
+        :raises RuntimeError: wenn Screenshot.exe fehlschlägt oder abgebrochen wird.
+        """
+        if self.processes is not None:
+            process = self.processes.run([self.exe], name="screenshot", resource="screenshot", timeout=self.timeout)
+            if process['state'] != 'done':
+                raise RuntimeError("Screenshot: %s" % (process['error'] or "Exit-Code %s" % process['returncode']))
+        else:
+            subprocess.run([self.exe], timeout=self.timeout)
+        with open(self.output, 'rb') as f:
+            return f.read()
+
+
+class StubScreenshotBackend(object):
+    """
+    Liefert ein erzeugtes PNG ohne Bildschirmzugriff, z.B. zum Testen unter Linux.
+    """
+
+    def __init__(self, width=64, height=48):
+        self.width = width
+        self.height = height
+        self.captures = 0
+
+    def capture(self):
+        """
+        :return: PNG-Daten eines Graustufenbildes, dessen Helligkeit sich bei jeder Aufnahme ändert.
+        """
+        self.captures += 1
+        value = (self.captures * 16) % 256
+        return png_gray(self.width, self.height, bytes([value]) * (self.width * self.height))
+
+
+class ScreenshotFrame(object):
+    """
+    Ein aufgenommenes Bildschirmfoto inklusive bereits berechneter Varianten.
+    """
+    # Kleinster Verkleinerungsfaktor einer Variante
+    MIN_SCALE = 1.0 / 16
+
+    def __init__(self, data, captured):
+        self.data = data
+        self.captured = captured
+        self.etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        self.variants = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def _scale(cls, scale):
+        """
+        Rundet den Faktor auf 1, 1/2, 1/4 ... auf, mindestens auf MIN_SCALE. So
+        entstehen je Bild nur wenige Varianten, egal welche Faktoren Clients anfragen.
+        :param scale: Skalierungsfaktor (0 < scale <= 1)
+        :return: Gerundeter Skalierungsfaktor
+        """
+        allowed = 1.0
+        while allowed / 2 >= max(scale, cls.MIN_SCALE):
+            allowed /= 2
+        return allowed
+
+    def variant(self, scale=1.0, fmt="png"):
+        """
+        Liefert eine verkleinerte und/oder als JPEG kodierte Variante. Varianten
+        werden je Bild nur einmal berechnet, der Faktor wird dazu gerundet (_scale).
+        :param scale: Skalierungsfaktor (0 < scale <= 1)
+        :param fmt: 'png' oder 'jpeg'
+        :return: (Daten, Content-Type, ETag)
+        """
+        scale = self._scale(scale)
+        if (scale >= 1 and fmt == "png") or Image is None:
+            return self.data, 'image/png', self.etag
+        key = (scale, fmt)
+        with self.lock:
+            if key not in self.variants:
+                img = Image.open(BytesIO(self.data))
+                if scale < 1:
+                    img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+                out = BytesIO()
+                if fmt == "jpeg":
+                    img.convert('RGB').save(out, 'JPEG', quality=75)
+                else:
+                    img.save(out, 'PNG')
+                etag = '"%s-%s-%s"' % (self.etag.strip('"'), scale, fmt)
+                self.variants[key] = (out.getvalue(), 'image/' + fmt, etag)
+            return self.variants[key]
+
+
+class ScreenshotService(SimplePlugin):
+    """
+    Gemeinsame Bildschirmfoto-Aufnahme für alle Clients. Ein Hintergrund-Thread
+    nimmt höchstens alle 'interval' Sekunden ein Bild auf, solange in den
+    letzten 'idle' Sekunden Bilder abgefragt wurden. Gleichzeitige Anfragen
+    warten gemeinsam auf dieselbe Aufnahme.
+    """
+    thread = None
+
+    def __init__(self, bus, backend, interval=5, idle=60, timeout=30):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param backend: Objekt mit Methode capture(), die PNG-Daten liefert.
+        :param interval: Mindestabstand zwischen zwei Aufnahmen in Sekunden.
+        :param idle: Ohne Anfragen in dieser Zeit wird die Aufnahme pausiert.
+        :param timeout: Maximale Wartezeit einer Anfrage auf ein Bild.
+        """
+        SimplePlugin.__init__(self, bus)
+        self.backend = backend
+        self.interval = interval
+        self.idle = idle
+        self.timeout = timeout
+        self.frame = None
+        self.error = None
+        self.last_request = 0
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        self.running = True
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Aufnahme-Schleife.
+        """
+        while True:
+            with self.cond:
+                # Schlafen, solange niemand Bilder abfragt
+                while self.running and time.time() - self.last_request > self.idle:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                if self.frame is not None:
+                    wait = self.frame.captured + self.interval - time.time()
+                    if wait > 0:
+                        self.cond.wait(wait)
+                        continue
+            try:
+                with device_seconds.time('screenshot', 'capture'):
+                    frame = ScreenshotFrame(self.backend.capture(), time.time())
+                error = None
+            except Exception as e:
+                frame = None
+                error = e
+                self.bus.log("Fehler bei der Bildschirmaufnahme: %s" % e, level=30)
+            with self.cond:
+                if frame is not None:
+                    self.frame = frame
+                self.error = error
+                self.cond.notify_all()
+                if error is not None:
+                    # Nicht im Sekundentakt erneut versuchen
+                    self.cond.wait(self.interval)
+
+    def latest(self):
+        """
+        Liefert das aktuelle Bildschirmfoto. Ist es älter als das Intervall,
+        wird auf die nächste (gemeinsame) Aufnahme gewartet.
+        :return: ScreenshotFrame
+        """
+        with self.cond:
+            self.last_request = time.time()
+            frame = self.frame
+            if frame is not None and time.time() - frame.captured < self.interval:
+                return frame
+            self.cond.notify_all()
+            deadline = time.time() + self.timeout
+            while self.frame is frame and self.error is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            if self.frame is None:
+                raise RuntimeError("Kein Bildschirmfoto verfügbar: %s" % (self.error or "Zeitüberschreitung"))
+            return self.frame
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import threading
+import time
+import uuid
+
+from cherrypy.process.plugins import SimplePlugin
+
+
+class SequenceAborted(Exception):
+    """
+    Die Sequenz wurde über abort() abgebrochen.
+    """
+    pass
+
+
+def sleep(abort, seconds):
+    """
+    Wartet, kehrt bei einem Abbruch aber sofort zurück.
+    :param abort: threading.Event des Sequencers
+    :param seconds: Wartezeit in Sekunden
+    :raises SequenceAborted: wenn die Sequenz während der Wartezeit abgebrochen wird.
+    """
+    if abort.wait(max(0, seconds)):
+        raise SequenceAborted()
+
+
+class Sequencer(SimplePlugin):
+    """
+    Führt einen ganzen Aufnahmeplan (Schwenk, Plate-Solve, Guiding, N Belichtungen
+    mit Dithern) lokal als Zustandsmaschine in einem eigenen Thread aus. Jeder
+    Schritt beginnt, sobald der vorherige fertig ist, statt auf Befehle über das
+    Netz zu warten. Fortschritt wird als Ereignisse veröffentlicht, die Abonnenten
+    wie beim StatusPoller mit wait() abholen.
+
+    Die Geräte-Schritte kommen als Aktionen von außen (Dict Name -> Funktion):
+    slew(target), platesolve(), guide(settle_pixels, settle_time, settle_timeout),
+    dither(amount, settle_pixels, settle_time, settle_timeout), expose(duration, iso, target, sequence),
+    guide_stop() und abort(). Alle außer abort() erhalten zusätzlich 'abort'
+    (threading.Event) und sollen damit warten, siehe sleep().
+    """
+    thread = None
+
+    # Parameter eines Plans mit Standardwerten
+    defaults = {'target': None, 'count': 1, 'duration': 60, 'iso': 800, 'dither': 0, 'dither_amount': 3,
+                'settle_pixels': 1.5, 'settle_time': 10, 'settle_timeout': 60, 'guide': True, 'platesolve': False}
+
+    def __init__(self, bus, actions, history=500):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param actions: Dict Name -> Funktion der Geräte-Schritte
+        :param history: Anzahl der gespeicherten Ereignisse für nachzügelnde Abonnenten.
+        """
+        SimplePlugin.__init__(self, bus)
+        self.actions = actions
+        self.abort_event = threading.Event()
+        self.sequence = None
+        self.version = 0
+        self.events = deque(maxlen=history)
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.abort()
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _plan(self, plan):
+        """
+        Prüft einen Plan und ergänzt fehlende Parameter.
+        :param plan: Dict mit Parametern, siehe 'defaults'
+        :return: Vollständiger Plan
+        :raises ValueError: bei unbekannten oder ungültigen Parametern.
+        """
+        unknown = set(plan) - set(self.defaults)
+        if unknown:
+            raise ValueError("Unbekannte Parameter: " + ", ".join(sorted(unknown)))
+        result = dict(self.defaults)
+        result.update(plan)
+        for key in ('count', 'dither'):
+            result[key] = int(result[key])
+        for key in ('duration', 'dither_amount', 'settle_pixels', 'settle_time', 'settle_timeout'):
+            result[key] = float(result[key])
+        for key in ('guide', 'platesolve'):
+            result[key] = str(result[key]) not in ("0", "False", "false")
+        if result['count'] < 1 or result['duration'] <= 0:
+            raise ValueError("Anzahl und Belichtungszeit müssen größer 0 sein")
+        if result['dither_amount'] <= 0:
+            raise ValueError("Dither-Weite muss größer 0 sein")
+        return result
+
+    def begin(self, plan):
+        """
+        Startet eine Sequenz. Es läuft immer höchstens eine.
+        :param plan: Dict mit Parametern, siehe 'defaults'
+        :return: ID der Sequenz
+        :raises RuntimeError: wenn bereits eine Sequenz läuft.
+        """
+        plan = self._plan(plan)
+        with self.cond:
+            if self.thread is not None and self.thread.is_alive():
+                raise RuntimeError("Es läuft bereits eine Sequenz")
+            self.abort_event.clear()
+            self.sequence = {'id': uuid.uuid4().hex, 'plan': plan, 'state': 'starting', 'frame': 0,
+                             'frames': [], 'started': time.time(), 'finished': None, 'error': None}
+            self.thread = threading.Thread(target=self._run, args=(self.sequence,))
+            self.thread.daemon = True
+            self.thread.start()
+            return self.sequence['id']
+
+    def abort(self):
+        """
+        Bricht die laufende Sequenz ab.
+        :return: True, wenn eine Sequenz lief.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            return False
+        self.abort_event.set()
+        try:
+            self.actions['abort']()
+        except Exception as e:
+            self._publish(self.sequence, self.sequence['state'], "Abbruch: " + str(e))
+        return True
+
+    def status(self):
+        """
+        :return: Zustand der aktuellen bzw. letzten Sequenz (Dict), None wenn noch keine lief.
+        """
+        with self.cond:
+            if self.sequence is None:
+                return None
+            status = dict(self.sequence)
+            status['frames'] = list(status['frames'])
+            return status
+
+    def wait(self, version, timeout=15):
+        """
+        Wartet auf Ereignisse nach 'version'.
+        :param version: Zuletzt bekannte Version des Abonnenten
+        :param timeout: Maximale Wartezeit in Sekunden.
+        :return: (neue Version, Liste der Ereignisse seit 'version')
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            if version > self.version:
+                # Version stammt von vor einem Server-Neustart
+                version = 0
+            while self.running and self.version <= version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return version, []
+                self.cond.wait(remaining)
+            return self.version, [e for e in self.events if e['version'] > version]
+
+    def _publish(self, sequence, state, message="", **extra):
+        """
+        Setzt den Zustand der Sequenz und veröffentlicht ein Ereignis.
+        """
+        with self.cond:
+            sequence['state'] = state
+            self.version += 1
+            event = {'version': self.version, 'time': time.time(), 'sequence': sequence['id'], 'state': state,
+                     'frame': sequence['frame'], 'count': sequence['plan']['count'], 'message': message}
+            event.update(extra)
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def _step(self, current, state, action, message="", **params):
+        """
+        Führt eine Aktion als Zustand der Sequenz aus.
+        :param current: Laufende Sequenz ('sequence' ist ein möglicher Parameter der Aktion)
+        :return: Ergebnis der Aktion
+        :raises SequenceAborted: wenn vor oder während der Aktion abgebrochen wurde.
+        """
+        if self.abort_event.is_set():
+            raise SequenceAborted()
+        self._publish(current, state, message)
+        started = time.time()
+        result = self.actions[action](abort=self.abort_event, **params)
+        if self.abort_event.is_set():
+            raise SequenceAborted()
+        self._publish(current, state, "fertig", seconds=time.time() - started, result=result)
+        return result
+
+    def _run(self, sequence):
+        plan = sequence['plan']
+        guiding = False
+        try:
+            if plan['target']:
+                self._step(sequence, 'slewing', 'slew', "Ziel " + plan['target'], target=plan['target'])
+            if plan['platesolve']:
+                self._step(sequence, 'solving', 'platesolve')
+            settle = {'settle_pixels': plan['settle_pixels'], 'settle_time': plan['settle_time'],
+                      'settle_timeout': plan['settle_timeout']}
+            if plan['guide']:
+                guiding = True
+                self._step(sequence, 'guiding', 'guide', **settle)
+            for i in range(plan['count']):
+                if plan['guide'] and plan['dither'] and i > 0 and i % plan['dither'] == 0:
+                    self._step(sequence, 'dithering', 'dither', amount=plan['dither_amount'], **settle)
+                sequence['frame'] = i + 1
+                result = self._step(sequence, 'exposing', 'expose', "Belichtung %d/%d" % (i + 1, plan['count']),
+                                    duration=plan['duration'], iso=plan['iso'], target=plan['target'],
+                                    sequence=sequence['id'])
+                with self.cond:
+                    sequence['frames'].append(result['path'])
+            state, message = 'done', "Sequenz beendet"
+        except SequenceAborted:
+            state, message = 'aborted', "Sequenz abgebrochen"
+        except Exception as e:
+            if self.abort_event.is_set():
+                # Folgefehler des Abbruchs, z.B. Settle durch gestopptes Guiding beendet
+                state, message = 'aborted', "Sequenz abgebrochen (%s)" % e
+            else:
+                state, message = 'failed', str(e)
+                sequence['error'] = message
+        if guiding:
+            try:
+                self.actions['guide_stop'](abort=threading.Event())
+            except Exception as e:
+                message += ", Guiding nicht beendet: " + str(e)
+        sequence['finished'] = time.time()
+        self._publish(sequence, state, message)
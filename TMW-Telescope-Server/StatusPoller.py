@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import threading
+import time
+
+from cherrypy.process.plugins import SimplePlugin
+
+
+class StatusPoller(SimplePlugin):
+    """
+    Fragt den Status aller Geräte zentral in einem Thread ab und verteilt nur
+    die Änderungen an beliebig viele Abonnenten. N Dashboards kosten so eine
+    einzige Geräteabfrage pro Intervall statt N.
+    """
+    thread = None
+
+    def __init__(self, bus, sources, interval=2, history=100):
+        """
+        :param bus: CherryPy-Bus (cherrypy.engine)
+        :param sources: Dict Name -> Funktion, die den Status als JSON-fähigen Wert liefert.
+        :param interval: Abfrage-Intervall in Sekunden.
+        :param history: Anzahl der gespeicherten Änderungen für nachzügelnde Abonnenten.
+        """
+        SimplePlugin.__init__(self, bus)
+        self.sources = sources
+        self.interval = interval
+        self.status = {}
+        self.version = 0
+        self.history = deque(maxlen=history)
+        self.running = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        self.running = True
+        if not self.thread:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Abfrage-Schleife.
+        """
+        while self.running:
+            started = time.time()
+            self.poll()
+            with self.cond:
+                if self.running:
+                    self.cond.wait(max(0, self.interval - (time.time() - started)))
+
+    def poll(self):
+        """
+        Fragt alle Quellen einmal ab und veröffentlicht die Änderungen.
+        :return:
+        """
+        sample = {}
+        for name, func in self.sources.items():
+            try:
+                sample[name] = func()
+            except Exception as e:
+                sample[name] = {'error': str(e)}
+        with self.cond:
+            changes = dict((k, v) for k, v in sample.items() if self.status.get(k) != v)
+            if changes:
+                self.status.update(changes)
+                self.version += 1
+                self.history.append((self.version, changes))
+                self.cond.notify_all()
+
+    def wait(self, version, timeout=15):
+        """
+        Wartet, bis es einen neueren Stand als 'version' gibt.
+        :param version: Zuletzt bekannte Version des Abonnenten, 0 für den vollständigen Stand.
+        :param timeout: Maximale Wartezeit in Sekunden.
+        :return: (neue Version, Dict der Änderungen seit 'version'), bei Zeitüberschreitung ohne Änderungen.
+        """
+        deadline = time.time() + timeout
+        with self.cond:
+            if version > self.version:
+                # Version stammt von vor einem Server-Neustart
+                version = 0
+            while self.running and self.version <= version:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return version, {}
+                self.cond.wait(remaining)
+            if self.version <= version:
+                return version, {}
+            if version <= 0 or not self.history or self.history[0][0] > version + 1:
+                # Abonnent ist neu oder zu weit zurück: vollständiger Stand
+                return self.version, dict(self.status)
+            changes = {}
+            for v, change in self.history:
+                if v > version:
+                    changes.update(change)
+            return self.version, changes
+
+
+class SubscriberLimit(object):
+    """
+    Begrenzt die gleichzeitig offenen Event-Streams und Long-Polls. Jeder davon
+    belegt für seine ganze Dauer einen Thread des CherryPy-Pools; ohne Grenze
+    blieben bei vielen Abonnenten keine Threads für die übrigen Routen.
+    """
+
+    def __init__(self, limit):
+        """
+        :param limit: Maximale Anzahl gleichzeitiger Abonnenten
+        """
+        self.limit = limit
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        :return: False, wenn bereits 'limit' Abonnenten verbunden sind.
+        """
+        with self.lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
@@ -1,75 +1,34 @@
 # -*- coding: utf-8 -*-
+import argparse
 import configparser
 import datetime
-from io import BytesIO
+import hashlib
+import json
+import math
 import os
 import socket
 import subprocess
 import time
+import types
 import cherrypy
-import pythoncom
-import struct
-import win32com
-import win32com.client
-from astropy.coordinates import *
-from astropy.time import Time
-from cherrypy.lib import file_generator
+from cherrypy.lib import cptools, httputil, static
 import queue
-import threading
-import http.client
-from cherrypy.process.plugins import SimplePlugin
-
-
-class BackgroundTaskQueue(SimplePlugin):
-    """
-    Die Klasse BackgroundTaskQueue ermöglicht die Funktionalität von Rückantworten nach Abschluss einer Aktion.
-    http://tools.cherrypy.org/wiki/BackgroundTaskQueue
-    """
-    thread = None
-
-    def __init__(self, bus, qsize=100, qwait=2, safe_stop=True):
-        SimplePlugin.__init__(self, bus)
-        self.q = queue.Queue(qsize)
-        self.qwait = qwait
-        self.safe_stop = safe_stop
-
-    def start(self):
-        self.running = True
-        if not self.thread:
-            self.thread = threading.Thread(target=self.run)
-            self.thread.start()
-
-    def stop(self):
-        if self.safe_stop:
-            self.running = "draining"
-        else:
-            self.running = False
-
-        if self.thread:
-            self.thread.join()
-            self.thread = None
-        self.running = False
-
-    def run(self):
-        while self.running:
-            try:
-                try:
-                    func, args, kwargs = self.q.get(block=True, timeout=self.qwait)
-                except queue.Empty:
-                    if self.running == "draining":
-                        return
-                    continue
-                else:
-                    func(*args, **kwargs)
-                    if hasattr(self.q, 'task_done'):
-                        self.q.task_done()
-            except:
-                self.bus.log("Error in BackgroundTaskQueue %r." % self,
-                             level=40, traceback=True)
-
-    def put(self, func, *args, **kwargs):
-        """Schedule the given func to be run."""
-        self.q.put((func, args, kwargs))
+import shlex
+from BackgroundTaskQueue import BackgroundTaskQueue, PRIORITY_LOW
+from CallbackDispatcher import CallbackDispatcher, CallbackOutbox, callback_port
+from DeviceConnection import DeviceConnection, QueuedDeviceConnection
+from Drivers import DeviceEndpoints, Lazy, driver, load
+from FrameIngest import FrameCatalog, FrameIngest, tar_stream
+from Metrics import MetricsTool, registry, timed
+from MountDriver import MountService
+from MountTelemetry import MountTelemetry
+from PHD2Client import PHD2Client
+from Readiness import wait_for_port, wait_for_process, wait_until
+from Preview import PreviewCache, PreviewService
+from ProcessManager import ProcessManager
+from ScreenshotService import ScreenshotService
+from Sequencer import SequenceAborted, Sequencer, sleep
+from StatusPoller import StatusPoller, SubscriberLimit
 
 
 class PHDCommunicator():
@@ -77,23 +36,32 @@ class PHDCommunicator():
     Kommunikations-Klasse für PHD Vebrindungen.
     """
 
-    def __init__(self):
+    def __init__(self, connection=None):
         """
-        Konstruktor, baut eine Verbindung auf.
+        Konstruktor, nutzt die dauerhafte PHD-Verbindung.
+        :param connection: DeviceConnection, ohne Angabe die gemeinsame Verbindung des Servers.
         """
+        self.connection = connection or phd_connection
+
+    # Fristen für Befehle, deren Antwort länger dauern kann (Standard: 5 Sekunden)
+    timeouts = {3: 10, 4: 10, 5: 10, 12: 10, 13: 10, 14: 15, 19: 10, 20: 10}
 
-        self.s = socket.socket()
-        self.host = socket.gethostname()
-        self.port = 4300  # PHD Port
-        self.s.connect((self.host, self.port))
+    # Dither-Weite 1 bis 5 -> MSG_MOVE1 bis MSG_MOVE5
+    dithers = {1: 3, 2: 4, 3: 5, 4: 12, 5: 13}
 
-    def __del__(self):
+    @classmethod
+    def _exchange(cls, channel, cmd):
         """
-        Schließt die Verbindung bei Zerstörung des Kommunikators.
-        :return:
+        Sendet einen Befehl über die Verbindung und liest die Antwort.
+        Jede Antwort von PHD ist genau ein Byte lang.
+        :param channel: BufferedChannel der Verbindung
+        :param cmd: Befehl in Form einer Zahl.
+        :return: Antwort des Servers in Form einer Zahl.
         """
-        self.s.close()
+        channel.sendall(bytes((cmd,)))
+        return channel.read_exact(1, cls.timeouts.get(cmd))[0]
 
+    @timed('phd', lambda self, cmd: str(cmd))
     def _sendandreceive(self, cmd):
         """
         Sendet einen Befehl an den PHD Server und liest dessen Antwort.
@@ -102,11 +70,7 @@ class PHDCommunicator():
         :param cmd: Befehl in Form einer Zahl.
         :return: Antwort des Servers in Form einer Zahl.
         """
-        byte = bytearray()
-        byte.append(cmd)
-        self.s.send(byte)
-        dat = self.s.recv(8)
-        return struct.unpack('B', dat)[0]
+        return self.connection.transact(lambda channel: self._exchange(channel, cmd))
 
     def getstatus(self, returnstatuscode=False):
         """
@@ -180,46 +144,101 @@ class PHDCommunicator():
         else:
             return False
 
+    def getdistance(self):
+        """
+        Wrapper für den Befehl "MSG_REQDIST".
+        :return: Aktuelle Abweichung des Leitsterns in Pixeln (PHD liefert 1/100 Pixel, höchstens 2,55).
+        """
+        return self._sendandreceive(10) / 100.0
+
+    def dither(self, amount=1):
+        """
+        Wrapper für die Befehle "MSG_MOVE1" bis "MSG_MOVE5".
+        :param amount: Dither-Weite von 1 (klein) bis 5 (groß)
+        :return: Antwort von PHD
+        """
+        return self._sendandreceive(self.dithers[amount])
+
+    def settle(self, pixels, settle_time, timeout, abort):
+        """
+        Wartet, bis PHD guidet und die Abweichung für 'settle_time' Sekunden unter 'pixels' bleibt.
+        :param pixels: Maximale Abweichung in Pixeln
+        :param settle_time: Geforderte ruhige Zeit in Sekunden
+        :param timeout: Maximale Wartezeit in Sekunden
+        :param abort: threading.Event des Sequencers
+        :return: Dict mit Abweichung und Wartezeit in Sekunden.
+        :raises TimeoutError: wenn sich das Guiding nicht rechtzeitig beruhigt.
+        """
+        started = time.time()
+        stable_since = None
+        while True:
+            distance = self.getdistance()
+            now = time.time()
+            if self.getstatus(True) == 3 and distance <= pixels:
+                stable_since = stable_since or now
+                if now - stable_since >= settle_time:
+                    return {'distance': distance, 'settle': now - started}
+            else:
+                stable_since = None
+            if now - started > timeout:
+                raise TimeoutError("Guiding nach %d s nicht beruhigt (Abweichung %.2f px)" % (timeout, distance))
+            sleep(abort, 0.5)
+
 
 class BYECommunicator():
     """
     Kommunikator für die Software BackyardEOS.
     """
 
-    def __init__(self):
+    def __init__(self, connection=None):
         """
-        Konstruktor, verbindet sich mit BYE.
+        Konstruktor, nutzt die dauerhafte Verbindung zu BYE.
+        :param connection: QueuedDeviceConnection, ohne Angabe die gemeinsame Verbindung des Servers.
         """
-        try:
-            self.s = socket.socket()
-            self.s.connect(('localhost', 1499))
-        except Exception as e:
-            raise (e)
+        self.connection = connection or bye_connection
 
-    def __del__(self):
+    # BYE schließt Antworten nicht zuverlässig ab. Eine Antwort gilt als vollständig, wenn
+    # nach den ersten Bytes für reply_idle Sekunden nichts mehr folgt. Nur wenn bekannt ist,
+    # dass die eingesetzte Version jede Antwort mit einem Endezeichen abschließt, kann es
+    # unter 'BYETerminator' eingetragen werden, dann entfällt diese Wartezeit.
+    terminator = b""
+    reply_idle = 0.1
+
+    @classmethod
+    def _exchange(cls, channel, cmd):
         """
-        Schließt die Verbindung bei Software-Ende.
-        :return:
+        Sendet einen Befehl über die Verbindung und liest die Antwort.
+        :param channel: BufferedChannel der Verbindung
+        :param cmd: Befehl als String
+        :return: Daten aus BYE
         """
-        self.s.close()
+        # Reste früherer Antworten, z.B. auf 'takepicture', gehören nicht zu diesem Befehl
+        channel.discard()
+        channel.sendall(cmd.encode())
+        if cls.terminator:
+            reply = channel.read_until(cls.terminator)
+        else:
+            reply = channel.read_until(b"\n", idle=cls.reply_idle)
+        return reply.decode().rstrip("\r")
 
+    @timed('bye', lambda self, cmd: cmd.split(" ", 1)[0])
     def _sendandreceive(self, cmd):
         """
         Sendet einen Befehl an BYE und gibt die Antwort zurück.
         :param cmd: Befehl als String
         :return: Daten aus BYE
         """
-        self.s.send(cmd.encode())
-        dat = self.s.recv(16).decode()
-        return dat
+        return self.connection.request(lambda channel: self._exchange(channel, cmd))
 
+    @timed('bye', lambda self, cmd: cmd.split(" ", 1)[0])
     def _send(self, cmd):
         """
-        Sendet einen Befehl, wertet die Antwort nicht aus.
+        Sendet einen Befehl, wertet die Antwort nicht aus. Eine eventuelle
+        Antwort verwirft der nächste Befehl.
         :param cmd:
         :return:
         """
-        self.s.send(cmd.encode())
+        self.connection.request(lambda channel: channel.sendall(cmd.encode()))
 
     def getstatus(self):
         """
@@ -255,6 +274,23 @@ class BYECommunicator():
         return status
 
 
+def json_or_bytes(*args, **kwargs):
+    """
+    Handler für cherrypy.tools.json_out: Routen, die neben JSON auch Dateien
+    liefern (z.B. Vorschaubilder), geben diese als bytes zurück, Event-Streams
+    als Generator.
+    :return: Antwort-Daten
+    """
+    value = cherrypy.serving.request._json_inner_handler(*args, **kwargs)
+    if isinstance(value, (bytes, types.GeneratorType)):
+        return value
+    return json.dumps(value).encode()
+
+
+# Bearbeitungszeit und Bytes je Route für '/metrics'
+cherrypy.tools.metrics = MetricsTool()
+
+
 class TMWServer(object):
     """
     Die Klasse TMWServer stellt den eigentlichen lokalen Server dar.
@@ -319,33 +355,303 @@ class TMWServer(object):
           </html>"""
 
     @cherrypy.expose
-    def screenshot(self, **params):
+    @cherrypy.tools.json_out(handler=json_or_bytes)
+    def screenshot(self, scale="1", format="png", **params):
         """
         Route '/screenshot' - Liefert ein Screenshot vom ausführenden Server.
+        Alle Clients teilen sich die zuletzt aufgenommene Aufnahme.
+        :param scale: Optionaler Verkleinerungsfaktor größer 0 bis 1, wird auf 1/2, 1/4 ... 1/16 aufgerundet.
+        :param format: 'png' (default) oder 'jpeg'
         :param params: -
-        :return: PNG-Daten des Screenshots.
+        :return: Bilddaten des Screenshots, JSON-Daten bei ungültigem Faktor.
+        """
+        try:
+            scale = float(scale)
+        except ValueError:
+            scale = None
+        if scale is None or not 0 < scale <= 1:
+            return {'status': False, 'message': "Verkleinerungsfaktor muss größer 0 und höchstens 1 sein"}
+        frame = screenshots.latest()
+        data, content_type, etag = frame.variant(scale, "jpeg" if format == "jpeg" else "png")
+        cherrypy.response.headers['Content-Type'] = content_type
+        cherrypy.response.headers['ETag'] = etag
+        cherrypy.response.headers['Last-Modified'] = httputil.HTTPDate(frame.captured)
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        # Unverändertes Bild: 304 Not Modified
+        cptools.validate_etags()
+        return data
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def rig_start(self):
+        """
+        Route '/rig_start' - startet BYE, PHD und AstroTortilla parallel im Hintergrund.
+        Die Start-Scripte laufen nur parallel, solange sie unter 'BDSParallelScripts' stehen.
+        :return: JSON-Daten mit den IDs der Aufgaben.
+        """
+        try:
+            return {'status': True,
+                    'jobs': {'bye': bgtask.submit(background_bye_start, lane="camera"),
+                             'phd': bgtask.submit(background_phd_start, lane="guider"),
+                             'at': bgtask.submit(background_at_start, lane="solver")}}
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def queue_status(self):
+        """
+        Route '/queue_status' - Kennzahlen der Hintergrund-Warteschlange.
+        :return: JSON-Daten mit Tiefe, Warte- und Laufzeiten.
+        """
+        return {'status': True, 'queue': bgtask.metrics()}
+
+    @cherrypy.expose
+    def metrics(self):
         """
-        # Header auf image/png für die Bildausgabe setzen
-        cherrypy.response.headers['Content-Type'] = 'image/png'
-        # Über die mitgelieferte Screenshto.exe ein Bildschirmfoto schießen.
-        #proc = subprocess.Popen(current_dir + "\\" + Config.get("Settings", "PathToScreenshot"))
-        proc = subprocess.Popen(current_dir + "\\screenshot\\Screenshot.exe")
-        proc.wait()
-        # Bildschirmfoto öffnen und per file_generator an den Clienten zurückgeben.
-        f = open('screenshot.png', 'rb')
-        data = BytesIO(f.read())
-        f.close()
-        return file_generator(data)
+        Route '/metrics' - Kennzahlen im Textformat von Prometheus: Bearbeitungszeit
+        und Bytes je Route, Dauer der Gerätebefehle, Warteschlange und Rückantworten.
+        :return: Text der Kennzahlen
+        """
+        cherrypy.response.headers['Content-Type'] = "text/plain; version=0.0.4; charset=utf-8"
+        return registry.render().encode()
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def jobs(self, job_id=None, ids=""):
+        """
+        Route '/jobs/<id>' - Zustand, Zeiten, Ergebnis und Fehler einer Hintergrund-Aufgabe.
+        Mit '/jobs?ids=a,b,c' werden mehrere Aufgaben in einer Anfrage abgefragt.
+        :param job_id: ID der Aufgabe
+        :param ids: Kommagetrennte Liste von IDs
+        :return: JSON-Daten der Aufgabe(n).
+        """
+        if job_id is not None:
+            job = bgtask.job(job_id)
+            if job is None:
+                return {'status': False, 'message': "Unbekannte oder abgelaufene Aufgabe"}
+            return {'status': True, 'job': job}
+        return {'status': True, 'jobs': dict((i, bgtask.job(i)) for i in ids.split(",") if i)}
 
     @cherrypy.expose
+    @cherrypy.tools.json_out()
     def run(self, name):
         """
         Route '/run' - führt ein BDS-Script aus.
         :param name: Name des Scriptes.
-        :return:
+        :return: JSON-Daten des Status mit ID des Prozesses ('/processes/<id>').
         """
-        bdsrun(name)
-        pass
+        try:
+            return {'status': True, 'process': bdsrun(name, wait=False)['id']}
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def processes(self, process_id=None, state=None):
+        """
+        Route '/processes' - gestartete externe Programme (BDS-Scripte, Screenshot.exe)
+        mit Zustand, Laufzeit und Exit-Code. '/processes/<id>' liefert zusätzlich die Ausgabe.
+        :param process_id: ID des Prozesses
+        :param state: Optionaler Filter, z.B. 'running' oder 'failed'
+        :return: JSON-Daten der Prozesse.
+        """
+        if process_id is not None:
+            process = process_manager.process(process_id)
+            if process is None:
+                return {'status': False, 'message': "Unbekannter oder abgelaufener Prozess"}
+            return {'status': True, 'process': process}
+        return {'status': True, 'processes': process_manager.processes(state)}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def callbacks(self, callback_id=None, state=None):
+        """
+        Route '/callbacks' - Rückantworten an den Server mit Zustand, Versuchen und
+        letztem Fehler. '/callbacks/<id>' liefert eine einzelne Rückantwort.
+        :param callback_id: ID der Rückantwort
+        :param state: Optionaler Filter, z.B. 'pending' oder 'failed'
+        :return: JSON-Daten der Rückantworten.
+        """
+        try:
+            if callback_id is not None:
+                callback = callbacks.outbox.get(int(callback_id))
+                if callback is None:
+                    return {'status': False, 'message': "Unbekannte Rückantwort"}
+                return {'status': True, 'callback': callback}
+            return {'status': True, 'dispatcher': callbacks.metrics(), 'callbacks': callbacks.outbox.find(state)}
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def callbacks_retry(self):
+        """
+        Route '/callbacks_retry' - stellt endgültig fehlgeschlagene Rückantworten erneut zu.
+        :return: JSON-Daten mit der Anzahl erneut eingereihter Rückantworten.
+        """
+        return {'status': True, 'queued': callbacks.retry_failed()}
+
+    # </editor-fold>
+
+    # <editor-fold desc="Status Routen">
+
+    @staticmethod
+    def _subscribe(since):
+        """
+        Prüft die Anfrage eines Abonnenten und belegt einen der begrenzten Plätze.
+        :param since: Zuletzt empfangene Version (alternativ Header 'Last-Event-ID').
+        :return: (Version, None) oder (None, JSON-Daten des Fehlers); bei Erfolg muss
+                 der Platz mit subscribers.release() wieder freigegeben werden.
+        """
+        try:
+            version = int(cherrypy.request.headers.get('Last-Event-ID', since))
+        except ValueError:
+            return None, {'status': False, 'message': "Ungültige Version: " + str(since)}
+        if not subscribers.acquire():
+            cherrypy.response.status = 503
+            cherrypy.response.headers['Retry-After'] = "30"
+            return None, {'status': False, 'message': "Zu viele Abonnenten (höchstens %d)" % subscribers.limit}
+        return version, None
+
+    @staticmethod
+    def _event_stream(events):
+        """
+        Liefert einen Event-Stream und gibt den Platz des Abonnenten frei, sobald er endet.
+        :param events: Generator der Ereignisse als bytes
+        :return: Event-Stream
+        """
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+
+        def stream():
+            try:
+                for event in events:
+                    yield event
+            finally:
+                subscribers.release()
+
+        return stream()
+
+    @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
+    @cherrypy.tools.json_out(handler=json_or_bytes)
+    def events(self, since="0"):
+        """
+        Route '/events' - Server-Sent-Events mit dem Status von PHD, BYE und EQMOD.
+        Zuerst wird der vollständige Stand gesendet, danach nur noch Änderungen.
+        Jeder Abonnent belegt einen Server-Thread, oberhalb von 'EventSubscribers'
+        wird mit 503 abgelehnt.
+        :param since: Zuletzt empfangene Version (alternativ Header 'Last-Event-ID').
+        :return: Event-Stream, JSON-Daten bei einem Fehler.
+        """
+        version, error = self._subscribe(since)
+        if error:
+            return error
+
+        def stream(version):
+            while status_poller.running:
+                version, changes = status_poller.wait(version)
+                if changes:
+                    yield ("id: %d\nevent: status\ndata: %s\n\n" % (version, json.dumps(changes))).encode()
+                else:
+                    # Kommentarzeile hält die Verbindung offen
+                    yield b": keepalive\n\n"
+
+        return self._event_stream(stream(version))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def status_changes(self, since="0", timeout="25"):
+        """
+        Route '/status_changes' - Long-Poll-Variante von '/events'. Antwortet, sobald
+        sich seit 'since' etwas geändert hat, spätestens nach 'timeout' Sekunden.
+        Wartende Anfragen zählen zu den Abonnenten von '/events'.
+        :param since: Zuletzt empfangene Version, 0 für den vollständigen Stand.
+        :param timeout: Maximale Wartezeit in Sekunden.
+        :return: JSON-Daten mit Version und Änderungen.
+        """
+        try:
+            timeout = min(float(timeout), 60)
+        except ValueError:
+            return {'status': False, 'message': "Ungültige Wartezeit: " + timeout}
+        version, error = self._subscribe(since)
+        if error:
+            return error
+        try:
+            version, changes = status_poller.wait(version, timeout)
+        finally:
+            subscribers.release()
+        return {'status': True, 'version': version, 'changes': changes}
+
+    # </editor-fold>
+
+    # <editor-fold desc="Sequenz Routen">
+
+    @cherrypy.expose
+    @cherrypy.tools.json_in(force=False)
+    @cherrypy.tools.json_out()
+    def sequence_start(self, **params):
+        """
+        Route '/sequence_start' - führt einen Aufnahmeplan lokal aus: Schwenk, optional
+        Plate-Solve, Guiding und 'count' Belichtungen mit Dithern alle 'dither' Bilder.
+        Parameter per GET oder als JSON-Body, siehe Sequencer.defaults.
+        Fortschritt über '/sequence_status' und '/sequence_events'.
+        :return: JSON-Daten des Status mit ID der Sequenz.
+        """
+        try:
+            params.update(getattr(cherrypy.request, 'json', None) or {})
+            return {'status': True, 'sequence': sequencer.begin(params)}
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def sequence_status(self):
+        """
+        Route '/sequence_status' - Zustand der laufenden bzw. letzten Sequenz.
+        :return: JSON-Daten der Sequenz.
+        """
+        return {'status': True, 'sequence': sequencer.status()}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def sequence_abort(self):
+        """
+        Route '/sequence_abort' - bricht die laufende Sequenz ab, stoppt Schwenk und Guiding.
+        :return: JSON-Daten des Status.
+        """
+        try:
+            if sequencer.abort():
+                return {'status': True}
+            return {'status': False, 'message': "Keine laufende Sequenz"}
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
+    @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
+    @cherrypy.tools.json_out(handler=json_or_bytes)
+    def sequence_events(self, since="0"):
+        """
+        Route '/sequence_events' - Server-Sent-Events mit dem Fortschritt der Sequenz.
+        Zählt zu den Abonnenten von '/events'.
+        :param since: Zuletzt empfangene Version (alternativ Header 'Last-Event-ID').
+        :return: Event-Stream, JSON-Daten bei einem Fehler.
+        """
+        version, error = self._subscribe(since)
+        if error:
+            return error
+
+        def stream(version):
+            while sequencer.running:
+                version, events = sequencer.wait(version)
+                for event in events:
+                    yield ("id: %d\nevent: sequence\ndata: %s\n\n" % (event['version'], json.dumps(event))).encode()
+                if not events:
+                    # Kommentarzeile hält die Verbindung offen
+                    yield b": keepalive\n\n"
+
+        return self._event_stream(stream(version))
 
     # </editor-fold>
 
@@ -359,20 +665,15 @@ class TMWServer(object):
         :return: JSON-Daten mit Status.
         """
         try:
-            pythoncom.CoInitialize()
-            # COM-Objekt ansteuern
-            o = win32com.client.Dispatch("EQMOD.Telescope")
-            # Verbindung mit dem Teleskop herstellen
-            o.Connected = True
-            o.IncClientCount()
+            # Verbindung mit dem Teleskop herstellen.
             # Wenn CanSlew True zurückgibt, wurde die Verbindung hergestellt.
-            if o.CanSlew:
+            if mount.call('start'):
                 return {'status': True}
             else:
                 return {'status': False,
                         'message': "Fehler beim Starten von EQMOD (Teleskop verbunden & eingeschaltet?)"}
         except Exception as e:
-            return {'status': False, 'message': "Fehler beim Starten von EQMOD: " + e.message}
+            return {'status': False, 'message': "Fehler beim Starten von EQMOD: " + str(e)}
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -382,14 +683,10 @@ class TMWServer(object):
         :return: JSON-Daten mit Status.
         """
         try:
-            # COM-Objekt ansteuern
-            pythoncom.CoInitialize()
-            o = win32com.client.Dispatch("EQMOD.Telescope")
-            # Beendet EQMod
-            o.StopClientCount()
+            mount.call('stop')
             return {'status': True}
         except Exception as e:
-            return {'status': False, 'message': "Konnte EQMOD nicht beenden", 'detail': e.message}
+            return {'status': False, 'message': "Konnte EQMOD nicht beenden", 'detail': str(e)}
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -399,12 +696,10 @@ class TMWServer(object):
         :return: JSON-Daten mit Status.
         """
         try:
-            pythoncom.CoInitialize()
-            o = win32com.client.Dispatch("EQMOD.Telescope")
-            o.Unpark()
+            mount.call('unpark')
             return {'status': True}
         except Exception as e:
-            return {'status': False, 'message': "Konnte EQMOD nicht unparken", 'detail': e.message}
+            return {'status': False, 'message': "Konnte EQMOD nicht unparken", 'detail': str(e)}
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -414,12 +709,10 @@ class TMWServer(object):
         :return: JSON-Daten mit Status.
         """
         try:
-            pythoncom.CoInitialize()
-            o = win32com.client.Dispatch("EQMOD.Telescope")
-            o.Park()
+            mount.call('park')
             return {'status': True}
         except Exception as e:
-            return {'status': False, 'message': "Konnte EQMOD nicht parken", 'detail': e.message}
+            return {'status': False, 'message': "Konnte EQMOD nicht parken", 'detail': str(e)}
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -430,12 +723,29 @@ class TMWServer(object):
         :return: JSON-Daten mit Status.
         """
         try:
-            pythoncom.CoInitialize()
-            o = win32com.client.Dispatch("EQMOD.Telescope")
-            o.SetPark()
+            mount.call('set_park')
             return {'status': True}
         except Exception as e:
-            return {'status': False, 'message': "Konnte EQMOD ParkPosition nicht setzen", 'detail': e.message}
+            return {'status': False, 'message': "Konnte EQMOD ParkPosition nicht setzen", 'detail': str(e)}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def eqmod_state(self, history=None, since=None):
+        """
+        Route '/eqmod_state' - letzter Zustand der Montierung aus dem Telemetrie-Cache
+        (RA/Dec, Alt/Az, Slewing, Park), ohne die Montierung selbst abzufragen.
+        :param history: Optional: Anzahl der letzten Werte aus dem Ringpuffer.
+        :param since: Optional: nur Werte nach diesem Zeitpunkt (Unix-Zeit).
+        :return: JSON-Daten mit Zustand.
+        """
+        state = telemetry.state()
+        if state is None:
+            return {'status': False, 'message': "Noch keine Daten der Montierung", 'detail': telemetry.error}
+        result = {'status': telemetry.error is None, 'state': state, 'error': telemetry.error}
+        if history is not None or since is not None:
+            result['history'] = telemetry.history(int(history) if history is not None else None,
+                                                  float(since) if since is not None else None)
+        return result
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -449,11 +759,18 @@ class TMWServer(object):
         :param object_name: GoTo Objekt Name als NGC-Katalogeintrag.
         :return: JSON-Daten mit Status.
         """
+        if host != "":
+            try:
+                port = callback_port(port)
+            except ValueError as e:
+                return {'status': False, 'message': str(e)}
         try:
             # Das eigentliche GoTo wird später erledigt. Hier wurde der Befehl nut entgegengenommen
             # und direkt eine Antwort formuliert.
-            bgtask.put(background_eqmod_goto_name, object_name, host, port, cmd, key)
-            return {'status': True}
+            job_id = bgtask.submit(background_eqmod_goto_name, (object_name, host, port, cmd, key), lane="mount")
+            return {'status': True, 'job': job_id}
+        except queue.Full as e:
+            return {'status': False, 'message': "GoTo abgelehnt, Warteschlange voll", 'detail': str(e)}
         except Exception as e:
             return {'status': False, 'message': "Fehler beim GoTo", 'detail': str(e)}
 
@@ -465,20 +782,12 @@ class TMWServer(object):
     @cherrypy.tools.json_out()
     def bye_start(self):
         """
-        Route '/bye_start' - startet BackyardEOS und verbindet sich zum Test.
-        :return: JSON-Daten des Status.
+        Route '/bye_start' - startet BackyardEOS im Hintergrund und verbindet sich zum Test,
+        sobald BYE bereit ist. Ergebnis über '/jobs/<id>'.
+        :return: JSON-Daten des Status mit ID der Aufgabe.
         """
         try:
-            bdsrun("bye_start")
-            time.sleep(20)
-            try:
-                status = None
-                bye = BYECommunicator()
-                status = bye.getstatus()
-                bye = None
-                return {'status': status != "error"}
-            except Exception as e:
-                return {'status': False, 'message': str(e)}
+            return {'status': True, 'job': bgtask.submit(background_bye_start, lane="camera")}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
@@ -490,11 +799,8 @@ class TMWServer(object):
         :return: JSON-Daten mti BYE Status.
         """
         try:
-            # Kommunikator erstellen.
             bye = BYECommunicator()
             status = bye.getstatus()
-            # Kommunikator wieder beenden.
-            bye = None
             return {'status': status != "error", 'message': status}
         except Exception as e:
             return {'status': False, 'message': str(e)}
@@ -511,34 +817,30 @@ class TMWServer(object):
         try:
             bye = BYECommunicator()
             bye.takepicture(duration, iso)
-            bye = None
             return {'status': True}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
     @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
     def bye_lastpicture(self):
         """
         Route 'bye_lastpicture' - ermittelt das letzte aufgenommene Bild und sendet dieses.
+        Die Datei wird stückweise gestreamt, unterstützt Range-Anfragen zum Fortsetzen
+        von Downloads und wird bei passendem If-None-Match nicht erneut gesendet.
         :return: Bild-Daten
         """
         try:
-            cherrypy.response.headers['Content-Type'] = 'application/octet-stream'
-            cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="lastpicture.cr2"'
             bye = BYECommunicator()
             image = bye.getpicturepath()
-            print(image)
-            bye = None
-
-            f = open(image, 'rb')
-            data = BytesIO(f.read())
-            f.close()
-
-            return file_generator(data)
-
+            cherrypy.response.headers['ETag'] = file_etag(image)
         except Exception as e:
             cherrypy.response.headers['Content-Type'] = 'application/json'
-            return {'status': False, 'message': str(e)}
+            return json.dumps({'status': False, 'message': str(e)}).encode()
+
+        # Unverändertes Bild: 304 Not Modified
+        cptools.validate_etags()
+        return static.serve_file(image, 'application/octet-stream', 'attachment', 'lastpicture.cr2')
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -548,12 +850,133 @@ class TMWServer(object):
         :return: JSON-Daten des Status.
         """
         try:
-            bdsrun("bye_beenden")
+            process = bdsrun("bye_beenden", wait=False)
             # todo: Validieren
-            return {'status': True}
+            return {'status': True, 'process': process['id']}
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
+    # </editor-fold>
+
+    # <editor-fold desc="Aufnahmen Routen">
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def ingest_status(self):
+        """
+        Route '/ingest_status' - Anzahl der erfassten Aufnahmen je Archiv-Zustand und Länge der Warteschlange.
+        :return: JSON-Daten des Status.
+        """
+        if ingest is None:
+            return {'status': False, 'message': "Kein Ausgabeverzeichnis (IngestDir) konfiguriert"}
+        return {'status': True, 'ingest': ingest.metrics()}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def ingest_retry(self):
+        """
+        Route '/ingest_retry' - überträgt endgültig fehlgeschlagene Aufnahmen erneut.
+        :return: JSON-Daten mit der Anzahl erneut eingereihter Aufnahmen.
+        """
+        if ingest is None:
+            return {'status': False, 'message': "Kein Ausgabeverzeichnis (IngestDir) konfiguriert"}
+        return {'status': True, 'queued': ingest.retry_failed()}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out(handler=json_or_bytes)
+    def frames(self, frame_id=None, action=None, session=None, target=None, since=None, until=None, state=None,
+               after="0", limit="100", size=None, format="jpeg"):
+        """
+        Route '/frames' - Aufnahmen aus dem Bild-Katalog, seitenweise. Die nächste
+        Seite liefert 'after=<next>'. '/frames/<id>' liefert eine einzelne Aufnahme,
+        '/frames/<id>/preview' ein gestrecktes Vorschaubild und '/frames/<id>/stats'
+        Sternanzahl und HFR.
+        :param frame_id: ID der Aufnahme
+        :param action: 'preview' oder 'stats'
+        :param size: Maximale Kantenlänge der Vorschau in Pixeln, gerundet auf 64, 128, ... bis PreviewSize
+        :param format: Format der Vorschau, 'jpeg' (default) oder 'png'
+        :param session: Beobachtungsnacht 'YYYY-MM-DD'
+        :param target: Ziel
+        :param since: Aufnahmezeit ab (ISO)
+        :param until: Aufnahmezeit bis (ISO)
+        :param state: Archiv-Zustand, z.B. 'failed'
+        :param after: ID der letzten Aufnahme der vorherigen Seite
+        :param limit: Anzahl je Seite (höchstens 1000)
+        :return: JSON-Daten der Aufnahmen mit 'next' für die nächste Seite.
+        """
+        if action == "preview":
+            return self.frame_preview(frame_id, size, format)
+        try:
+            if action == "stats":
+                return {'status': True, 'stats': previews.stats(int(frame_id))}
+            if frame_id is not None:
+                frame = frame_catalog.get(int(frame_id))
+                if frame is None:
+                    return {'status': False, 'message': "Unbekannte Aufnahme"}
+                return {'status': True, 'frame': frame}
+            limit = max(1, min(int(limit), 1000))
+            result = frame_catalog.query(after=int(after), limit=limit,
+                                         **frame_filters(session, target, since, until, state))
+            return {'status': True, 'frames': result,
+                    'next': result[-1]['id'] if len(result) == limit else None}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
+    def frame_preview(self, frame_id, size=None, fmt="jpeg"):
+        """
+        Vorschaubild einer Aufnahme für '/frames/<id>/preview'. Unveränderte
+        Vorschauen werden per ETag mit 304 beantwortet, ohne sie zu berechnen.
+        :return: Bilddaten
+        """
+        try:
+            key, content_type, etag = previews.variant(int(frame_id), size, fmt)
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+        cherrypy.response.headers['ETag'] = etag
+        cherrypy.response.headers['Cache-Control'] = 'max-age=86400'
+        # Unverändertes Bild: 304 Not Modified
+        cptools.validate_etags()
+        try:
+            data, content_type, etag = previews.preview(int(frame_id), size, fmt)
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+        cherrypy.response.headers['Content-Type'] = content_type
+        return data
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def frame_sessions(self):
+        """
+        Route '/frame_sessions' - Beobachtungsnächte mit Anzahl der Aufnahmen und Zielen.
+        :return: JSON-Daten der Nächte.
+        """
+        return {'status': True, 'sessions': frame_catalog.sessions()}
+
+    @cherrypy.expose
+    @cherrypy.config(**{'response.stream': True})
+    def frames_download(self, ids="", session=None, target=None, since=None, until=None, state=None):
+        """
+        Route '/frames_download' - alle passenden Aufnahmen als tar-Archiv in einer Anfrage.
+        Das Archiv wird beim Senden erzeugt, nicht im Speicher oder auf der Platte.
+        :param ids: Kommagetrennte Liste von IDs
+        :param session: Beobachtungsnacht 'YYYY-MM-DD'
+        :param target: Ziel
+        :param since: Aufnahmezeit ab (ISO)
+        :param until: Aufnahmezeit bis (ISO)
+        :param state: Archiv-Zustand
+        :return: tar-Daten
+        """
+        try:
+            selected = frame_catalog.query(ids=[int(i) for i in ids.split(",") if i] or None, limit=None,
+                                           **frame_filters(session, target, since, until, state))
+        except Exception as e:
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            return json.dumps({'status': False, 'message': str(e)}).encode()
+        cherrypy.response.headers['Content-Type'] = 'application/x-tar'
+        cherrypy.response.headers['Content-Disposition'] = \
+            'attachment; filename="frames-%s.tar"' % (session or datetime.date.today().isoformat())
+        return tar_stream(selected)
+
     # </editor-fold>
 
     # <editor-fold desc="PHD Routen">
@@ -562,16 +985,12 @@ class TMWServer(object):
     @cherrypy.tools.json_out()
     def phd_start(self):
         """
-        Route '/phd_start' - startet PHD und testet die Verbindung.
-        :return:  JSON-Daten des Status.
+        Route '/phd_start' - startet PHD im Hintergrund und testet die Verbindung,
+        sobald PHD bereit ist. Ergebnis über '/jobs/<id>'.
+        :return:  JSON-Daten des Status mit ID der Aufgabe.
         """
         try:
-            bdsrun("phd_starten")
-            time.sleep(30)
-            phd = PHDCommunicator()
-            status = phd.getstatus()
-            phd = None
-            return {'status': True, 'message': status}
+            return {'status': True, 'job': bgtask.submit(background_phd_start, lane="guider")}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
@@ -585,11 +1004,50 @@ class TMWServer(object):
         try:
             phd = PHDCommunicator()
             status = phd.getstatus()
-            phd = None
             return {'status': True, 'message': status}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def phd_stats(self, history=None):
+        """
+        Route '/phd_stats' - Guiding-Statistik aus dem Event-Server von PHD2: RMS und
+        Spitzenwerte in RA/Dec (Pixel) über die letzten Guide-Schritte, verlorene Sterne
+        und letztes Settle-Ergebnis.
+        :param history: Optional die letzten N Guide-Schritte mit ausgeben.
+        :return: JSON-Daten der Statistik.
+        """
+        try:
+            return {'status': True, 'stats': phd2.stats(int(history) if history is not None else None)}
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def phd_dither(self, amount=None, ra_only=False, pixels=None, settle_time=None, timeout=None):
+        """
+        Route '/phd_dither' - dithert über PHD2 und wartet, bis sich das Guiding beruhigt
+        hat (Ereignis SettleDone), statt eine feste Zeit zu schlafen.
+        :param amount: Dither-Weite in Pixeln
+        :param ra_only: Nur in RA dithern
+        :param pixels: Maximale Abweichung in Pixeln für ein ruhiges Guiding
+        :param settle_time: Geforderte ruhige Zeit in Sekunden
+        :param timeout: Maximale Settle-Dauer in Sekunden
+        :return: JSON-Daten des Status mit gemessener Settle-Dauer.
+        """
+        try:
+            settle_time = float(settle_time or Config.getfloat("Settings", "SettleTime", fallback=10))
+            result = phd2.dither(float(amount or Config.getfloat("Settings", "DitherAmount", fallback=3)),
+                                 ra_only=str(ra_only) not in ("0", "False", "false"),
+                                 pixels=float(pixels or Config.getfloat("Settings", "SettlePixels", fallback=1.5)),
+                                 settle_time=settle_time,
+                                 timeout=float(timeout or Config.getfloat("Settings", "SettleTimeout", fallback=60)))
+            result['status'] = True
+            return result
+        except Exception as e:
+            return {'status': False, 'message': str(e)}
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def phd_guiding_start(self):
@@ -612,7 +1070,6 @@ class TMWServer(object):
                 return {'status': False,
                         'message': "Fehler: StartLoop klappt nicht. PHD: " + phd.getstatus()}
         except Exception as e:
-            phd = None
             return {'status': False, 'message': str(e)}
 
     @cherrypy.expose
@@ -625,10 +1082,8 @@ class TMWServer(object):
         try:
             phd = PHDCommunicator()
             if phd.stop():
-                phd = None
                 return {'status': True, 'message': phd.getstatus()}
             else:
-                phd = None
                 return {'status': False, 'message': phd.getstatus()}
         except Exception as e:
             return {'status': False, 'message': str(e)}
@@ -641,9 +1096,9 @@ class TMWServer(object):
         :return:
         """
         try:
-            bdsrun("phd_beenden")
+            process = bdsrun("phd_beenden", wait=False)
             # todo: Validieren
-            return {'status': True}
+            return {'status': True, 'process': process['id']}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
@@ -655,13 +1110,12 @@ class TMWServer(object):
     @cherrypy.tools.json_out()
     def at_start(self):
         """
-        Route '/at_start' - startet die Software Astrotortilla.
-        :return: JSON-Daten des Status.
+        Route '/at_start' - startet die Software Astrotortilla im Hintergrund und
+        wartet, bis der Prozess läuft. Ergebnis über '/jobs/<id>'.
+        :return: JSON-Daten des Status mit ID der Aufgabe.
         """
         try:
-            bdsrun("at_start")
-            # todo: Start validate
-            return {'status': True}
+            return {'status': True, 'job': bgtask.submit(background_at_start, lane="solver")}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
@@ -673,9 +1127,9 @@ class TMWServer(object):
         :return: JSON-Daten des Status.
         """
         try:
-            bdsrun("at_platesolve")
+            process = bdsrun("at_platesolve", wait=False)
             # todo: Funktion zur Auswertung von Plate Solve Ergebnissen?
-            return {'status': True}
+            return {'status': True, 'process': process['id']}
         except Exception as e:
             return {'status': False, 'message': str(e)}
 
@@ -683,88 +1137,370 @@ class TMWServer(object):
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
-    def test_astropy(self, objekt):
-        print("                        ")
-        print("Testing astropy...")
-        print("                        ")
-        now = datetime.datetime.now()
-        observatory_location = EarthLocation(lat=53.082806, lon=7.800694, height=5)
-        observing_time = Time(now)  # 1am UTC=6pm AZ mountain time
-        observer = AltAz(location=observatory_location, obstime=observing_time)
-
-        skyobject = SkyCoord.from_name(objekt)
-        print(skyobject)
-
-        print("                        ")
-
-        skyobject2 = skyobject.transform_to(observer)
-        print(skyobject2)
+    def resolve(self, objekt):
+        """
+        Route '/resolve' - ermittelt die Koordinaten eines Objektes (Offline-Katalog,
+        Cache oder Sesame) und legt sie für spätere GoTos im Cache ab.
+        :param objekt: Objektname
+        :return: JSON-Daten mit RA/Dec in Grad und Quelle.
+        """
+        try:
+            ra, dec, source = resolver.resolve(objekt)
+            return {'status': True, 'ra': ra, 'dec': dec, 'source': source}
+        except Exception as e:
+            return {'status': False, 'message': "Objekt nicht gefunden", 'detail': str(e)}
 
-        print("                        ")
+    @cherrypy.expose
+    @cherrypy.tools.json_in(force=False)
+    @cherrypy.tools.json_out()
+    def plan(self, targets="", start=None, end=None, step="10", horizon=None, curves="1"):
+        """
+        Route '/plan' - Sichtbarkeitsplanung für eine Zielliste: Höhen-/Azimutkurven,
+        Aufgang, Kulmination, Untergang und Zeit über dem Horizont.
+        Parameter per GET oder als JSON-Body (targets dann als Liste).
+        :param targets: Durch ';' getrennte Objektnamen oder 'RA,Dec' in Grad
+        :param start: Beginn (ISO, UTC), Standard ist die aktuelle Nacht.
+        :param end: Ende (ISO, UTC)
+        :param step: Zeitschritt in Minuten, mindestens 1, höchstens 2000 Zeitschritte je Plan.
+        :param horizon: Mindesthöhe in Grad, Standard aus der Konfiguration.
+        :param curves: 0, um nur die Zusammenfassung ohne Kurven zu erhalten.
+        :return: JSON-Daten des Plans.
+        """
+        try:
+            params = getattr(cherrypy.request, 'json', None) or {}
+            targets = params.get('targets', [t.strip() for t in targets.split(";") if t.strip()])
+            start = params.get('start', start)
+            end = params.get('end', end)
+            step = float(params.get('step', step))
+            if not math.isfinite(step) or step <= 0:
+                return {'status': False, 'message': "Ungültiger Zeitschritt: %s" % step}
+            horizon = float(params.get('horizon', horizon if horizon is not None
+                                       else Config.getfloat("Settings", "Horizon", fallback=20)))
+            curves = str(params.get('curves', curves)) not in ("0", "False", "false")
+            if start is not None and end is not None:
+                start = datetime.datetime.fromisoformat(start)
+                end = datetime.datetime.fromisoformat(end)
+            result = planner.plan(targets, start, end, step, horizon, curves)
+            result['status'] = True
+            return result
+        except Exception as e:
+            return {'status': False, 'message': "Fehler bei der Planung", 'detail': str(e)}
 
-        newAltAzcoordiantes = SkyCoord(alt=skyobject2.alt, az=skyobject2.az, obstime=observing_time, frame='altaz',
-                                       location=observatory_location)
-        print(str(newAltAzcoordiantes.icrs.ra.hour), str(newAltAzcoordiantes.icrs.dec.degree))
-        print("                        ")
-        return {'status': True}
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def test_astropy(self, objekt):
+        """
+        Route '/test_astropy' - berechnet Alt/Az und die JNow-Koordinaten für die Montierung.
+        :param objekt: Objektname
+        :return: JSON-Daten mit den Koordinaten.
+        """
+        skyobject = resolver.coord(objekt)
+        altaz = skyobject.transform_to(coordinates.altaz_frame())
+        ra, dec = coordinates.to_mount(skyobject)
+        return {'status': True, 'alt': altaz.alt.degree, 'az': altaz.az.degree, 'ra': ra, 'dec': dec}
 
     pass
 
 
 
 
-def background_eqmod_goto_name(objekt, host="", port="", cmd="", key=""):
+def background_eqmod_goto_name(objekt, host="", port="", cmd="", key="", abort=None):
     """
-    Ermittelt die Position des angegebenen Objektes und berechnet diese
-    auf AltAz-Koordinaten der aktuellen Sternwartenposition. Anschließend
-    wird die Rückantwort zum Server gegeben.
+    Ermittelt die Position des angegebenen Objektes und berechnet daraus
+    die scheinbaren Koordinaten für die Sternwartenposition. Nach Schwenkende
+    und Beruhigungszeit wird die Rückantwort zum Server gegeben.
     :param host: Hostname des Servers
     :param port: Port des Servers
     :param cmd: Rückrouten-Befehl
     :param key: Rückrouten-Schlüssel
     :param objekt: GoTo Objekt Name als NGC-Katalogeintrag.
-    :return:
+    :param abort: Optional threading.Event des Sequencers, beendet das Warten auf das Schwenkende.
+    :return: Dict mit Zielkoordinaten und Zeiten (Schwenk, Beruhigung, gesamt).
     """
     try:
-        print("GoTo: " + objekt)
+        cherrypy.log("GoTo: %s" % objekt)
 
-        now = datetime.datetime.now()
-        observatory_location = EarthLocation(lat=53.082806, lon=7.800694, height=5)
-        observing_time = Time(now)  # 1am UTC=6pm AZ mountain time
-        observer = AltAz(location=observatory_location, obstime=observing_time)
+        # Scheinbare Koordinaten des Tages (JNow), wie sie EQMOD erwartet
+        ra, dec = coordinates.to_mount(resolver.coord(objekt))
 
-        skyobject = SkyCoord.from_name(objekt)
-        skyobject2 = skyobject.transform_to(observer)
-        newAltAzcoordiantes = SkyCoord(alt=skyobject2.alt, az=skyobject2.az, obstime=observing_time, frame='altaz',
-                                       location=observatory_location)
+        mount.call('unpark')
+        mount.call('slew_to_coordinates', ra, dec)
+        issued = time.time()
 
-        pythoncom.CoInitialize()
-        o = win32com.client.Dispatch("EQMOD.Telescope")
-        o.Unpark()
-        o.SlewToCoordinates(str(newAltAzcoordiantes.icrs.ra.hour), str(newAltAzcoordiantes.icrs.dec.degree))
+        # Erst nach Schwenkende und Beruhigungszeit Erfolg melden
+        timings = telemetry.wait_for_slew(issued,
+                                          settle=Config.getfloat("Settings", "SlewSettle", fallback=5),
+                                          timeout=Config.getfloat("Settings", "SlewTimeout", fallback=300),
+                                          abort=abort)
+        cherrypy.log("GoTo beendet: %s, Schwenk %.1f s, gesamt %.1f s" % (objekt, timings['slew'], timings['total']))
 
         if host != "":
             responseserver(host, port, cmd, key, True)
 
-        return True
+        return {'ra': ra, 'dec': dec, 'timings': timings}
 
-    except Exception as e:
+    except Exception:
 
         if host != "":
             responseserver(host, port, cmd, key, False)
 
-        return False
+        # Fehler wird im Ergebnis der Aufgabe festgehalten ('/jobs/<id>')
+        raise
+
+
+def background_bye_start():
+    """
+    Startet BackyardEOS und wartet, bis BYE Verbindungen annimmt und einen Status liefert.
+    :return: Dict mit Status und Startdauer in Sekunden.
+    """
+    started = time.time()
+    bdsrun("bye_start")
+    timeout = Config.getfloat("Settings", "StartTimeout", fallback=120)
+    wait_for_port(bye_connection.host, bye_connection.port, timeout)
+    bye_connection.reset_backoff()
+    status = {}
+
+    def ready():
+        status['message'] = BYECommunicator().getstatus()
+        return status['message'] != "error"
+
+    wait_until(ready, max(1, started + timeout - time.time()))
+    return {'message': status['message'], 'startup': time.time() - started}
+
+
+def background_phd_start():
+    """
+    Startet PHD und wartet, bis PHD Verbindungen annimmt und einen Status liefert.
+    :return: Dict mit Status und Startdauer in Sekunden.
+    """
+    started = time.time()
+    bdsrun("phd_starten")
+    timeout = Config.getfloat("Settings", "StartTimeout", fallback=120)
+    wait_for_port(phd_connection.host, phd_connection.port, timeout)
+    phd_connection.reset_backoff()
+    return {'message': PHDCommunicator().getstatus(), 'startup': time.time() - started}
+
+
+def background_at_start():
+    """
+    Startet AstroTortilla und wartet, bis der Prozess läuft.
+    :return: Dict mit Startdauer in Sekunden.
+    """
+    started = time.time()
+    bdsrun("at_start")
+    image = os.path.basename(Config.get("Settings", "PathToAstrotortilla",
+                                        fallback="AstroTortilla.exe").strip('"').replace("\\", "/"))
+    wait_for_process(image, Config.getfloat("Settings", "StartTimeout", fallback=120))
+    return {'startup': time.time() - started}
+
+
+def sequence_slew(target, abort):
+    """
+    Sequenz-Schritt: GoTo zum Ziel, wartet auf Schwenkende und Beruhigung.
+    Läuft wie '/eqmod_goto_name' in der Spur 'mount', damit kein anderes GoTo
+    die Montierung währenddessen umlenkt.
+    :param target: Objektname
+    :param abort: threading.Event des Sequencers
+    :return: Dict mit Zielkoordinaten und Zeiten.
+    """
+    job = bgtask.wait(bgtask.submit(background_eqmod_goto_name, (target,), {'abort': abort}, lane="mount"),
+                      abort=abort)
+    if job['state'] == 'done':
+        return job['result']
+    if abort.is_set():
+        raise SequenceAborted()
+    raise RuntimeError(job['error'])
+
+
+def sequence_platesolve(abort):
+    """
+    Sequenz-Schritt: Plate-Solve mit AstroTortilla, wartet auf das Ende des Scriptes.
+    :param abort: threading.Event des Sequencers
+    :return: ID des Prozesses
+    """
+    return bdsrun("at_platesolve")['id']
+
+
+def sequence_guide(settle_pixels, settle_time, settle_timeout, abort):
+    """
+    Sequenz-Schritt: Loop, Leitstern wählen, Guiding starten und auf Beruhigung warten.
+    :param abort: threading.Event des Sequencers
+    :return: Dict mit Abweichung und Wartezeit.
+    """
+    phd = PHDCommunicator()
+    if not phd.startloop():
+        raise RuntimeError("Fehler: StartLoop klappt nicht. PHD: " + phd.getstatus())
+    if not phd.autoselectstar():
+        raise RuntimeError("Keinen Stern gefunden. PHD: " + phd.getstatus())
+    if not phd.startguide():
+        raise RuntimeError("Guiding startet nicht. PHD: " + phd.getstatus())
+    return phd.settle(settle_pixels, settle_time, settle_timeout, abort)
+
+
+def sequence_dither(amount, settle_pixels, settle_time, settle_timeout, abort):
+    """
+    Sequenz-Schritt: Dithern über PHD und auf Beruhigung warten. Mit Verbindung
+    zum Event-Server von PHD2 wird auf SettleDone gewartet, sonst die Abweichung
+    über die alte Schnittstelle abgefragt.
+    :param amount: Dither-Weite in Pixeln
+    :param abort: threading.Event des Sequencers
+    :return: Dict mit Wartezeit.
+    """
+    if phd2.connected:
+        return phd2.dither(amount, pixels=settle_pixels, settle_time=settle_time, timeout=settle_timeout,
+                           abort=abort)
+    phd = PHDCommunicator()
+    # Die alte Schnittstelle kennt nur die Stufen 1 bis 5
+    phd.dither(max(1, min(5, int(round(amount)))))
+    # PHD braucht einen Guide-Zyklus, bis der Versatz in der Abweichung sichtbar ist
+    sleep(abort, 1)
+    return phd.settle(settle_pixels, settle_time, settle_timeout, abort)
+
+
+def sequence_expose(duration, iso, target, sequence, abort):
+    """
+    Sequenz-Schritt: eine Belichtung mit BYE. Fertig ist sie, sobald BYE einen
+    neuen Bildpfad meldet, also das Bild heruntergeladen ist. Ziel und Sequenz
+    werden für den Bild-Katalog vermerkt.
+    :param duration: Belichtungszeit in Sekunden
+    :param iso: ISO-Wert
+    :param target: Ziel der Sequenz
+    :param sequence: ID der Sequenz
+    :param abort: threading.Event des Sequencers
+    :return: Dict mit Bildpfad und Download-Zeit in Sekunden.
+    """
+    bye = BYECommunicator()
+    previous = bye.getpicturepath()
+    started = time.time()
+    bye.takepicture("%g" % duration, str(iso))
+    sleep(abort, duration)
+    deadline = started + duration + Config.getfloat("Settings", "DownloadTimeout", fallback=120)
+    while True:
+        path = bye.getpicturepath()
+        if path and path != previous and path != "error":
+            if ingest is not None:
+                ingest.annotate(path, exposure=duration, iso=int(iso), target=target, sequence=sequence)
+            return {'path': path, 'download': time.time() - started - duration}
+        if time.time() > deadline:
+            raise TimeoutError("Kein neues Bild von BYE nach %d s" % (time.time() - started))
+        sleep(abort, 0.25)
+
+
+def sequence_guide_stop(abort):
+    """
+    Sequenz-Schritt: Guiding beenden.
+    """
+    PHDCommunicator().stop()
+
+
+def sequence_abort():
+    """
+    Hält Schwenk und Guiding beim Abbruch einer Sequenz sofort an. Eine laufende
+    Belichtung in BYE wird nicht abgebrochen.
+    """
+    # Wartende Schritte sofort wecken, sie prüfen dann das Abbruch-Ereignis
+    telemetry.wake()
+    phd2.wake()
+    mount.submit('abort_slew')
+    PHDCommunicator().stop()
+
+
+def phd_status():
+    """
+    Status von PHD für den StatusPoller.
+    :return: Statuscode
+    """
+    return PHDCommunicator().getstatus(True)
+
+
+def bye_status():
+    """
+    Status von BYE für den StatusPoller.
+    :return: Status
+    """
+    return BYECommunicator().getstatus()
 
 
-def bdsrun(name):
+def eqmod_status():
     """
-    Führt ein BDS-Script aus.
+    Status von EQMOD für den StatusPoller, aus dem Telemetrie-Cache.
+    :return: Dict mit Position, Slew- und Park-Status.
+    """
+    state = telemetry.state()
+    if state is None:
+        return {'error': telemetry.error}
+    return {'ra': state['ra'], 'dec': state['dec'], 'slewing': state['slewing'], 'atpark': state['atpark']}
+
+
+def bdsrun(name, wait=True):
+    """
+    Führt ein BDS-Script über den ProcessManager aus. Scripte, die die Oberfläche
+    bedienen, belegen gemeinsam die Ressource 'desktop' und laufen nacheinander.
+    Nur die unter 'BDSParallelScripts' eingetragenen Scripte, die lediglich ein
+    Programm starten, laufen parallel dazu (z.B. beim Start über '/rig_start').
     :param name:  Name des Scriptes.
-    :return:
+    :param wait: True wartet auf das Ende des Scriptes.
+    :return: Eintrag des Prozesses (Dict), bei wait=True mit Exit-Code und Ausgabe.
+    :raises RuntimeError: wenn das Script bei wait=True fehlschlägt oder abgebrochen wird.
+    """
+    command = [part.strip('"') for part in shlex.split(scripts.command, posix=False)]
+    script = os.path.join(current_dir, "baramundi", name + ".bds")
+    parallel = Config.get("Settings", "BDSParallelScripts", fallback="bye_start, phd_starten, at_start")
+    resource = None if name in [n.strip() for n in parallel.split(",")] else "desktop"
+    process = process_manager.run(command + ["/Script:" + script, "/S"], name=name, resource=resource,
+                                  timeout=Config.getfloat("Settings", "BDSTimeout", fallback=120), wait=wait)
+    if wait and process['state'] != 'done':
+        raise RuntimeError("BDS-Script %s: %s" % (name, process['error'] or "Exit-Code %s" % process['returncode']))
+    return process
+
+
+def warm_up():
+    """
+    Lädt astropy, Koordinaten-Umrechnung, Objektnamen-Auflösung und Planung
+    vorab, damit der erste GoTo nicht darauf warten muss.
+    :return: Dauer in Sekunden
+    """
+    started = time.time()
+    coordinates.warm()
+    resolver.warm()
+    planner.warm()
+    return time.time() - started
+
+
+def queue_preview(frame_id):
     """
-    bdsrun = current_dir + "\\BDSRun.exe /Script:"
-    bdsrun_folder = "\\baramundi\\"
-    os.popen(bdsrun + current_dir + bdsrun_folder + name + ".bds /S")
+    Berechnet Vorschau und Statistik einer neuen Aufnahme im Hintergrund,
+    damit der erste Aufruf von '/frames/<id>/preview' sofort antwortet.
+    :param frame_id: ID der Aufnahme
+    """
+    try:
+        bgtask.submit(previews.generate, (frame_id,), lane="preview", priority=PRIORITY_LOW)
+    except queue.Full:
+        # Dann eben beim ersten Aufruf
+        pass
+
+
+def frame_filters(session=None, target=None, since=None, until=None, state=None):
+    """
+    Wandelt die Filter-Parameter der Aufnahmen-Routen für FrameCatalog.query um.
+    :param since: Aufnahmezeit ab (ISO)
+    :param until: Aufnahmezeit bis (ISO)
+    :return: Dict der Filter
+    """
+    return {'session': session, 'target': target, 'state': state,
+            'since': datetime.datetime.fromisoformat(since).timestamp() if since else None,
+            'until': datetime.datetime.fromisoformat(until).timestamp() if until else None}
+
+
+def file_etag(path):
+    """
+    Bildet ein ETag aus Pfad, Größe und Änderungszeit einer Datei, ohne sie zu lesen.
+    :param path: Pfad der Datei
+    :return: ETag in Anführungszeichen
+    """
+    st = os.stat(path)
+    key = "%s|%d|%d" % (path, st.st_size, st.st_mtime_ns)
+    return '"' + hashlib.md5(key.encode()).hexdigest() + '"'
 
 
 def responseserver(host, port, cmd, key, status=True):
@@ -775,15 +1511,11 @@ def responseserver(host, port, cmd, key, status=True):
     :param cmd: Return-Befehl, üblicherweise 'return'
     :param key: Einmalig erstellter Schlüssel für diese eine Abfrage.
     :param status: Erfolg- oder Misserfolgsmeldung
-    :return:
+    :return: ID der Rückantwort
     """
     print("Inform Sender: ", host, port, cmd, key, status)
-    conn = http.client.HTTPConnection(host, port)
-    conn.request("GET", "/" + cmd + "/" + key + "/" + str(status))
-    r1 = conn.getresponse()
-    conn.close()
-    print(r1.status, r1.reason)
-    pass
+    # Zustellung mit Wiederholungen im Hintergrund, siehe '/callbacks'
+    return callbacks.send(host, port, cmd, key, status)
 
 
 def validate_password(realm, username, password):
@@ -801,17 +1533,161 @@ if __name__ == '__main__':
 
     current_dir = os.path.dirname(os.path.abspath(__file__))
 
-    # BackgroundTaskQueue initialisieren
-    bgtask = BackgroundTaskQueue(cherrypy.engine)
-    bgtask.subscribe()
+    # Kommandozeile
+    parser = argparse.ArgumentParser(description="TMW Telescope Server")
+    parser.add_argument("--config", default="./config.cfg", help="Konfigurationsdatei")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Alle Geräte durch Python-Simulatoren ersetzen, läuft auch ohne Windows")
+    arguments = parser.parse_args()
 
     # Config lesen
     Config = configparser.ConfigParser()
-    Config.read("./config.cfg")
+    Config.read(arguments.config)
     server_challenge = Config.get("Settings", "ServerChallenge")
 
+    if arguments.simulate:
+        # Treiber nur für diesen Lauf umstellen, die Datei bleibt unverändert
+        for key in ("MountDriver", "CameraDriver", "GuiderDriver", "SolverDriver"):
+            Config.set("Settings", key, "simulator")
+        Config.set("Settings", "ScreenshotDriver", "stub")
+        Config.set("Settings", "IERSAutoDownload", "False")
+
+    # Kamera, Guider und PHD2-Ereignisse: echte Programme oder Simulatoren auf denselben Ports
+    guider_driver = Config.get("Settings", "GuiderDriver", fallback="phd")
+    endpoints = DeviceEndpoints(cherrypy.engine, {
+        'camera': (Config.get("Settings", "CameraDriver", fallback="bye"), 'localhost', 1499, {'picture_dir': "."}),
+        'guider': (guider_driver, socket.gethostname(), 4300, {}),
+        'guider_events': (guider_driver, socket.gethostname(),
+                          Config.getint("Settings", "PHD2EventPort", fallback=4400), {})})
+    endpoints.subscribe()
+
+    # BDS-Scripte für den Solver und zum Starten der Programme
+    scripts = driver('solver', Config.get("Settings", "SolverDriver", fallback="astrotortilla"),
+                     Config.get("Settings", "BDSCommand", fallback=current_dir + "\\BDSRun.exe"))
+
+    # Objektnamen-Auflösung mit Offline-Katalog und persistentem Cache. Wie die
+    # Koordinaten-Umrechnung benötigt sie astropy, beides wird daher erst beim
+    # ersten Zugriff bzw. nach dem Start im Hintergrund geladen (warm_up).
+    resolver = Lazy(lambda: load("NameResolver:NameResolver")(
+        Config.get("Settings", "NameCacheFile", fallback="name_cache.json"),
+        Config.get("Settings", "CatalogFile", fallback=None),
+        ttl=Config.getfloat("Settings", "NameCacheTTL", fallback=30 * 86400)))
+
+    # Beobachtungsort und Koordinaten-Umrechnung
+    coordinates = Lazy(lambda: load("CoordinateService:CoordinateService")(
+        Config.getfloat("Settings", "Latitude", fallback=53.082806),
+        Config.getfloat("Settings", "Longitude", fallback=7.800694),
+        Config.getfloat("Settings", "Height", fallback=5),
+        iers_auto_download=Config.getboolean("Settings", "IERSAutoDownload", fallback=True)))
+    planner = Lazy(lambda: load("Planner:Planner")(coordinates.warm(), resolver.warm()))
+
+    # Montierung: ein Thread besitzt den Treiber, alle Routen schicken ihm Befehle
+    mount_driver_name = Config.get("Settings", "MountDriver", fallback="ascom")
+    if mount_driver_name == "simulator":
+        mount_driver = driver('mount', mount_driver_name,
+                              Config.getfloat("Settings", "Latitude", fallback=53.082806),
+                              Config.getfloat("Settings", "Longitude", fallback=7.800694))
+    else:
+        mount_driver = driver('mount', mount_driver_name,
+                              Config.get("Settings", "MountProgID", fallback="EQMOD.Telescope"))
+    mount = MountService(cherrypy.engine, mount_driver,
+                         timeout=Config.getfloat("Settings", "MountTimeout", fallback=30),
+                         long_timeout=Config.getfloat("Settings", "SlewTimeout", fallback=300))
+    mount.subscribe()
+    telemetry = MountTelemetry(cherrypy.engine, mount,
+                               interval=Config.getfloat("Settings", "TelemetryInterval", fallback=1),
+                               history=Config.getint("Settings", "TelemetryHistory", fallback=3600),
+                               slew_interval=Config.getfloat("Settings", "TelemetrySlewInterval", fallback=0.25))
+    telemetry.subscribe()
+
+    # BackgroundTaskQueue initialisieren
+    bgtask = BackgroundTaskQueue(cherrypy.engine, workers=Config.getint("Settings", "BackgroundWorkers", fallback=4))
+    bgtask.subscribe()
+    cherrypy.engine.subscribe('start', lambda: bgtask.submit(warm_up, lane="warmup", priority=PRIORITY_LOW),
+                              priority=80)
+
+    # Rückantworten an den Server, überstehen Ausfälle des Servers und Neustarts
+    callbacks = CallbackDispatcher(cherrypy.engine,
+                                   CallbackOutbox(Config.get("Settings", "CallbackDatabase", fallback="callbacks.db")),
+                                   timeout=Config.getfloat("Settings", "CallbackTimeout", fallback=10),
+                                   retries=Config.getint("Settings", "CallbackRetries", fallback=10),
+                                   batch_path=Config.get("Settings", "CallbackBatchPath", fallback="") or None)
+    callbacks.subscribe()
+
+    # Momentanwerte für '/metrics', werden erst beim Abfragen ermittelt
+    registry.gauge("tmw_task_queue_depth", "Wartende Hintergrund-Aufgaben je Spur",
+                   lambda: bgtask.metrics()['depth_by_lane'], ('lane',))
+    registry.gauge("tmw_task_active", "Laufende Hintergrund-Aufgaben", lambda: bgtask.metrics()['active'])
+    registry.gauge("tmw_callbacks", "Rückantworten je Zustand", lambda: callbacks.outbox.counts(), ('state',))
+
+    # Dauerhafte PHD-Verbindung, wird von allen Routen gemeinsam genutzt
+    phd_connection = DeviceConnection(cherrypy.engine, socket.gethostname(), 4300,
+                                      keepalive_func=lambda channel: PHDCommunicator._exchange(channel, 17))
+    phd_connection.subscribe()
+
+    # Ereignisse von PHD2 (Guide-Schritte, Settle, Sternverlust)
+    phd2 = PHD2Client(cherrypy.engine, socket.gethostname(), Config.getint("Settings", "PHD2EventPort", fallback=4400),
+                      size=Config.getint("Settings", "GuideStatsSize", fallback=1000))
+    phd2.subscribe()
+
+    # Dauerhafte BYE-Verbindung mit Befehlswarteschlange
+    BYECommunicator.terminator = Config.get("Settings", "BYETerminator", fallback="").encode().decode(
+        "unicode_escape").encode()
+    bye_connection = QueuedDeviceConnection(cherrypy.engine, 'localhost', 1499,
+                                            keepalive_func=lambda channel: BYECommunicator._exchange(channel, "getstatus"))
+    bye_connection.subscribe()
+
+    # Externe Programme mit begrenzter Parallelität und Timeout
+    process_manager = ProcessManager(Config.getint("Settings", "ProcessSlots", fallback=4))
+
+    # Gemeinsame Bildschirmfoto-Aufnahme für die Route '/screenshot'
+    if Config.get("Settings", "ScreenshotDriver", fallback="exe") == "stub":
+        screenshot_backend = driver('screenshot', 'stub')
+    else:
+        screenshot_backend = driver('screenshot', 'exe', current_dir + "\\screenshot\\Screenshot.exe",
+                                    processes=process_manager)
+    screenshots = ScreenshotService(cherrypy.engine, screenshot_backend,
+                                    interval=Config.getfloat("Settings", "ScreenshotInterval", fallback=5),
+                                    idle=Config.getfloat("Settings", "ScreenshotIdle", fallback=60))
+    screenshots.subscribe()
+
+    # Bild-Katalog, neue Aufnahmen aus dem BYE-Ausgabeverzeichnis werden erfasst und archiviert
+    frame_catalog = FrameCatalog(Config.get("Settings", "FrameDatabase", fallback="frames.db"))
+    ingest = None
+    if Config.get("Settings", "IngestDir", fallback=""):
+        ingest = FrameIngest(cherrypy.engine, frame_catalog, Config.get("Settings", "IngestDir"),
+                             interval=Config.getfloat("Settings", "IngestInterval", fallback=2),
+                             archive_url=Config.get("Settings", "ArchiveURL", fallback="") or None,
+                             workers=Config.getint("Settings", "ArchiveWorkers", fallback=2),
+                             retries=Config.getint("Settings", "ArchiveRetries", fallback=5))
+        ingest.subscribe()
+
+    # Vorschaubilder, für neue Aufnahmen im Voraus berechnet
+    previews = PreviewService(frame_catalog,
+                              PreviewCache(Config.get("Settings", "PreviewCache", fallback="previews"),
+                                           Config.getint("Settings", "PreviewCacheMB", fallback=500) * 1024 * 1024),
+                              size=Config.getint("Settings", "PreviewSize", fallback=1024))
+    if Config.getboolean("Settings", "EagerPreviews", fallback=True):
+        cherrypy.engine.subscribe('frame_added', queue_preview)
+
+    # Aufnahme-Sequenzen, laufen vollständig auf diesem Rechner
+    sequencer = Sequencer(cherrypy.engine, {'slew': sequence_slew, 'platesolve': sequence_platesolve,
+                                            'guide': sequence_guide, 'dither': sequence_dither,
+                                            'expose': sequence_expose, 'guide_stop': sequence_guide_stop,
+                                            'abort': sequence_abort})
+    sequencer.subscribe()
+
+    # Zentrale Statusabfrage für '/events' und '/status_changes'
+    status_poller = StatusPoller(cherrypy.engine,
+                                 {'phd': phd_status, 'bye': bye_status, 'eqmod': eqmod_status},
+                                 interval=Config.getfloat("Settings", "StatusInterval", fallback=2))
+    status_poller.subscribe()
+    subscribers = SubscriberLimit(Config.getint("Settings", "EventSubscribers", fallback=200))
+    registry.gauge("tmw_subscribers", "Offene Event-Streams und Long-Polls", lambda: subscribers.active)
+
     # WebServer cherrypy konfigurieren und starten
-    cherrypy.config.update({'tools.auth_basic.checkpassword': validate_password,
+    cherrypy.config.update({'tools.metrics.on': True,
+                            'tools.auth_basic.checkpassword': validate_password,
                             'tools.auth_basic.on': True,
                             'tools.auth_basic.realm': "localhost"})
 
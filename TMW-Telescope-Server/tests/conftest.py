@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+# Die Module des Servers liegen ohne Paket direkt im Server-Verzeichnis
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
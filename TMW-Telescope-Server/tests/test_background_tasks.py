@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import cherrypy
+import pytest
+
+from BackgroundTaskQueue import BackgroundTaskQueue
+
+
+@pytest.fixture
+def bgtask():
+    queue = BackgroundTaskQueue(cherrypy.engine, workers=4, qwait=0.05)
+    queue.start()
+    yield queue
+    queue.stop()
+
+
+def test_wait_serializes_with_lane(bgtask):
+    running = []
+    overlaps = []
+
+    def goto(name):
+        running.append(name)
+        overlaps.append(len(running))
+        time.sleep(0.1)
+        running.remove(name)
+        return name
+
+    route = bgtask.submit(goto, ("route",), lane="mount")
+    job = bgtask.wait(bgtask.submit(goto, ("sequence",), lane="mount"))
+    assert job['state'] == 'done' and job['result'] == "sequence"
+    assert bgtask.job(route)['state'] == 'done'
+    # Nie zwei GoTos gleichzeitig
+    assert overlaps == [1, 1]
+
+
+def test_abort_drops_queued_job(bgtask):
+    release = threading.Event()
+    ran = []
+    bgtask.submit(release.wait, (5,), lane="mount")
+    abort = threading.Event()
+    job_id = bgtask.submit(ran.append, ("sequence",), lane="mount")
+    threading.Timer(0.1, abort.set).start()
+    started = time.time()
+    assert bgtask.wait(job_id, abort=abort)['state'] == 'cancelled'
+    assert time.time() - started < 1
+    release.set()
+    time.sleep(0.2)
+    assert ran == []
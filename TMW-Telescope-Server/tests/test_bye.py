@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+
+import cherrypy
+import pytest
+
+from DeviceConnection import QueuedDeviceConnection
+from DeviceSimulators import FakeBYEServer
+from TMWServer import BYECommunicator
+
+
+class ConnectPerCall(object):
+    """
+    Vergleichsbasis: der frühere BYECommunicator mit einem Socket je Aufruf.
+    """
+
+    def __init__(self, port):
+        self.s = socket.socket()
+        self.s.connect(('localhost', port))
+
+    def __del__(self):
+        self.s.close()
+
+    def getstatus(self):
+        self.s.send(b"getstatus")
+        return self.s.recv(16).decode()
+
+
+@pytest.fixture
+def bye(tmp_path):
+    server = FakeBYEServer(port=0, picture_dir=str(tmp_path))
+    port = server.start()
+    yield server, port
+    server.stop()
+
+
+@pytest.fixture
+def communicator(bye):
+    server, port = bye
+    connection = QueuedDeviceConnection(cherrypy.engine, 'localhost', port, timeout=2)
+    connection.start()
+    yield BYECommunicator(connection)
+    connection.stop()
+
+
+def rate(func, threads=4, count=50):
+    """
+    :return: Anfragen je Sekunde, alle Threads gleichzeitig.
+    """
+    def work():
+        for _ in range(count):
+            assert func() == "idle"
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * count / (time.perf_counter() - started)
+
+
+def test_takepicture_reply_does_not_reach_next_command(bye, communicator):
+    server, port = bye
+    server.terminator = "\n"
+    # Die Simulation quittiert 'takepicture' hier, die Antwort wird nie gelesen
+    server.command = lambda cmd, command=server.command: command(cmd) or "OK"
+    communicator.takepicture("0", "800")
+    time.sleep(0.1)
+    assert communicator.getpicturepath().endswith("IMG_0001.CR2")
+
+
+def test_idle_framing_by_default(bye, communicator):
+    server, port = bye
+    assert BYECommunicator.terminator == b""
+    started = time.perf_counter()
+    assert communicator.getstatus() == "idle"
+    # Ohne Endezeichen wartet jede Antwort die Ruhezeit ab
+    assert BYECommunicator.reply_idle <= time.perf_counter() - started < 1
+    assert server.commands == 1
+
+
+def test_benchmark_against_connect_per_call(bye, communicator, monkeypatch):
+    server, port = bye
+    baseline = rate(lambda: ConnectPerCall(port).getstatus())
+    idle = rate(communicator.getstatus, count=5)
+    server.terminator = "\n"
+    monkeypatch.setattr(BYECommunicator, 'terminator', b"\n")
+    framed = rate(communicator.getstatus)
+    print("BYE getstatus je Sekunde: Socket je Aufruf %.0f, Ruhezeit %.0f, Endezeichen %.0f"
+          % (baseline, idle, framed))
+    # Mit Endezeichen ist die dauerhafte Verbindung schneller als ein Socket je Aufruf;
+    # ohne begrenzt die Ruhezeit die Befehle der einen Verbindung auf 1 / reply_idle je Sekunde.
+    assert framed > baseline
+    assert idle <= 1.1 / BYECommunicator.reply_idle
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import time
+
+import cherrypy
+import pytest
+
+from CallbackDispatcher import CallbackDispatcher, CallbackOutbox, callback_port
+from DeviceSimulators import FakeCallbackServer
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("Bedingung nicht erfüllt")
+        time.sleep(0.02)
+
+
+def pending(dispatcher):
+    return dispatcher.outbox.counts().get('pending', 0)
+
+
+def test_callback_port():
+    assert callback_port("8080") == 8080
+    for port in ("", "abc", "0", "70000", None):
+        with pytest.raises(ValueError):
+            callback_port(port)
+
+
+def test_invalid_port_is_rejected():
+    dispatcher = CallbackDispatcher(cherrypy.engine, CallbackOutbox(':memory:'))
+    with pytest.raises(ValueError):
+        dispatcher.send("localhost", "abc", "return", "k", True)
+    assert dispatcher.outbox.counts() == {}
+
+
+def test_flaky_sink_gets_every_callback_once():
+    server = FakeCallbackServer(drop_rate=0.2, error_rate=0.2, seed=1)
+    port = server.start()
+    dispatcher = CallbackDispatcher(cherrypy.engine, CallbackOutbox(':memory:'), timeout=2, max_delay=0.2)
+    dispatcher.start()
+    try:
+        for i in range(30):
+            dispatcher.send("localhost", port, "return", "k%d" % i, i % 2 == 0)
+        wait_for(lambda: pending(dispatcher) == 0)
+        assert dispatcher.outbox.counts() == {'done': 30}
+        assert sorted(server.received) == sorted(("return", "k%d" % i, i % 2 == 0) for i in range(30))
+        # Keep-Alive: deutlich weniger Verbindungen als Anfragen
+        assert len(server.connections) < server.requests
+    finally:
+        dispatcher.stop()
+        server.stop()
+
+
+def test_outbox_survives_restart_and_batches(tmp_path):
+    path = str(tmp_path / "callbacks.db")
+    server = FakeCallbackServer()
+    port = server.start()
+    server.stop()
+    dispatcher = CallbackDispatcher(cherrypy.engine, CallbackOutbox(path), timeout=1, batch_path="/batch")
+    dispatcher.start()
+    for i in range(20):
+        dispatcher.send("localhost", port, "return", "b%d" % i, True)
+    wait_for(lambda: dispatcher.outbox.get(1)['attempts'] > 0)
+    dispatcher.stop()
+
+    server = FakeCallbackServer(port=port)
+    server.start()
+    dispatcher = CallbackDispatcher(cherrypy.engine, CallbackOutbox(path), timeout=1, batch_path="/batch")
+    dispatcher.start()
+    try:
+        wait_for(lambda: pending(dispatcher) == 0)
+        assert len(set(server.received)) == len(server.received) == 20
+        assert server.batches >= 1
+        assert server.requests < 20
+    finally:
+        dispatcher.stop()
+        server.stop()
+
+
+def test_batch_falls_back_to_single_requests():
+    server = FakeCallbackServer(batch=False)
+    port = server.start()
+    dispatcher = CallbackDispatcher(cherrypy.engine, CallbackOutbox(':memory:'), batch_path="/batch")
+    dispatcher.start()
+    try:
+        for i in range(10):
+            dispatcher.outbox.add("localhost", port, "return", "n%d" % i, True)
+        dispatcher.retry_failed()
+        wait_for(lambda: pending(dispatcher) == 0)
+        assert len(server.received) == 10
+        assert server.batches == 0
+    finally:
+        dispatcher.stop()
+        server.stop()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+import random
+import socket
+import threading
+import time
+
+import cherrypy
+import pytest
+
+from DeviceConnection import BufferedChannel, DeviceConnection, QueuedDeviceConnection
+
+
+def send_chunked(s, data, rng, max_chunk=64, pause=0.0):
+    """
+    Sendet data in zufällig geschnittenen Stücken: Rahmen werden geteilt und zusammengeklebt.
+    """
+    i = 0
+    while i < len(data):
+        n = rng.randint(1, max_chunk)
+        s.sendall(data[i:i + n])
+        i += n
+        if pause and rng.random() < 0.1:
+            time.sleep(pause)
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    yield BufferedChannel(a, timeout=2, bufsize=256), b
+    a.close()
+    b.close()
+
+
+def test_read_until_fuzz(pair):
+    channel, peer = pair
+    rng = random.Random(3)
+    frames = [bytes(rng.choice(b"abc\r 0123") for _ in range(rng.randint(0, 300))) for _ in range(2000)]
+    data = b"".join(f + b"\r\n" for f in frames)
+    sender = threading.Thread(target=send_chunked, args=(peer, data, rng, 700, 0.001))
+    sender.start()
+    assert [channel.read_until(b"\r\n") for _ in frames] == frames
+    sender.join()
+    assert channel.data == bytearray()
+
+
+def test_read_exact_fuzz(pair):
+    channel, peer = pair
+    rng = random.Random(5)
+    sizes = [rng.randint(1, 1000) for _ in range(2000)]
+    data = bytes(rng.getrandbits(8) for _ in range(sum(sizes)))
+    sender = threading.Thread(target=send_chunked, args=(peer, data, rng, 1500, 0.001))
+    sender.start()
+    frames = [channel.read_exact(n) for n in sizes]
+    sender.join()
+    assert b"".join(frames) == data
+    assert [len(f) for f in frames] == sizes
+
+
+def test_merged_replies_stay_buffered(pair):
+    channel, peer = pair
+    peer.sendall(b"one\ntwo\nthr")
+    assert channel.read_until(b"\n") == b"one"
+    peer.sendall(b"ee\n")
+    assert channel.read_until(b"\n") == b"two"
+    assert channel.read_until(b"\n") == b"three"
+
+
+def test_idle_gap_ends_unterminated_reply(pair):
+    channel, peer = pair
+    peer.sendall(b"idle")
+    started = time.monotonic()
+    assert channel.read_until(b"\n", idle=0.05) == b"idle"
+    assert time.monotonic() - started < 1
+    # Ein Endezeichen beendet den Rahmen ohne die Pause abzuwarten
+    peer.sendall(b"busy\nnext")
+    started = time.monotonic()
+    assert channel.read_until(b"\n", idle=1) == b"busy"
+    assert time.monotonic() - started < 0.5
+    assert channel.read_until(b"\n", idle=0.05) == b"next"
+
+
+def test_idle_waits_for_first_bytes(pair):
+    channel, peer = pair
+    # Die Pause zählt erst nach den ersten Bytes, davor gilt die Frist
+    threading.Timer(0.2, peer.sendall, (b"late",)).start()
+    assert channel.read_until(b"\n", timeout=2, idle=0.05) == b"late"
+    with pytest.raises(socket.timeout):
+        channel.read_until(b"\n", timeout=0.1, idle=0.05)
+
+
+def test_partial_frame_times_out(pair):
+    channel, peer = pair
+    peer.sendall(b"abc")
+    with pytest.raises(socket.timeout):
+        channel.read_until(b"\n", timeout=0.1)
+    with pytest.raises(socket.timeout):
+        channel.read_exact(10, timeout=0.1)
+    # Der angefangene Rahmen bleibt erhalten
+    peer.sendall(b"def\n")
+    assert channel.read_until(b"\n") == b"abcdef"
+
+
+def test_closed_peer_raises(pair):
+    channel, peer = pair
+    peer.sendall(b"ab")
+    peer.close()
+    with pytest.raises(ConnectionError):
+        channel.read_exact(3)
+
+
+def test_throughput(pair):
+    channel, peer = pair
+    count = 50000
+    data = b"getstatus idle\n" * count
+    sender = threading.Thread(target=peer.sendall, args=(data,))
+    started = time.perf_counter()
+    sender.start()
+    for _ in range(count):
+        channel.read_until(b"\n")
+    elapsed = time.perf_counter() - started
+    sender.join()
+    # Großzügige Grenze, gemessen werden unter 0,1 s
+    assert elapsed < 5
+
+
+class LineServer(object):
+    """
+    Beantwortet jede Zeile mit 'ok <Zeile>'. Mit close_after schließt der
+    Server die Verbindung nach so vielen Zeilen, ohne zu antworten.
+    """
+
+    def __init__(self, close_after=None):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.close_after = close_after
+        self.received = []
+        self.connections = 0
+        self.closed = threading.Event()
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        with conn, conn.makefile("rb") as f:
+            for line in f:
+                self.received.append(line.strip())
+                if self.close_after is not None and len(self.received) >= self.close_after:
+                    break
+                conn.sendall(b"ok " + line)
+        self.closed.set()
+
+    def close(self):
+        self.listener.close()
+
+
+def command(cmd):
+    def func(channel):
+        channel.sendall(cmd + b"\n")
+        return channel.read_until(b"\n", timeout=2)
+    return func
+
+
+@pytest.fixture
+def server():
+    server = LineServer()
+    yield server
+    server.close()
+
+
+def test_reconnects_before_sending_when_peer_closed(server):
+    connection = DeviceConnection(cherrypy.engine, "127.0.0.1", server.port, timeout=2)
+    assert connection.transact(command(b"a")) == b"ok a"
+    # Gegenstelle schließt die Verbindung, z.B. Neustart der Software
+    connection.s.shutdown(socket.SHUT_WR)
+    assert server.closed.wait(2)
+    assert connection.transact(command(b"b")) == b"ok b"
+    assert server.received == [b"a", b"b"]
+    assert server.connections == 2
+    connection.close()
+
+
+def test_no_retry_after_command_was_sent():
+    server = LineServer(close_after=1)
+    try:
+        connection = DeviceConnection(cherrypy.engine, "127.0.0.1", server.port, timeout=2)
+        with pytest.raises(ConnectionError):
+            connection.transact(command(b"takepicture"))
+        # Der Befehl wurde genau einmal gesendet und nicht wiederholt
+        assert server.received == [b"takepicture"]
+        assert server.connections == 1
+        assert not connection.connected()
+    finally:
+        server.close()
+
+
+def slow(cmd, seconds):
+    def func(channel):
+        time.sleep(seconds)
+        return command(cmd)(channel)
+    return func
+
+
+@pytest.fixture
+def queued(server):
+    connection = QueuedDeviceConnection(cherrypy.engine, "127.0.0.1", server.port, timeout=0.2)
+    connection.start()
+    yield connection
+    connection.stop()
+
+
+def test_timed_out_request_is_not_sent_later(server, queued):
+    busy = queued.submit(slow(b"takepicture", 0.5))
+    with pytest.raises(TimeoutError):
+        queued.request(command(b"late"), timeout=0.1)
+    assert busy.result(2) == b"ok takepicture"
+    # Der Aufrufer hat bereits einen Fehler erhalten, der Befehl darf nicht mehr ausgeführt werden
+    assert queued.request(command(b"next")) == b"ok next"
+    assert server.received == [b"takepicture", b"next"]
+
+
+def test_wait_grows_with_queue_depth(server, queued):
+    # Jeder Befehl braucht länger als das Doppelte des Socket-Timeouts allein
+    for i in range(3):
+        queued.submit(slow(b"slow%d" % i, 0.3))
+    assert queued.request(command(b"last")) == b"ok last"
+    assert server.received == [b"slow0", b"slow1", b"slow2", b"last"]
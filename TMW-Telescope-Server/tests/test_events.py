@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import json
+import socket
+import time
+import urllib.error
+import urllib.request
+
+import cherrypy
+import pytest
+
+import TMWServer
+from StatusPoller import StatusPoller, SubscriberLimit
+
+SUBSCRIBERS = 300
+LIMIT = 200
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+@pytest.fixture(scope="module")
+def server():
+    # Die CherryPy-Engine lässt sich je Prozess nur einmal sauber starten, daher ein Server je Modul
+    state = {'value': 0}
+    poller = StatusPoller(cherrypy.engine, {'phd': lambda: state['value']}, interval=0.05)
+    poller.start()
+    subscribers = SubscriberLimit(LIMIT)
+    TMWServer.status_poller = poller
+    TMWServer.subscribers = subscribers
+    port = free_port()
+    cherrypy.tree.mount(TMWServer.TMWServer(), "/", {'/': {}})
+    # Weniger Threads als Abonnenten, aber mehr als die Grenze
+    cherrypy.config.update({'server.socket_host': "127.0.0.1", 'server.socket_port': port,
+                            'server.thread_pool': LIMIT + 50, 'server.socket_queue_size': 128,
+                            'engine.autoreload.on': False, 'log.screen': False})
+    cherrypy.engine.start()
+    cherrypy.engine.wait(cherrypy.engine.states.STARTED)
+    yield port, state, subscribers
+    # Beendet zuerst die offenen Streams, sonst wartet der Server auf ihre Threads
+    poller.stop()
+    cherrypy.engine.exit()
+    del TMWServer.status_poller, TMWServer.subscribers
+
+
+def get(port, path):
+    with urllib.request.urlopen("http://127.0.0.1:%d%s" % (port, path), timeout=5) as response:
+        return json.loads(response.read().decode())
+
+
+def subscribe(port):
+    s = socket.create_connection(("127.0.0.1", port), timeout=10)
+    s.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    return s
+
+
+def read_until(s, marker, data=b""):
+    while marker not in data:
+        chunk = s.recv(4096)
+        assert chunk, "Verbindung geschlossen"
+        data += chunk
+    return data
+
+
+def test_hundreds_of_subscribers(server):
+    port, state, subscribers = server
+    clients = [subscribe(port) for _ in range(SUBSCRIBERS)]
+    replies = [read_until(s, b"\r\n") for s in clients]
+    streaming = [(s, reply) for s, reply in zip(clients, replies) if reply.startswith(b"HTTP/1.1 200")]
+    refused = [s for s, reply in zip(clients, replies) if reply.startswith(b"HTTP/1.1 503")]
+    assert len(streaming) == LIMIT
+    assert len(refused) == SUBSCRIBERS - LIMIT
+    assert subscribers.active == LIMIT
+    for s in refused:
+        s.close()
+
+    # Die übrigen Routen bekommen trotz aller Abonnenten noch einen Thread
+    started = time.perf_counter()
+    with urllib.request.urlopen("http://127.0.0.1:%d/metrics" % port, timeout=5) as response:
+        assert response.status == 200
+    assert time.perf_counter() - started < 2
+    # Long-Polls zählen zu den Abonnenten
+    with pytest.raises(urllib.error.HTTPError) as refused_poll:
+        get(port, "/status_changes?since=0&timeout=1")
+    assert refused_poll.value.code == 503
+    assert json.loads(refused_poll.value.read().decode())['status'] is False
+    assert get(port, "/status_changes?since=x")['status'] is False
+    assert get(port, "/status_changes?timeout=x")['status'] is False
+
+    # Eine einzige Abfrage erreicht alle Abonnenten
+    for s, reply in streaming:
+        read_until(s, b'"phd": 0', reply)
+    started = time.perf_counter()
+    state['value'] = 1
+    for s, reply in streaming:
+        read_until(s, b'"phd": 1')
+    assert time.perf_counter() - started < 5
+
+    # Getrennte Abonnenten geben ihren Platz beim nächsten Ereignis frei
+    for s, reply in streaming:
+        s.close()
+    deadline = time.time() + 10
+    while subscribers.active and time.time() < deadline:
+        state['value'] += 1
+        time.sleep(0.1)
+    assert subscribers.active == 0
+    assert get(port, "/status_changes?since=0&timeout=1")['changes'] == {'phd': state['value']}
+
+
+def test_invalid_event_id(server):
+    port, state, subscribers = server
+    request = urllib.request.Request("http://127.0.0.1:%d/events" % port, headers={'Last-Event-ID': "abc"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        assert json.loads(response.read().decode())['status'] is False
+    assert subscribers.active == 0
+
+
+def test_plan_rejects_bad_step(server):
+    port, state, subscribers = server
+    for step in ("0", "-1", "nan", "inf"):
+        assert get(port, "/plan?targets=M31&step=" + step)['status'] is False
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import io
+import sqlite3
+import tarfile
+import time
+
+import cherrypy
+import pytest
+
+from DeviceSimulators import FakeArchiveServer
+from FrameIngest import FrameCatalog, FrameIngest, session_of, tar_stream
+
+
+class LockedOnce(FrameCatalog):
+    """
+    Katalog, dessen erste Abfrage einer Aufnahme an einer gesperrten Datenbank scheitert.
+    """
+    failed = False
+
+    def get(self, frame_id):
+        if not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError("database is locked")
+        return FrameCatalog.get(self, frame_id)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    server = FakeArchiveServer(directory=str(tmp_path / "archive"))
+    port = server.start()
+    yield server, "http://localhost:%d/frames" % port
+    server.stop()
+
+
+def test_upload_thread_survives_database_error(tmp_path, archive):
+    server, url = archive
+    incoming = tmp_path / "bye"
+    incoming.mkdir()
+    catalog = LockedOnce(":memory:")
+    ingest = FrameIngest(cherrypy.engine, catalog, str(incoming), interval=0.05, archive_url=url, workers=1)
+    ingest.start()
+    try:
+        (incoming / "M31_LIGHT_60s_800iso_1.CR2").write_bytes(b"a" * 1000)
+        wait_for(lambda: catalog.counts().get('retry') == 1)
+        # Der einzige Übertragungs-Thread arbeitet weiter
+        (incoming / "M31_LIGHT_60s_800iso_2.CR2").write_bytes(b"b" * 1000)
+        wait_for(lambda: catalog.counts().get('done') == 1)
+    finally:
+        ingest.stop()
+    assert catalog.counts() == {'retry': 1, 'done': 1}
+
+
+def test_session_column_added_to_old_catalog(tmp_path):
+    path = str(tmp_path / "frames.db")
+    # Schema der ersten Version ohne Spalte 'session'
+    db = sqlite3.connect(path)
+    db.execute("""CREATE TABLE frames (
+        id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, name TEXT NOT NULL, size INTEGER,
+        mtime REAL, sha256 TEXT, exposure REAL, iso INTEGER, target TEXT, sequence TEXT,
+        captured REAL, ingested REAL, archive_state TEXT, attempts INTEGER DEFAULT 0,
+        retry_at REAL, archived REAL, error TEXT)""")
+    db.execute("INSERT INTO frames (path, name, target, captured) VALUES ('/bye/a.CR2', 'a.CR2', 'M31', ?)",
+               (time.time(),))
+    db.commit()
+    db.close()
+    catalog = FrameCatalog(path)
+    frame = catalog.get(1)
+    assert frame['session'] and frame['session'] == session_of(frame['captured'])
+
+
+def test_tar_stream_keeps_duplicate_names(tmp_path):
+    frames = []
+    for frame_id, directory in ((1, "a"), (2, "b"), (3, "c")):
+        (tmp_path / directory).mkdir()
+        path = tmp_path / directory / "IMG_0001.CR2"
+        path.write_bytes(directory.encode() * 100)
+        frames.append({'id': frame_id, 'path': str(path), 'name': "IMG_0001.CR2", 'session': "2026-10-17",
+                       'mtime': time.time()})
+    with tarfile.open(fileobj=io.BytesIO(b"".join(tar_stream(frames)))) as tar:
+        members = dict((m.name, tar.extractfile(m).read()) for m in tar.getmembers())
+    assert members == {"2026-10-17/IMG_0001.CR2": b"a" * 100,
+                       "2026-10-17/IMG_0001_2.CR2": b"b" * 100,
+                       "2026-10-17/IMG_0001_3.CR2": b"c" * 100}
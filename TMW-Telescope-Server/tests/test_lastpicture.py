@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from io import BytesIO
+import os
+import threading
+import time
+import urllib.request
+
+import cheroot.wsgi
+import cherrypy
+from cherrypy.lib import file_generator
+import pytest
+
+from DeviceConnection import QueuedDeviceConnection
+from DeviceSimulators import FakeBYEServer
+import TMWServer
+
+SIZE = 50 * 1024 * 1024
+CLIENTS = 4
+
+
+class ReadWholeFile(object):
+    """
+    Vergleichsbasis: die frühere Route, die das ganze Bild in den Speicher liest.
+    """
+
+    @cherrypy.expose
+    def bye_lastpicture(self):
+        cherrypy.response.headers['Content-Type'] = 'application/octet-stream'
+        image = TMWServer.BYECommunicator().getpicturepath()
+        f = open(image, 'rb')
+        data = BytesIO(f.read())
+        f.close()
+        return file_generator(data)
+
+
+def peak_rss():
+    """
+    :return: Höchster Speicherverbrauch (RSS) des Prozesses seit reset_peak_rss() in Bytes.
+    """
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+
+
+def reset_peak_rss():
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+@pytest.fixture(scope="module")
+def picture(tmp_path_factory):
+    path = tmp_path_factory.mktemp("bye") / "IMG_0001.CR2"
+    with open(str(path), "wb") as f:
+        for _ in range(SIZE // (1024 * 1024)):
+            f.write(os.urandom(1024 * 1024))
+    bye = FakeBYEServer(port=0)
+    bye.picturepath = str(path)
+    bye.terminator = "\n"
+    connection = QueuedDeviceConnection(cherrypy.engine, 'localhost', bye.start(), timeout=5)
+    connection.start()
+    TMWServer.bye_connection = connection
+    TMWServer.BYECommunicator.terminator = b"\n"
+    yield str(path)
+    TMWServer.BYECommunicator.terminator = b""
+    del TMWServer.bye_connection
+    connection.stop()
+    bye.stop()
+
+
+def serve(root):
+    """
+    Startet die Anwendung ohne die CherryPy-Engine auf einem freien Port.
+    :return: (Server, Port)
+    """
+    app = cherrypy.Application(root, config={'/': {'response.stream': True}})
+    server = cheroot.wsgi.Server(('127.0.0.1', 0), app, numthreads=CLIENTS + 2)
+    server.prepare()
+    threading.Thread(target=server.serve, daemon=True).start()
+    return server, server.bind_addr[1]
+
+
+def download(port, ttfb, headers=None):
+    request = urllib.request.Request("http://127.0.0.1:%d/bye_lastpicture" % port, headers=headers or {})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        size = len(response.read(1))
+        ttfb.append(time.perf_counter() - started)
+        while True:
+            chunk = response.read(1024 * 1024)
+            if not chunk:
+                return size
+            size += len(chunk)
+
+
+def measure(root):
+    """
+    :return: (Anstieg des RSS in Bytes, mittlere Zeit bis zum ersten Byte in Sekunden) bei CLIENTS gleichzeitigen Downloads.
+    """
+    server, port = serve(root)
+    try:
+        ttfb = []
+        sizes = []
+        clients = [threading.Thread(target=lambda: sizes.append(download(port, ttfb))) for _ in range(CLIENTS)]
+        reset_peak_rss()
+        before = peak_rss()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        assert sizes == [SIZE] * CLIENTS
+        return peak_rss() - before, sum(ttfb) / len(ttfb)
+    finally:
+        server.stop()
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="Nur unter Linux messbar")
+def test_benchmark_peak_rss_and_ttfb(picture):
+    streamed_rss, streamed_ttfb = measure(TMWServer.TMWServer())
+    whole_rss, whole_ttfb = measure(ReadWholeFile())
+    print("bye_lastpicture, %d x %d MB: Spitze RSS +%.0f MB statt +%.0f MB, erstes Byte nach %.1f ms statt %.1f ms"
+          % (CLIENTS, SIZE >> 20, streamed_rss / 2 ** 20, whole_rss / 2 ** 20, streamed_ttfb * 1e3, whole_ttfb * 1e3))
+    # Gestreamt bleibt der Speicher unter einer Dateigröße, egal wie viele Clients laden
+    assert streamed_rss < SIZE
+    assert whole_rss > 2 * SIZE
+    assert streamed_ttfb < whole_ttfb
+
+
+def test_range_and_etag(picture):
+    server, port = serve(TMWServer.TMWServer())
+    try:
+        url = "http://127.0.0.1:%d/bye_lastpicture" % port
+        with urllib.request.urlopen(url, timeout=60) as response:
+            etag = response.headers['ETag']
+            assert int(response.headers['Content-Length']) == SIZE
+        request = urllib.request.Request(url, headers={'Range': "bytes=%d-" % (SIZE - 10)})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            assert response.status == 206
+            with open(picture, "rb") as f:
+                f.seek(SIZE - 10)
+                assert response.read() == f.read()
+        request = urllib.request.Request(url, headers={'If-None-Match': etag})
+        with pytest.raises(urllib.error.HTTPError) as unchanged:
+            urllib.request.urlopen(request, timeout=5)
+        assert unchanged.value.code == 304
+    finally:
+        server.stop()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+import threading
+import time
+
+import pytest
+
+from Metrics import LATENCY_BUCKETS, Counter, Histogram, Registry, device_errors, device_seconds, timed
+
+
+class LockedCounter(object):
+    """
+    Vergleichsbasis: ein Dict hinter einem gemeinsamen Lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class LockedHistogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+
+def hammer(func, threads=8, count=20000):
+    """
+    :return: Zeit je Aufruf in Sekunden, alle Threads gleichzeitig.
+    """
+    def work():
+        for _ in range(count):
+            func()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / (threads * count)
+
+
+def test_sharded_counts_are_exact():
+    counter = Counter("c", "Test", ('route',))
+    histogram = Histogram("h", "Test", ('route',))
+    hammer(lambda: counter.inc(1, "a"))
+    hammer(lambda: histogram.observe(0.003, "a"))
+    # Die Threads sind beendet, ihre Teile gehen in 'retired' über und bleiben erhalten
+    for _ in range(2):
+        assert counter.collect() == {("a",): 160000}
+        counts = histogram.collect()[("a",)]
+        assert counts[bisect_left(histogram.buckets, 0.003)] == 160000
+        assert sum(counts[:-1]) == 160000
+    assert counter.shards == []
+
+
+def test_sharded_not_slower_than_lock():
+    counter, locked_counter = Counter("c", "Test", ('route',)), LockedCounter()
+    histogram, locked_histogram = Histogram("h", "Test", ('route',)), LockedHistogram()
+    inc = hammer(lambda: counter.inc(1, "a"))
+    inc_locked = hammer(lambda: locked_counter.inc(1, "a"))
+    observe = hammer(lambda: histogram.observe(0.003, "a"))
+    observe_locked = hammer(lambda: locked_histogram.observe(0.003, "a"))
+    print("inc %.2f us (Lock %.2f us), observe %.2f us (Lock %.2f us)"
+          % (inc * 1e6, inc_locked * 1e6, observe * 1e6, observe_locked * 1e6))
+    # Gemessen ist der Shard etwa 1,5- bis 2-mal schneller; Reserve gegen Schwankungen
+    assert inc < 1.5 * inc_locked
+    assert observe < 1.5 * observe_locked
+
+
+def test_render_exposition_format():
+    registry = Registry()
+    counter = registry.counter("tmw_test_total", "Zähler mit Labels", ('route', 'code'))
+    histogram = registry.histogram("tmw_test_seconds", "Dauer", ('route',), buckets=(0.1, 1))
+    registry.gauge("tmw_test_depth", "Tiefe", lambda: {'camera': 2, 'mount': 0}, ('lane',))
+    registry.gauge("tmw_test_active", "Aktiv", lambda: 3)
+    registry.gauge("tmw_test_broken", "Defekt", lambda: 1 / 0)
+    counter.inc(2, 'a"b\\c', "200")
+    counter.inc(1, "x\ny", "500")
+    for value in (0.05, 0.5, 0.1, 5):
+        histogram.observe(value, "frames")
+
+    assert registry.render() == "\n".join([
+        '# HELP tmw_test_total Zähler mit Labels',
+        '# TYPE tmw_test_total counter',
+        'tmw_test_total{route="a\\"b\\\\c",code="200"} 2',
+        'tmw_test_total{route="x\\ny",code="500"} 1',
+        '# HELP tmw_test_seconds Dauer',
+        '# TYPE tmw_test_seconds histogram',
+        'tmw_test_seconds_bucket{route="frames",le="0.1"} 2',
+        'tmw_test_seconds_bucket{route="frames",le="1"} 3',
+        'tmw_test_seconds_bucket{route="frames",le="+Inf"} 4',
+        'tmw_test_seconds_sum{route="frames"} 5.65',
+        'tmw_test_seconds_count{route="frames"} 4',
+        '# HELP tmw_test_depth Tiefe',
+        '# TYPE tmw_test_depth gauge',
+        'tmw_test_depth{lane="camera"} 2',
+        'tmw_test_depth{lane="mount"} 0',
+        '# HELP tmw_test_active Aktiv',
+        '# TYPE tmw_test_active gauge',
+        'tmw_test_active 3',
+        '# HELP tmw_test_broken Defekt',
+        '# TYPE tmw_test_broken gauge',
+        '# tmw_test_broken: division by zero',
+    ]) + "\n"
+
+
+def test_timed_counts_calls_and_errors():
+    @timed('test', lambda cmd: str(cmd))
+    def command(cmd):
+        if cmd == 2:
+            raise OSError("Gerät nicht erreichbar")
+        return cmd
+
+    assert command(1) == 1
+    with pytest.raises(OSError):
+        command(2)
+    assert sum(device_seconds.collect()[('test', '1')][:-1]) == 1
+    assert sum(device_seconds.collect()[('test', '2')][:-1]) == 1
+    assert device_errors.collect().get(('test', '1')) is None
+    assert device_errors.collect()[('test', '2')] == 1
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import cherrypy
+import pytest
+
+from MountDriver import MountDriver, MountService
+from MountTelemetry import MountTelemetry, TelemetryStopped
+from Sequencer import SequenceAborted
+
+
+class RecordingDriver(MountDriver):
+    """
+    Protokolliert Verbindungsaufbau und -abbau, OSError gilt als Verbindungsverlust.
+    """
+
+    def __init__(self):
+        self.log = []
+        self.slewing = False
+
+    def connect(self):
+        self.log.append('connect')
+
+    def disconnect(self):
+        self.log.append('disconnect')
+
+    def connection_lost(self, error):
+        return isinstance(error, OSError)
+
+    def start(self):
+        return True
+
+    def stop(self):
+        self.log.append('stop')
+
+    def park(self):
+        raise OSError("EQMOD beendet")
+
+    def unpark(self):
+        raise ValueError("Montierung ist nicht geparkt")
+
+    def state(self):
+        self.log.append('state')
+        return {'slewing': self.slewing}
+
+
+@pytest.fixture
+def mount():
+    driver = RecordingDriver()
+    service = MountService(cherrypy.engine, driver, timeout=5)
+    service.start()
+    yield service
+    service.stop()
+
+
+def test_reconnects_after_stop(mount):
+    mount.call('start')
+    mount.call('stop')
+    assert not mount.connected
+    mount.call('start')
+    assert mount.connected
+    assert mount.driver.log == ['connect', 'stop', 'disconnect', 'connect']
+
+
+def test_reconnects_after_connection_error(mount):
+    mount.call('start')
+    with pytest.raises(ValueError):
+        mount.call('unpark')
+    # Fehler der Montierung selbst behalten die Verbindung
+    assert mount.connected
+    with pytest.raises(OSError):
+        mount.call('park')
+    assert not mount.connected
+    mount.call('start')
+    assert mount.driver.log == ['connect', 'disconnect', 'connect']
+
+
+def test_disconnects_on_shutdown(mount):
+    mount.call('start')
+    mount.stop()
+    assert mount.driver.log == ['connect', 'disconnect']
+
+
+def test_telemetry_polls_only_while_connected(mount):
+    telemetry = MountTelemetry(cherrypy.engine, mount, interval=0.05)
+    telemetry.start()
+    try:
+        time.sleep(0.3)
+        # Die Abfrage darf nicht selbst verbinden (EQMOD würde starten)
+        assert mount.driver.log == []
+        assert telemetry.state() is None
+        assert telemetry.error == "Montierung nicht verbunden"
+        mount.call('start')
+        deadline = time.time() + 2
+        while telemetry.state() is None and time.time() < deadline:
+            time.sleep(0.01)
+        assert telemetry.state() is not None
+        mount.call('stop')
+        polls = mount.driver.log.count('state')
+        time.sleep(0.3)
+        assert mount.driver.log.count('state') == polls
+        assert mount.driver.log[-1] == 'disconnect'
+    finally:
+        telemetry.stop()
+
+
+def test_wait_for_slew_abort(mount):
+    telemetry = MountTelemetry(cherrypy.engine, mount, interval=0.05, slew_interval=0.02)
+    telemetry.start()
+    mount.driver.slewing = True
+    mount.call('start')
+    abort = threading.Event()
+
+    def interrupt():
+        abort.set()
+        telemetry.wake()
+
+    threading.Timer(0.2, interrupt).start()
+    started = time.time()
+    try:
+        with pytest.raises(SequenceAborted):
+            telemetry.wait_for_slew(time.time(), timeout=30, abort=abort)
+        assert time.time() - started < 1
+    finally:
+        telemetry.stop()
+
+
+@pytest.mark.parametrize("slewing", [True, False])
+def test_wait_for_slew_on_shutdown(mount, slewing):
+    telemetry = MountTelemetry(cherrypy.engine, mount, interval=0.05, slew_interval=0.02)
+    telemetry.start()
+    # Beim Schwenk oder in der Beruhigungszeit
+    mount.driver.slewing = slewing
+    mount.call('start')
+    threading.Timer(0.2, telemetry.stop).start()
+    started = time.time()
+    with pytest.raises(TelemetryStopped):
+        telemetry.wait_for_slew(time.time(), settle=30, timeout=30)
+    assert time.time() - started < 1
+
+
+class SlowDriver(RecordingDriver):
+    """
+    Synchrones Parken wie ASCOM Park(), zeichnet die Reihenfolge der Befehle auf.
+    """
+
+    def park(self):
+        self.log.append('park')
+        time.sleep(0.5)
+
+    def slew_to_coordinates(self, ra, dec):
+        self.log.append('slew')
+
+    def abort_slew(self):
+        self.log.append('abort')
+
+
+def test_long_commands_get_long_timeout():
+    service = MountService(cherrypy.engine, SlowDriver(), timeout=0.2, long_timeout=5)
+    service.start()
+    try:
+        service.call('park')
+        with pytest.raises(TimeoutError):
+            service.call('park', timeout=0.1)
+    finally:
+        service.stop()
+
+
+def test_abort_overtakes_queued_commands():
+    service = MountService(cherrypy.engine, SlowDriver(), timeout=5)
+    service.start()
+    try:
+        service.call('start')
+        parking = service.submit('park')
+        time.sleep(0.1)
+        slew = service.submit('slew_to_coordinates', 1, 2)
+        service.call('abort_slew')
+        slew.result(5)
+        assert service.driver.log == ['connect', 'park', 'abort', 'slew']
+        assert parking.done()
+    finally:
+        service.stop()
+
+
+def test_timed_out_command_is_dropped():
+    service = MountService(cherrypy.engine, SlowDriver(), timeout=0.1)
+    service.start()
+    try:
+        service.call('start')
+        service.submit('park')
+        time.sleep(0.1)
+        with pytest.raises(TimeoutError):
+            service.call('slew_to_coordinates', 1, 2, timeout=0.1)
+        service.call('state', timeout=5)
+        assert 'slew' not in service.driver.log
+    finally:
+        service.stop()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from NameResolver import NameResolver, normalize
+
+CATALOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "catalog", "messier.csv")
+
+
+@pytest.fixture
+def resolver(tmp_path):
+    return NameResolver(str(tmp_path / "cache.json"), CATALOG)
+
+
+def prepare(resolver, names, repeat=200):
+    """
+    GoTo-Vorbereitung wie in background_eqmod_goto_name: Name -> SkyCoord.
+    :return: Mittlere Zeit je Name in Sekunden
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for name in names:
+            resolver.coord(name)
+    return (time.perf_counter() - started) / (repeat * len(names))
+
+
+def test_bundled_messier_catalog(resolver):
+    assert all(normalize("M%d" % i) in resolver.catalog for i in range(1, 111))
+    assert resolver.resolve("Messier 31") == resolver.resolve("NGC 224") == resolver.resolve("m31")
+    ra, dec, source = resolver.resolve("M42")
+    assert source == 'catalog'
+    assert abs(ra - 83.85) < 0.1 and abs(dec + 5.45) < 0.1
+    # Objekte ohne NGC-Nummer
+    assert resolver.resolve("M45")[2] == 'catalog'
+    for ra, dec in resolver.catalog.values():
+        assert 0 <= ra < 360 and -90 <= dec <= 90
+
+
+def test_several_catalog_files(tmp_path):
+    extra = tmp_path / "ngc.csv"
+    extra.write_text("Name;Type;RA;Dec;M\nNGC7000;HII;20:59:17.1;+44:31:44;\n", encoding='utf-8')
+    resolver = NameResolver(str(tmp_path / "cache.json"), CATALOG + "," + str(extra))
+    assert resolver.resolve("NGC 7000")[2] == 'catalog'
+    assert resolver.resolve("M13")[2] == 'catalog'
+
+
+def test_stats_from_many_threads(resolver):
+    def work():
+        for _ in range(2000):
+            resolver.resolve("M13")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert resolver.stats['catalog'] == 16000
+
+
+def test_benchmark_cached_vs_uncached(tmp_path):
+    cache = tmp_path / "cache.json"
+    cache.write_text(json.dumps({"VEGA": [279.2347, 38.7837, time.time()]}), encoding='utf-8')
+    resolver = NameResolver(str(cache), CATALOG)
+    catalog_time = prepare(resolver, ["M31", "M57", "Messier 101"])
+    cache_time = prepare(resolver, ["Vega"])
+    print("GoTo-Vorbereitung je Name: Katalog %.3f ms, Cache %.3f ms" % (catalog_time * 1e3, cache_time * 1e3))
+    assert catalog_time < 0.005 and cache_time < 0.005
+
+    # Ohne Eintrag in Katalog und Cache fragt der Resolver Sesame über das Netz
+    uncached = NameResolver(str(tmp_path / "empty.json"))
+    started = time.perf_counter()
+    try:
+        uncached.coord("Vega")
+    except Exception as e:
+        pytest.skip("Sesame nicht erreichbar: %s" % e)
+    network_time = time.perf_counter() - started
+    print("GoTo-Vorbereitung ohne Cache: %.0f ms" % (network_time * 1e3))
+    assert uncached.resolve("Vega")[2] == 'cache'
+    assert network_time > 10 * cache_time
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+
+import cherrypy
+import pytest
+
+from DeviceConnection import DeviceConnection
+from DeviceSimulators import FakePHDServer
+from TMWServer import PHDCommunicator
+
+
+class CountingPHDServer(FakePHDServer):
+    """
+    Zählt die Verbindungen und kann sie wie ein beendetes PHD schließen.
+    """
+
+    def __init__(self, *args, **kwargs):
+        FakePHDServer.__init__(self, *args, **kwargs)
+        self.connections = []
+
+    def process_request(self, request, client_address):
+        self.connections.append(request)
+        FakePHDServer.process_request(self, request, client_address)
+
+    def stop(self):
+        FakePHDServer.stop(self)
+        for request in self.connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def connect_per_call(port):
+    """
+    Vergleichsbasis: der frühere PHDCommunicator mit einem Socket je Anfrage.
+    """
+    s = socket.create_connection(('localhost', port))
+    try:
+        s.send(bytes((17,)))
+        return s.recv(1)[0]
+    finally:
+        s.close()
+
+
+@pytest.fixture
+def phd():
+    server = CountingPHDServer(port=0)
+    port = server.start()
+    connection = DeviceConnection(cherrypy.engine, 'localhost', port, timeout=2, keepalive=0.2,
+                                  keepalive_func=lambda channel: PHDCommunicator._exchange(channel, 17),
+                                  backoff_min=0.2, backoff_max=1)
+    connection.start()
+    yield server, port, connection
+    connection.stop()
+    server.stop()
+
+
+def rate(func, threads=8, count=250):
+    """
+    :return: Anfragen je Sekunde, alle Threads gleichzeitig.
+    """
+    errors = []
+
+    def work():
+        for _ in range(count):
+            if func() != 0:
+                errors.append(1)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert not errors
+    return threads * count / (time.perf_counter() - started)
+
+
+def test_load_shares_one_connection(phd):
+    server, port, connection = phd
+    communicator = PHDCommunicator(connection)
+    shared = rate(lambda: communicator.getstatus(returnstatuscode=True))
+    # 2000 Anfragen aus 8 Threads über eine einzige Verbindung
+    assert len(server.connections) == 1
+    baseline = rate(lambda: connect_per_call(port))
+    print("PHD getstatus je Sekunde: Socket je Anfrage %.0f, gemeinsame Verbindung %.0f" % (baseline, shared))
+    assert shared > baseline
+
+
+def test_keepalive_and_reconnect_after_restart(phd):
+    server, port, connection = phd
+    communicator = PHDCommunicator(connection)
+    assert communicator.getstatus(returnstatuscode=True) == 0
+    commands = server.commands
+    time.sleep(0.7)
+    # In Ruhephasen hält das Keepalive die Verbindung offen
+    assert server.commands > commands
+    assert len(server.connections) == 1
+
+    server.stop()
+    with pytest.raises(OSError):
+        communicator.getstatus(returnstatuscode=True)
+    # Während des Backoffs wird PHD nicht mit Verbindungsversuchen geflutet
+    started = time.perf_counter()
+    with pytest.raises(ConnectionError):
+        communicator.getstatus(returnstatuscode=True)
+    assert time.perf_counter() - started < 0.05
+
+    restarted = CountingPHDServer(port=port)
+    restarted.start()
+    try:
+        deadline = time.time() + 5
+        while not connection.connected() and time.time() < deadline:
+            time.sleep(0.05)
+        # Das Keepalive hat die Verbindung von selbst wiederhergestellt
+        assert connection.connected()
+        assert communicator.getstatus(returnstatuscode=True) == 0
+        assert len(restarted.connections) == 1
+    finally:
+        restarted.stop()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import cherrypy
+import numpy as np
+import pytest
+
+from DeviceSimulators import FakePHD2Server
+from PHD2Client import GuideStats, PHD2Client
+from Sequencer import SequenceAborted
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("Bedingung nicht erfüllt")
+        time.sleep(0.01)
+
+
+def expected(values):
+    values = np.array(values)
+    ra, dec = values[:, 0], values[:, 1]
+    return {'count': len(values), 'ra_rms': round(float(ra.std()), 3), 'dec_rms': round(float(dec.std()), 3),
+            'total_rms': round(float(np.hypot(ra.std(), dec.std())), 3),
+            'ra_peak': round(float(np.abs(ra).max()), 3), 'dec_peak': round(float(np.abs(dec).max()), 3)}
+
+
+def test_guide_stats_rolling_window():
+    rng = np.random.default_rng(1)
+    stats = GuideStats(size=50)
+    values = []
+    # Mehrfach über das Fenster hinaus, inklusive Neuberechnung der Summen nach 10 Fenstern
+    for i in range(1234):
+        ra, dec = float(rng.normal(0, 0.5)), float(rng.normal(0.1, 0.3))
+        if i == 700:
+            # Spitze, die später aus dem Fenster fallen muss
+            ra = 9.0
+        stats.add(i, i, ra, dec)
+        values.append((ra, dec))
+        if i in (0, 1, 49, 50, 51, 720, 749, 750, 999, 1233):
+            assert stats.stats() == expected(values[-50:]), i
+    history = stats.history(3)
+    assert [h['frame'] for h in history] == [1231, 1232, 1233]
+    assert [h['ra'] for h in history] == [v[0] for v in values[-3:]]
+    assert len(stats.history()) == 50
+
+
+def test_guide_stats_clear():
+    stats = GuideStats(size=10)
+    for i in range(25):
+        stats.add(i, i, 5.0, -5.0)
+    stats.clear()
+    assert stats.stats()['count'] == 0
+    assert stats.stats()['ra_peak'] is None
+    assert stats.history() == []
+    for i in range(3):
+        stats.add(i, 100 + i, 0.1 * (i + 1), 0.2)
+    assert stats.stats() == expected([(0.1, 0.2), (0.2, 0.2), (0.3, 0.2)])
+    assert [h['frame'] for h in stats.history()] == [100, 101, 102]
+
+
+@pytest.fixture
+def server():
+    server = FakePHD2Server("127.0.0.1", 0, interval=0.02, settle_duration=0.2)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    client = PHD2Client(cherrypy.engine, "127.0.0.1", server.server_address[1], size=50, timeout=2)
+    client.start()
+    wait_for(lambda: client.connected and server.clients)
+    yield client
+    client.stop()
+
+
+def test_dither_waits_for_settle_done(client):
+    result = client.dither(1.5, settle_time=0.3, timeout=5)
+    assert 0.3 <= result['settle'] < 2
+    assert result['dropped_frames'] == 0
+
+
+def test_dither_abort(client, server):
+    server.settle_duration = 10
+    abort = threading.Event()
+
+    def interrupt():
+        abort.set()
+        client.wake()
+
+    threading.Timer(0.2, interrupt).start()
+    started = time.time()
+    with pytest.raises(SequenceAborted):
+        client.dither(1.5, settle_time=10, timeout=30, abort=abort)
+    assert time.time() - started < 1
+
+
+def test_guide_steps_reach_stats(client):
+    wait_for(lambda: client.stats()['guide']['count'] >= 10)
+    stats = client.stats(history=5)
+    assert stats['connected'] and stats['state'] == 'Guiding'
+    assert len(stats['history']) == 5
+
+
+def test_wait_event(client, server):
+    server.broadcast({'Event': 'StarLost'})
+    wait_for(lambda: client.star_lost == 1)
+    since = client.version
+    # Ereignisse bis 'since' zählen nicht
+    with pytest.raises(TimeoutError):
+        client.wait_event(('StarLost',), since, 0.2)
+    threading.Timer(0.1, server.broadcast, ({'Event': 'StarLost', 'Frame': 7},)).start()
+    event = client.wait_event(('StarLost', 'GuidingStopped'), since, 5)
+    assert event['Frame'] == 7
+    assert client.state == 'LostLock'
+
+
+def test_reconnect_after_server_restart(client, server):
+    port = server.server_address[1]
+    server.stop()
+    wait_for(lambda: not client.connected)
+    with pytest.raises(ConnectionError):
+        client.call('get_app_state')
+    restarted = FakePHD2Server("127.0.0.1", port, interval=0.02, settle_duration=0.2)
+    restarted.start()
+    try:
+        # Backoff beginnt bei 0,5 s
+        wait_for(lambda: client.connected, timeout=10)
+        assert client.call('get_app_state') == 'Guiding'
+        version = client.version
+        wait_for(lambda: client.version > version)
+    finally:
+        restarted.stop()
+
+
+def test_late_reply_is_dropped(client, server):
+    rpc = server.rpc
+
+    def slow(request, message):
+        time.sleep(0.3)
+        rpc(request, message)
+
+    server.rpc = slow
+    for _ in range(3):
+        with pytest.raises(TimeoutError):
+            client.call('get_app_state', timeout=0.1)
+    server.rpc = rpc
+    # Nach den verspäteten Antworten bleibt nichts zurück
+    assert client.call('get_app_state') == 'Guiding'
+    assert client.responses == {} and client.waiting == set()
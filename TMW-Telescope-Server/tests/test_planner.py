@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import time
+
+import pytest
+
+import NameResolver
+from CoordinateService import CoordinateService
+from Planner import Planner
+
+CATALOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "catalog", "messier.csv")
+START = datetime.datetime(2026, 10, 18, 12)
+END = START + datetime.timedelta(days=1)
+
+
+@pytest.fixture
+def planner(tmp_path, monkeypatch):
+    def sesame(name):
+        # Ein Zugriff auf Sesame dauert über das Netz Sekunden
+        time.sleep(1)
+        raise AssertionError("Sesame abgefragt: %s" % name)
+
+    monkeypatch.setattr(NameResolver.SkyCoord, 'from_name', sesame)
+    resolver = NameResolver.NameResolver(str(tmp_path / "cache.json"), CATALOG)
+    return Planner(CoordinateService(53.082806, 7.800694, 5, iers_auto_download=False), resolver)
+
+
+def test_two_hundred_targets(planner):
+    planner.plan(["M31"], START, END)
+    # Katalog, Koordinaten und Namen, die weder im Katalog noch im Cache stehen
+    targets = (["M%d" % i for i in range(1, 111)] + ["%d,%d" % (i * 9, i - 20) for i in range(40)]
+               + ["Unbekannt %d" % i for i in range(50)])
+    started = time.perf_counter()
+    result = planner.plan(targets, START, END, step=5)
+    elapsed = time.perf_counter() - started
+    print("Plan für %d Ziele: %.0f ms" % (len(targets), elapsed * 1e3))
+    assert len(result['targets']) == 150
+    assert sorted(result['errors']) == sorted("Unbekannt %d" % i for i in range(50))
+    assert elapsed < 1
+
+
+@pytest.mark.parametrize("step", [0, -5, 0.5, 0.001])
+def test_step_too_small(planner, step):
+    with pytest.raises(ValueError):
+        planner.plan(["M31"], START, END, step=step)
+
+
+def test_too_many_steps(planner):
+    with pytest.raises(ValueError):
+        planner.plan(["M31"], START, START + datetime.timedelta(days=3), step=1)
+    assert len(planner.plan(["M31"], START, END, step=1)['times']) == 1441
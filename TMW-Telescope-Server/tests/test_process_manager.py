@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import configparser
+import shlex
+import time
+
+import pytest
+
+from Drivers import SimulatedBDSScripts, simulator_bdscommand
+from ProcessManager import ProcessManager
+import TMWServer
+
+
+@pytest.fixture
+def bds(monkeypatch):
+    """
+    Ruft fake_bdsrun wie BDSRun.exe auf: run(name, ...) -> Eintrag des Prozesses.
+    """
+    monkeypatch.setenv("FAKE_BDS_DELAY", "0.3")
+    command = [part.strip('"') for part in shlex.split(simulator_bdscommand(), posix=False)]
+    manager = ProcessManager(max_concurrent=2)
+
+    def run(name, **kwargs):
+        return manager.run(command + ["/Script:C:\\TMW\\baramundi\\%s.bds" % name, "/S"], name=name, **kwargs)
+
+    run.manager = manager
+    return run
+
+
+def overlapping(records):
+    """
+    :return: Größte Anzahl gleichzeitig laufender Prozesse.
+    """
+    events = sorted([(r['started'], 1) for r in records] + [(r['finished'], -1) for r in records])
+    running = peak = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+    return peak
+
+
+def wait_all(records, timeout=10):
+    deadline = time.time() + timeout
+    while any(r['finished'] is None for r in records):
+        assert time.time() < deadline
+        time.sleep(0.02)
+
+
+def test_exit_code_and_output(bds):
+    record = bds("bye_start")
+    assert record['state'] == 'done' and record['returncode'] == 0
+    assert "BDSRun: bye_start.bds" in record['output']
+    record = bds("phd_fail")
+    assert record['state'] == 'failed' and record['returncode'] == 1
+
+
+def test_hanging_script_is_killed(bds):
+    started = time.time()
+    record = bds("at_hang", timeout=1)
+    assert record['state'] == 'killed' and record['error'] == "Timeout nach 1 s"
+    assert time.time() - started < 5
+    assert bds.manager.processes(state='running') == []
+
+
+def test_resource_is_exclusive(bds):
+    records = [bds(name, resource="desktop", wait=False) for name in ("bye_start", "phd_starten")]
+    wait_all(records)
+    assert overlapping(records) == 1
+    assert all(r['state'] == 'done' for r in records)
+
+
+def test_concurrency_is_bounded(bds):
+    records = [bds("script_%d" % i, wait=False) for i in range(5)]
+    wait_all(records)
+    # max_concurrent=2, ohne Ressource laufen trotzdem nie mehr als zwei gleichzeitig
+    assert overlapping(records) == 2
+    assert [r['state'] for r in records] == ['done'] * 5
+
+
+@pytest.fixture
+def server_scripts(monkeypatch, tmp_path):
+    """
+    bdsrun aus dem Server mit fake_bdsrun statt BDSRun.exe.
+    """
+    monkeypatch.setenv("FAKE_BDS_DELAY", "0.3")
+    manager = ProcessManager(max_concurrent=4)
+    monkeypatch.setattr(TMWServer, 'Config', configparser.ConfigParser(), raising=False)
+    monkeypatch.setattr(TMWServer, 'scripts', SimulatedBDSScripts(), raising=False)
+    monkeypatch.setattr(TMWServer, 'process_manager', manager, raising=False)
+    monkeypatch.setattr(TMWServer, 'current_dir', str(tmp_path), raising=False)
+    return TMWServer.bdsrun
+
+
+def test_start_scripts_run_in_parallel(server_scripts):
+    starts = [server_scripts(name, wait=False) for name in ("bye_start", "phd_starten", "at_start")]
+    wait_all(starts)
+    assert overlapping(starts) == 3 and all(r['resource'] is None for r in starts)
+    desktop = [server_scripts(name, wait=False) for name in ("bye_beenden", "at_platesolve")]
+    wait_all(desktop)
+    assert overlapping(desktop) == 1 and all(r['resource'] == "desktop" for r in desktop)
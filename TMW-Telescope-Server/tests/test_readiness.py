@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from itertools import islice
+import socket
+import threading
+import time
+
+import pytest
+
+from Readiness import backoff_delays, port_open, wait_for_port, wait_until
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_backoff_delays():
+    assert list(islice(backoff_delays(0.25, 5.0), 7)) == [0.25, 0.5, 1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+def test_wait_until_backs_off():
+    calls = []
+
+    def check():
+        calls.append(time.monotonic())
+        return len(calls) == 5
+
+    wait_until(check, timeout=5, initial=0.02, maximum=0.08)
+    gaps = [b - a for a, b in zip(calls, calls[1:])]
+    # 0.02, 0.04, 0.08, 0.08: wachsend bis zum Maximum
+    for gap, expected in zip(gaps, (0.02, 0.04, 0.08, 0.08)):
+        assert expected <= gap < expected + 0.05
+
+
+def test_wait_until_timeout_reports_last_error():
+    def check():
+        raise ConnectionRefusedError("abgelehnt")
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError, match="abgelehnt"):
+        wait_until(check, timeout=0.3, initial=0.05, maximum=0.1)
+    # Die letzte Wartezeit wird auf die Frist gekürzt
+    assert 0.3 <= time.monotonic() - started < 0.5
+
+
+def test_wait_for_port_opens_late():
+    port = free_port()
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    def open_late():
+        listener.bind(("127.0.0.1", port))
+        listener.listen(1)
+
+    assert not port_open("127.0.0.1", port)
+    timer = threading.Timer(0.3, open_late)
+    timer.start()
+    try:
+        waited = wait_for_port("127.0.0.1", port, timeout=5, initial=0.05, maximum=0.1)
+        # Spätestens ein Backoff-Schritt nach dem Öffnen erkannt
+        assert 0.3 <= waited < 0.3 + 0.1 + 0.1
+    finally:
+        timer.join()
+        listener.close()
+
+
+def test_wait_for_port_timeout():
+    port = free_port()
+    with pytest.raises(TimeoutError):
+        wait_for_port("127.0.0.1", port, timeout=0.3, initial=0.05, maximum=0.1)
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from ScreenshotService import ScreenshotFrame, StubScreenshotBackend
+
+
+@pytest.mark.parametrize("scale, rounded", [(1, 1), (0.9, 1), (0.5, 0.5), (0.3, 0.5), (0.25, 0.25),
+                                            (0.1, 0.125), (0.01, 1.0 / 16), (1e-9, 1.0 / 16)])
+def test_scale_buckets(scale, rounded):
+    assert ScreenshotFrame._scale(scale) == rounded
+
+
+def test_variants_are_bounded():
+    pytest.importorskip("PIL")
+    frame = ScreenshotFrame(StubScreenshotBackend().capture(), 0)
+    for _ in range(500):
+        frame.variant(random.uniform(0.001, 1), random.choice(["png", "jpeg"]))
+    # 1 bis 1/16 je Format, das Original-PNG wird nicht zwischengespeichert
+    assert len(frame.variants) <= 9
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import base64
+import configparser
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from Drivers import DRIVERS, driver, load
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Feste Ports aus server.cfg und der Simulatoren (BYE, PHD, PHD2)
+PORTS = (8080, 1499, 4300, 4400)
+
+
+def port_in_use(port):
+    s = socket.socket()
+    # Wie CherryPy: Verbindungen im TIME_WAIT eines vorigen Laufs belegen den Port nicht
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        s.bind(("", port))
+    except OSError:
+        return True
+    finally:
+        s.close()
+    return False
+
+
+def test_driver_table():
+    for kind in ('mount', 'screenshot', 'camera', 'guider', 'guider_events', 'solver'):
+        assert 'simulator' in DRIVERS[kind] or 'stub' in DRIVERS[kind]
+        for path in DRIVERS[kind].values():
+            assert isinstance(load(path), type)
+    with pytest.raises(ValueError, match="möglich: bye, simulator"):
+        driver('camera', 'unbekannt', 'localhost', 1499)
+    assert driver('camera', 'bye', 'localhost', 1499, picture_dir=".").start() == 1499
+    assert driver("solver", "astrotortilla", "BDSRun.exe").command == "BDSRun.exe"
+    assert "DeviceSimulators" in driver("solver", "simulator", "BDSRun.exe").command
+
+
+def test_import_is_lazy():
+    code = ("import sys, time\n"
+            "started = time.perf_counter()\n"
+            "import TMWServer\n"
+            "print(time.perf_counter() - started)\n"
+            "print(','.join(m for m in ('astropy', 'win32com', 'rawpy') if m in sys.modules))\n")
+    output = subprocess.run([sys.executable, "-c", code], cwd=SERVER_DIR, stdout=subprocess.PIPE,
+                            check=True).stdout.decode().split("\n")
+    # Gemessen etwa 0,25 s, mit astropy beim Import waren es 0,6 s
+    assert float(output[0]) < 1.5
+    assert output[1] == ""
+
+
+def test_simulate_starts_quickly(tmp_path):
+    busy = [port for port in PORTS if port_in_use(port)]
+    if busy:
+        pytest.skip("Ports belegt: %s" % busy)
+    config = configparser.ConfigParser()
+    config.read(os.path.join(SERVER_DIR, "config.cfg"))
+    for key, name in (("NameCacheFile", "name_cache.json"), ("FrameDatabase", "frames.db"),
+                      ("PreviewCache", "previews"), ("CallbackDatabase", "callbacks.db")):
+        config.set("Settings", key, str(tmp_path / name))
+    config.set("Settings", "IngestDir", "")
+    path = str(tmp_path / "config.cfg")
+    with open(path, "w") as f:
+        config.write(f)
+
+    started = time.time()
+    process = subprocess.Popen([sys.executable, "TMWServer.py", "--simulate", "--config", path], cwd=SERVER_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while not port_in_use(8080):
+            assert process.poll() is None, "Server beendet"
+            assert time.time() - started < 10, "Server lauscht nicht"
+            time.sleep(0.02)
+        # Gemessen etwa 0,3 s bis der Server lauscht
+        assert time.time() - started < 5
+
+        auth = "Basic " + base64.b64encode(b"tmw:" + config.get("Settings", "ServerChallenge").encode()).decode()
+
+        def get(route):
+            request = urllib.request.Request("http://127.0.0.1:8080" + route, headers={'Authorization': auth})
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.loads(response.read().decode())
+
+        assert get("/bye_status") == {'status': True, 'message': "idle"}
+        assert get("/phd_status")['status']
+        deadline = time.time() + 5
+        while not get("/phd_stats")['stats']['connected']:
+            assert time.time() < deadline
+            time.sleep(0.1)
+    finally:
+        process.terminate()
+        process.wait(30)